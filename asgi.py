@@ -0,0 +1,18 @@
+"""
+ASGI entry point:
+
+    uvicorn asgi:application --host 0.0.0.0 --port $PORT --workers 2
+
+The Flask app runs on a pool of ASGI_THREADS threads (default 200) instead of one request per
+sync gunicorn worker, so a process can hold hundreds of page views that are waiting on Fyers
+or Google. The stock, candles and news views are async and fetch their upstream data
+concurrently on an event loop (utils/async_client.py). Raise DB_POOL_SIZE to match the load;
+the sync `gunicorn main:app` mode is unchanged.
+"""
+import os
+from a2wsgi import WSGIMiddleware
+from main import app
+
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", "200"))
+
+application = WSGIMiddleware(app, workers=ASGI_THREADS)
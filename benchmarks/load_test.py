@@ -0,0 +1,224 @@
+"""
+Load test for the main pages against the local stand-in server.
+
+Starts benchmarks/stub_server.py and the app in-process on a scratch DATA_DIR and database,
+seeds users with large ledgers, then drives /stocks, /portfolio, /transactions, /candles and
+buy/sell from concurrent virtual users and reports throughput and p50/p99 latency per endpoint:
+
+    python -m benchmarks.load_test --users 20 --ledger-size 2000 --concurrency 16 --duration 30
+    python -m benchmarks.load_test --db-uri postgresql+psycopg://... --latency-ms 40 --json bench.json
+"""
+import argparse, json, logging, os, random, shutil, sys, tempfile, threading, time
+from datetime import datetime, timedelta
+from decimal import Decimal
+import requests
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.abspath(os.path.join(BASE_DIR, ".."))
+SOURCE_DATA_DIR = os.path.join(REPO_DIR, "Data")
+PASSWORD = "bench-password"
+
+# (name, weight) of each virtual-user action
+SCENARIOS = [
+    ("stocks", 30),
+    ("portfolio", 20),
+    ("transactions", 15),
+    ("candles", 15),
+    ("buy", 10),
+    ("sell", 10),
+]
+
+
+def prepare_environment(args, stub_port):
+    """Points the app at a scratch data dir, database and the stub before main is imported."""
+    workdir = tempfile.mkdtemp(prefix="suwi-bench-")
+    data_dir = os.path.join(workdir, "Data")
+    os.makedirs(data_dir)
+    for name in ("NSE_CM.csv", "NSE_EQ_names.csv", "NSE_EQ_only.csv", "NSE_holidays.csv"):
+        shutil.copy(os.path.join(SOURCE_DATA_DIR, name), data_dir)
+
+    os.environ["DATA_DIR"] = data_dir
+    os.environ["DB_URI"] = args.db_uri or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["FYERS_API_BASE"] = f"http://127.0.0.1:{stub_port}"
+    os.environ["GOOGLE_CSE_URL"] = f"http://127.0.0.1:{stub_port}/customsearch/v1"
+    if not os.getenv("FERNET_KEY"):
+        from cryptography.fernet import Fernet
+        os.environ["FERNET_KEY"] = Fernet.generate_key().decode()
+    return workdir
+
+
+def seed(app, users, ledger_size, symbols, rng):
+    from werkzeug.security import generate_password_hash
+    from utils.models import db, UserData, Transaction
+    from utils.crypto_utils import encrypt
+
+    password_hash = generate_password_hash(PASSWORD, method="pbkdf2:sha256", salt_length=8)
+    with app.app_context():
+        db.create_all()
+        names = []
+        for i in range(users):
+            name = f"bench{i}"
+            names.append(name)
+            db.session.add(UserData(
+                user=name,
+                password=password_hash,
+                email=encrypt(f"{name}@example.com"),
+                fyers_client_id=encrypt("STUB-100"),
+                fyers_secret_key=encrypt("stub-secret"),
+                fyers_refresh_token=encrypt("stub-refresh"),
+                google_api_key=encrypt("stub-key"),
+                cx=encrypt("stub-cx"),
+                balance=Decimal("100000000"),
+            ))
+        db.session.commit()
+
+        start = datetime.now() - timedelta(days=ledger_size)
+        for name in names:
+            held = {}
+            rows = []
+            for n in range(ledger_size):
+                symbol = rng.choice(symbols)
+                price = Decimal(rng.randint(100, 5000))
+                qty = Decimal(rng.randint(1, 50))
+                if held.get(symbol, 0) >= qty and rng.random() < 0.3:
+                    txn_type, held[symbol] = "SELL", held[symbol] - qty
+                else:
+                    txn_type, held[symbol] = "BUY", held.get(symbol, 0) + qty
+                rows.append({
+                    "txn_id": f"{name}-{n}",
+                    "user_id": name,
+                    "symbol": symbol,
+                    "name": symbol,
+                    "type": txn_type,
+                    "quantity": qty,
+                    "execution_price": price,
+                    "total_value": qty * price,
+                    "timestamp": start + timedelta(minutes=n),
+                    "remarks": "seed",
+                    "realised_pnl": Decimal("0") if txn_type == "SELL" else None,
+                })
+            db.session.execute(db.insert(Transaction), rows)
+            db.session.commit()
+    return names
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def virtual_user(base_url, user, symbols, deadline, results, rng):
+    session = requests.Session()
+    session.post(f"{base_url}/login", data={"user": user, "password": PASSWORD})
+    names = [name for name, _ in SCENARIOS]
+    weights = [weight for _, weight in SCENARIOS]
+
+    while time.time() < deadline:
+        action = rng.choices(names, weights)[0]
+        symbol = rng.choice(symbols)
+        if action == "stocks":
+            call = lambda: session.get(f"{base_url}/stocks")
+        elif action == "portfolio":
+            call = lambda: session.get(f"{base_url}/portfolio")
+        elif action == "transactions":
+            call = lambda: session.get(f"{base_url}/transactions")
+        elif action == "candles":
+            call = lambda: session.get(f"{base_url}/candles/{symbol}", params={"range": rng.choice(["1M", "6M", "1Y"])})
+        else:
+            call = lambda: session.post(f"{base_url}/{action}/{symbol}", data={"quantity": "1", "remarks": "bench"},
+                                        allow_redirects=False)
+
+        start = time.perf_counter()
+        try:
+            resp = call()
+            ok = resp.status_code < 400
+        except requests.RequestException:
+            ok = False
+        results.append((action, time.perf_counter() - start, ok))
+
+
+def report(results, duration):
+    summary = {}
+    for action, _ in SCENARIOS:
+        latencies = sorted(l for a, l, _ in results if a == action)
+        errors = sum(1 for a, _, ok in results if a == action and not ok)
+        summary[action] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "rps": round(len(latencies) / duration, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        }
+    all_latencies = sorted(l for _, l, _ in results)
+    summary["total"] = {
+        "requests": len(results),
+        "errors": sum(1 for *_, ok in results if not ok),
+        "rps": round(len(results) / duration, 2),
+        "p50_ms": round(percentile(all_latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(all_latencies, 99) * 1000, 2),
+    }
+
+    print(f"{'endpoint':<14}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, row in summary.items():
+        print(f"{name:<14}{row['requests']:>10}{row['errors']:>8}{row['rps']:>10}{row['p50_ms']:>10}{row['p99_ms']:>10}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test against the local Fyers/Google stand-in")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--ledger-size", type=int, default=1000, help="transactions seeded per user")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20, help="seconds")
+    parser.add_argument("--latency-ms", type=float, default=20, help="stub upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--db-uri", help="defaults to a scratch SQLite file")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the summary to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    from benchmarks.stub_server import create_stub_app, load_universe, serve_in_thread
+
+    rng = random.Random(args.seed)
+    symbols = load_universe()
+    stub = serve_in_thread(create_stub_app(args.latency_ms, args.jitter_ms, args.error_rate, symbols, args.seed))
+    workdir = prepare_environment(args, stub.port)
+
+    import main as web
+    web.app.config["WTF_CSRF_ENABLED"] = False
+    users = seed(web.app, args.users, args.ledger_size, symbols[:50], rng)
+    server = serve_in_thread(web.app)
+    base_url = f"http://127.0.0.1:{server.port}"
+
+    results = []
+    deadline = time.time() + args.duration
+    threads = [
+        threading.Thread(target=virtual_user,
+                         args=(base_url, users[i % len(users)], symbols[:50], deadline, results, random.Random(args.seed + i)))
+        for i in range(args.concurrency)
+    ]
+    started = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    summary = report(results, time.time() - started)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    server.shutdown()
+    stub.shutdown()
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
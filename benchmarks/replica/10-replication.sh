@@ -0,0 +1,3 @@
+#!/bin/bash
+# Allow the standby to stream WAL from the primary.
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -0,0 +1,42 @@
+"""
+File-based stand-in for a lagging read replica when running on SQLite.
+
+Copies the primary database file to the replica file every --lag seconds with SQLite's online
+backup API, so reads routed to DB_REPLICA_URI see data that is up to --lag seconds old:
+
+    DB_URI=sqlite:////tmp/primary.db DB_REPLICA_URI=sqlite:////tmp/replica.db flask --app main init-db
+    python -m benchmarks.replica_sync /tmp/primary.db /tmp/replica.db --lag 5
+    DB_URI=sqlite:////tmp/primary.db DB_REPLICA_URI=sqlite:////tmp/replica.db flask --app main run
+
+For a real streaming replica use benchmarks/replica/docker-compose.yml.
+"""
+import argparse, sqlite3, time
+
+
+def sync_once(primary, replica):
+    src = sqlite3.connect(primary)
+    dst = sqlite3.connect(replica)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Periodically copy a SQLite primary to a replica file")
+    parser.add_argument("primary")
+    parser.add_argument("replica")
+    parser.add_argument("--lag", type=float, default=5, help="seconds between copies")
+    parser.add_argument("--once", action="store_true")
+    args = parser.parse_args()
+
+    while True:
+        sync_once(args.primary, args.replica)
+        if args.once:
+            return
+        time.sleep(args.lag)
+
+
+if __name__ == "__main__":
+    main()
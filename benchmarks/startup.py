@@ -0,0 +1,93 @@
+"""
+Worker startup benchmark: import time of main.py and time to first response.
+
+Each run spawns a fresh interpreter (like a gunicorn worker boot or a Render cold start),
+imports the app and serves GET /login through the WSGI stack:
+
+    python -m benchmarks.startup --runs 10
+    python -m benchmarks.startup --runs 5 --importtime   # also list the slowest imports
+"""
+import argparse, json, os, statistics, subprocess, sys, tempfile, time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.abspath(os.path.join(BASE_DIR, ".."))
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+response = main.app.test_client().get("/login")
+served = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - start,
+    "first_response_s": served - start,
+    "status": response.status_code,
+    "heavy_modules": [m for m in ("pandas", "fyers_apiv3", "numpy") if m in sys.modules],
+}))
+"""
+
+
+def child_env():
+    env = dict(os.environ)
+    env.setdefault("DB_URI", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'suwi-startup.db')}")
+    if not env.get("FERNET_KEY"):
+        from cryptography.fernet import Fernet
+        env["FERNET_KEY"] = Fernet.generate_key().decode()
+    return env
+
+
+def run_once(env):
+    spawned = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", CHILD], cwd=REPO_DIR, env=env,
+                         capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["process_s"] = time.perf_counter() - spawned
+    return result
+
+
+def slowest_imports(env, top=15):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=REPO_DIR, env=env,
+                         capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "").split("|")]
+        rows.append((int(cumulative_us), int(self_us), name))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app import time and time-to-first-response")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", action="store_true", help="print the slowest imports")
+    parser.add_argument("--json", help="write the summary to this file")
+    args = parser.parse_args()
+
+    env = child_env()
+    results = [run_once(env) for _ in range(args.runs)]
+
+    summary = {"runs": args.runs, "heavy_modules_at_boot": results[-1]["heavy_modules"]}
+    for key in ("import_s", "first_response_s", "process_s"):
+        values = [r[key] for r in results]
+        summary[key] = {"median": round(statistics.median(values), 4), "max": round(max(values), 4)}
+
+    print(f"{'metric':<20}{'median ms':>12}{'max ms':>12}")
+    for key in ("import_s", "first_response_s", "process_s"):
+        print(f"{key:<20}{summary[key]['median'] * 1000:>12.1f}{summary[key]['max'] * 1000:>12.1f}")
+    print("heavy modules loaded at boot:", ", ".join(summary["heavy_modules_at_boot"]) or "none")
+
+    if args.importtime:
+        print(f"\n{'cumulative ms':>14}{'self ms':>10}  module")
+        for cumulative, self_us, name in slowest_imports(env):
+            print(f"{cumulative / 1000:>14.1f}{self_us / 1000:>10.1f}  {name}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
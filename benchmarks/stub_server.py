@@ -0,0 +1,196 @@
+"""
+Local stand-in for the Fyers and Google Custom Search APIs.
+
+Serves the endpoints the app uses (quotes, history, token refresh / auth code and
+custom search) with configurable latency, error rate and symbol universe, so the app
+can be load-tested without touching the real broker:
+
+    python -m benchmarks.stub_server --port 8765 --latency-ms 40 --error-rate 0.01
+    FYERS_API_BASE=http://127.0.0.1:8765 GOOGLE_CSE_URL=http://127.0.0.1:8765/customsearch/v1 python main.py
+"""
+import argparse, os, random, time, zlib
+from datetime import datetime
+import pandas as pd
+from flask import Flask, request, jsonify
+from werkzeug.serving import make_server
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SYMBOLS_FILE = os.path.join(BASE_DIR, "../Data/NSE_EQ_only.csv")
+
+RESOLUTION_SECONDS = {"D": 86400, "1D": 86400}
+INDEX_SYMBOLS = ["NSE:NIFTY50-INDEX"]  # benchmark for the portfolio risk page
+
+
+def load_universe(symbols_file=None, universe=None):
+    """Symbols from a CSV with a "symbol" column, or `universe` synthetic NSE:STUBn-EQ names."""
+    if universe:
+        return [f"NSE:STUB{i}-EQ" for i in range(universe)]
+    df = pd.read_csv(symbols_file or DEFAULT_SYMBOLS_FILE)
+    return df["symbol"].tolist()
+
+
+def base_price(symbol):
+    return 50 + zlib.crc32(symbol.encode()) % 4950
+
+
+def make_quote(symbol, now):
+    # Deterministic per (symbol, minute) so repeated calls inside a minute agree.
+    rng = random.Random(f"{symbol}:{int(now // 60)}")
+    prev_close = base_price(symbol)
+    lp = round(prev_close * (1 + rng.uniform(-0.04, 0.04)), 2)
+    open_price = round(prev_close * (1 + rng.uniform(-0.01, 0.01)), 2)
+    high = round(max(lp, open_price) * (1 + rng.uniform(0, 0.01)), 2)
+    low = round(min(lp, open_price) * (1 - rng.uniform(0, 0.01)), 2)
+    spread = round(rng.uniform(0.05, 1.0), 2)
+    return {
+        "n": symbol,
+        "s": "ok",
+        "v": {
+            "symbol": symbol,
+            "short_name": symbol[4:].split("-")[0],
+            "exchange": "NSE",
+            "lp": lp,
+            "prev_close_price": prev_close,
+            "open_price": open_price,
+            "high_price": high,
+            "low_price": low,
+            "ch": round(lp - prev_close, 2),
+            "chp": round((lp - prev_close) / prev_close * 100, 2),
+            "ask": round(lp + spread / 2, 2),
+            "bid": round(lp - spread / 2, 2),
+            "spread": spread,
+            "volume": rng.randint(1_000, 5_000_000),
+            "tt": int(now),
+        },
+    }
+
+
+def make_candles(symbol, start, end, step):
+    candles = []
+    price = base_price(symbol)
+    rng = random.Random(f"{symbol}:{step}")
+    ts = start - start % step
+    while ts <= end:
+        if step < 86400:
+            # intraday candles only inside the 09:15-15:30 IST session
+            in_session = 33300 <= (ts + 19800) % 86400 < 55800
+        else:
+            in_session = datetime.fromtimestamp(ts).weekday() < 5
+        if in_session:
+            o = price
+            c = round(o * (1 + rng.gauss(0, 0.015)), 2)
+            h = round(max(o, c) * (1 + abs(rng.gauss(0, 0.005))), 2)
+            l = round(min(o, c) * (1 - abs(rng.gauss(0, 0.005))), 2)
+            candles.append([ts, o, h, l, c, rng.randint(1_000, 1_000_000)])
+            price = c
+        ts += step
+    return candles
+
+
+def parse_range(value, date_format):
+    if date_format == "1":
+        return int(datetime.strptime(value, "%Y-%m-%d").timestamp())
+    return int(value)
+
+
+def create_stub_app(latency_ms=0, jitter_ms=0, error_rate=0.0, symbols=None, seed=None):
+    app = Flask(__name__)
+    universe = set(symbols or load_universe()) | set(INDEX_SYMBOLS)
+    rng = random.Random(seed)
+
+    def simulate():
+        """Sleeps for the configured latency; returns an error response or None."""
+        delay = max(0.0, latency_ms + rng.uniform(-jitter_ms, jitter_ms)) / 1000
+        if delay:
+            time.sleep(delay)
+        if error_rate and rng.random() < error_rate:
+            return jsonify({"s": "error", "code": 429, "message": "request limit reached"}), 429
+        return None
+
+    @app.route("/data/quotes")
+    def quotes():
+        error = simulate()
+        if error:
+            return error
+        now = time.time()
+        d = []
+        for symbol in request.args.get("symbols", "").split(","):
+            if symbol in universe:
+                d.append(make_quote(symbol, now))
+            elif symbol:
+                d.append({"n": symbol, "s": "error", "v": {"errmsg": "invalid symbol"}})
+        return jsonify({"s": "ok", "code": 200, "d": d})
+
+    @app.route("/data/history")
+    def history():
+        error = simulate()
+        if error:
+            return error
+        symbol = request.args.get("symbol")
+        if symbol not in universe:
+            return jsonify({"s": "error", "code": -300, "message": "invalid symbol"})
+        date_format = request.args.get("date_format", "0")
+        start = parse_range(request.args["range_from"], date_format)
+        end = parse_range(request.args["range_to"], date_format)
+        if date_format == "1":
+            end += 86399
+        resolution = request.args.get("resolution", "1D")
+        step = RESOLUTION_SECONDS.get(resolution) or int(resolution) * 60
+        return jsonify({"s": "ok", "code": 200, "candles": make_candles(symbol, start, end, step)})
+
+    @app.route("/api/v3/validate-refresh-token", methods=["POST"])
+    @app.route("/api/v3/validate-authcode", methods=["POST"])
+    def tokens():
+        error = simulate()
+        if error:
+            return error
+        return jsonify({
+            "s": "ok",
+            "code": 200,
+            "access_token": f"stub-access-{int(time.time())}",
+            "refresh_token": "stub-refresh",
+        })
+
+    @app.route("/customsearch/v1")
+    def custom_search():
+        error = simulate()
+        if error:
+            return error
+        q = request.args.get("q", "")
+        return jsonify({"items": [
+            {"title": f"{q} news #{i}", "link": f"https://example.com/{i}", "snippet": f"Stub article {i} about {q}"}
+            for i in range(10)
+        ]})
+
+    return app
+
+
+def serve_in_thread(app, host="127.0.0.1", port=0):
+    """Starts `app` on a background thread; returns the server (server.port, server.shutdown())."""
+    import threading
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Fyers / Google stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--symbols-file", help="CSV with a 'symbol' column (default Data/NSE_EQ_only.csv)")
+    parser.add_argument("--universe", type=int, help="use N synthetic symbols instead of a CSV")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    stub = create_stub_app(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        symbols=load_universe(args.symbols_file, args.universe),
+        seed=args.seed,
+    )
+    print(f"Stub Fyers/Google server on http://{args.host}:{args.port}")
+    make_server(args.host, args.port, stub, threaded=True).serve_forever()
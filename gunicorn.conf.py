@@ -0,0 +1,33 @@
+import os, shutil
+
+# Prometheus multiprocess mode: workers share metric samples through files in this directory.
+# It must be set before any worker imports prometheus_client, and wiped on every master start.
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(os.getenv("TMPDIR", "/tmp"), "suwi_prometheus")
+)
+
+# Structured logs: one listener in the master writes the JSON log file for every worker.
+# Started here so that it exists before --preload imports the app and before any fork.
+from utils.logs import start_listener
+start_listener(shared=True)
+
+
+def on_starting(server):
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    # With --preload the app is imported once in the master; make sure no pooled DB
+    # connection created there is shared with the forked workers.
+    import sys
+    main = sys.modules.get("main")
+    if main is not None:
+        with main.app.app_context():
+            for engine in main.db.engines.values():
+                engine.dispose(close=False)
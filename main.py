@@ -1,22 +1,49 @@
-from datetime import datetime, time
 import os
+import click
+from contextlib import contextmanager
+from urllib.parse import urlencode
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
 from flask_wtf import FlaskForm
-from wtforms import DecimalField, SubmitField, StringField, PasswordField, SelectField
+from wtforms import DecimalField, SubmitField, StringField, PasswordField, SelectField, IntegerField
 from flask_bootstrap import Bootstrap5
-from wtforms.validators import InputRequired, NumberRange
+from wtforms.validators import InputRequired, NumberRange, Optional
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import login_user, LoginManager, login_required, current_user, logout_user
 from decimal import Decimal
-from utils.models import db, UserData, Transaction
-from utils.stock_utils import get_data, get_database, search, calculate_portfolio, get_historic_data, get_prices_bulk, get_quantity_held
+from sqlalchemy.orm import load_only
+from utils.models import db, UserData, Transaction, PriceAlert, Notification, LedgerSummary, Strategy
+from utils.stock_utils import get_data, get_database, calculate_portfolio, get_prices_bulk, get_quantity_held, \
+    get_fyers_client, market_data_available, get_equity_symbols, on_quote_refresh, get_database_snapshot
 from utils.api_client import get_auth_code, exchange_auth_code_for_tokens
 from utils.crypto_utils import encrypt
-import pytz
+from utils.replay import replay_enabled, record_session
+from utils.async_client import get_stock_page_data, get_historic_data_only, search_only
+from utils.metrics import init_metrics
+from utils.logs import init_logging
+from utils.resilience import FYERS_BREAKER, UpstreamUnavailable
+from utils.market_calendar import market_status
+from utils.profiling import init_profiling
+from utils.replica import init_replica, read_only
+from utils.fragments import cached_fragment
+from utils.compression import init_compression
+from utils.lots import lot_method, set_lot_method, rebuild_lots, open_lots, realised_by_term, \
+    METHODS
+from utils.archive import archive_ledger, archived_transactions, partition_ledger, ensure_partitions, \
+    COLUMNS as ARCHIVE_COLUMNS, LEDGER_HOT_MONTHS
+from utils.alerts import evaluate_alerts, create_alert, delete_alert, unread_count, FIELDS
+from utils.risk import portfolio_risk, RISK_BENCHMARK
+from utils.backfill import run_backfill, universe_symbols, UNIVERSES, BACKFILL_YEARS
+from utils.leaderboard import get_leaderboard, update_leaderboard_prices, METRICS
+from utils.orders import execute_order, commit_orders, OrderRejected
+from utils.strategies import strategy_params, strategy_symbols, create_strategy, user_strategy, run_strategies, \
+    KINDS as STRATEGY_KINDS, STRATEGY_TICK_SECONDS, STRATEGY_WORKERS
+from utils.watchlists import watchlist_symbols, add_to_watchlist, remove_from_watchlist, run_quote_refresher, \
+    QUOTE_REFRESH_SECONDS
 
 #        CONFIG SECTION
 app = Flask(__name__)
 bootstrap = Bootstrap5(app)
+init_compression(app)  # registered first so it runs after every other after_request hook
 
 db_uri = os.getenv("DB_URI")
 if not db_uri:
@@ -28,11 +55,17 @@ app.config["SQLALCHEMY_DATABASE_URI"] = db_uri
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_pre_ping": True,     # detects dead connections
     "pool_recycle": 280,       # seconds (Render kills idle conns ~300s)
-    "pool_size": 5,
-    "max_overflow": 5,
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "5")),
 }
 app.config["SECRET_KEY"] = os.getenv("FLASK_SECRET_KEY", "dev-secret")
+init_replica(app, app.config["SQLALCHEMY_ENGINE_OPTIONS"])
 db.init_app(app)
+init_logging(app)
+init_metrics(app)
+init_profiling(app)
+on_quote_refresh(update_leaderboard_prices)
+on_quote_refresh(evaluate_alerts)
 
 #LOGIN CODE
 login_manager = LoginManager()
@@ -42,10 +75,20 @@ login_manager.login_view = 'login'
 #user loader callback
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(UserData, str(user_id))
+    # Only what auth, the navbar and balance checks need; credentials load on demand.
+    return db.session.get(
+        UserData, str(user_id),
+        options=[load_only(UserData.user, UserData.balance, UserData.fyers_connected)],
+    )
 
-with app.app_context():
+@app.cli.command("init-db")
+def init_db():
+    """Create missing tables. Run once per deploy instead of on every worker boot."""
     db.create_all()
+    click.echo("Database schema is up to date.")
+
+
+STOCK_SORT_FIELDS = ("volume", "chp", "lp", "trend")
 
 
 # login form
@@ -84,6 +127,58 @@ class BalanceForm(FlaskForm):
     action = SelectField("Action", choices=[("ADD", "Add Balance"), ("SUB", "Withdraw Funds")], validators=[InputRequired()])
     submit = SubmitField("Confirm")
 
+class LotMethodForm(FlaskForm):
+    method = SelectField("Cost Basis Method", choices=list(METHODS.items()), validators=[InputRequired()])
+    submit = SubmitField("Save & Rebuild Lots")
+
+class AlertForm(FlaskForm):
+    symbol = StringField("Symbol (e.g. NSE:SBIN-EQ)", validators=[InputRequired()])
+    field = SelectField("When", choices=list(FIELDS.items()), validators=[InputRequired()])
+    direction = SelectField("Goes", choices=[("ABOVE", "Above"), ("BELOW", "Below")], validators=[InputRequired()])
+    threshold = DecimalField("Threshold", validators=[InputRequired()], places=2)
+    submit = SubmitField("Create Alert")
+
+class WatchlistForm(FlaskForm):
+    symbol = StringField("Symbol (e.g. NSE:SBIN-EQ)", validators=[InputRequired()])
+    submit = SubmitField("Add to Watchlist")
+
+class StrategyForm(FlaskForm):
+    name = StringField("Name", validators=[InputRequired()])
+    kind = SelectField("Strategy", choices=list(STRATEGY_KINDS.items()), validators=[InputRequired()])
+    symbols = StringField("Symbol (SMA) or weights (Rebalance, e.g. NSE:SBIN-EQ=0.6, NSE:ITC-EQ=0.4)",
+                          validators=[InputRequired()])
+    fast = IntegerField("Fast SMA (days)", default=20, validators=[Optional(), NumberRange(min=1)])
+    slow = IntegerField("Slow SMA (days)", default=50, validators=[Optional(), NumberRange(min=2)])
+    quantity = DecimalField("Quantity to hold (SMA)", validators=[Optional(), NumberRange(min=1)], places=0)
+    capital = DecimalField("Capital ₹ (Rebalance)", validators=[Optional(), NumberRange(min=1)], places=2)
+    band = DecimalField("Drift band % (Rebalance)", default=5, validators=[Optional(), NumberRange(min=0, max=100)])
+    interval = IntegerField("Run every (minutes)", default=15, validators=[InputRequired(), NumberRange(min=1)])
+    submit = SubmitField("Create Strategy")
+
+
+@app.context_processor
+def inject_notifications():
+    if current_user.is_authenticated:
+        return {"unread_notifications": unread_count(current_user.user)}
+    return {"unread_notifications": 0}
+
+
+@app.context_processor
+def inject_market_status():
+    return {"market_status": FYERS_BREAKER.status()}
+
+
+def quote_unavailable(data, symbol, endpoint):
+    """Flashes why a trade can't go ahead (no price, or only a stale one) and returns the redirect."""
+    if data is None:
+        flash("No price is available for this stock right now. Please try again shortly.", "error")
+        return redirect(url_for("database"))
+    if data["v"].get("stale"):
+        flash("Live prices are unavailable (the broker is not responding), so trading is paused. "
+              "Please try again shortly.", "error")
+        return redirect(url_for(endpoint, symbol=symbol))
+    return None
+
 
 @app.route("/login", methods = ["GET", "POST"])
 def login():
@@ -187,42 +282,106 @@ def home():
 
 
 @app.route("/stocks", methods=["GET", "POST"])
+@read_only
 @login_required
 def database():
     online = False
     sort_by = request.args.get("sort_by")
     order = request.args.get("order", "desc")  # default descending
-    data = get_database()
-    if not data:
+    if sort_by not in STOCK_SORT_FIELDS:
+        sort_by = None
+    if order not in ("asc", "desc"):
+        order = "desc"
+
+    data, version = get_database_snapshot()
+    if data is None:
         flash(f"Please connect Fyers first")
         return redirect(url_for("get_code"))
+    if not data:
+        # Connected, but the broker is unavailable (circuit open / rate limited) and nothing is cached.
+        flash("Live prices are unavailable (the broker is not responding) and none are cached yet. "
+              "Please try again shortly.", "error")
+
+    def table_context():
+        if sort_by:
+            reverse = True if order == "desc" else False
+
+            if sort_by == "trend":
+                # Bullish first
+                data.sort(key=lambda x: 0 if x["v"].get("trend") == "Bullish" else 1, reverse=reverse)
+            else:
+                data.sort(key=lambda x: x["v"].get(sort_by, 0) or 0, reverse=reverse)
+        current_query = urlencode({"sort_by": sort_by, "order": order}) if sort_by else ""
+        return {"all_stocks": data, "current_query": current_query}
+
+    # The table is the same for every user, so it is rendered once per quote snapshot and sort order.
+    stock_table = cached_fragment("_stock_table.html", version, (sort_by, order), table_context) \
+        if data else ""
+
+    market = market_status()
+    if market["state"] == "open" or replay_enabled():
+        online = True
+    return render_template("database.html", stock_table=stock_table, sort_by=sort_by, order=order,
+                           logged_in= current_user.is_authenticated, status = online, market=market)
 
-    if sort_by:
-        reverse = True if order == "desc" else False
 
-        if sort_by == "trend":
-            # Bullish first
-            data.sort(key=lambda x: 0 if x["v"].get("trend") == "Bullish" else 1, reverse=reverse)
-        else:
-            data.sort(key=lambda x: x["v"].get(sort_by, 0) or 0, reverse=reverse)
+def watch(symbol):
+    """Adds symbol to the current user's watchlist and flashes the outcome."""
+    symbol = symbol.strip().upper()
+    if symbol not in get_equity_symbols():
+        flash("Unknown symbol.")
+        return
+    try:
+        added = add_to_watchlist(current_user.user, symbol)
+    except ValueError as e:
+        flash(str(e))
+        return
+    flash(f"{symbol} added to your watchlist." if added else f"{symbol} is already on your watchlist.")
 
-    now = datetime.now(pytz.timezone("Asia/Kolkata"))
-    is_weekday = now.weekday() < 5
-    is_market_time = time(9, 15) <= now.time() <= time(15, 30)
 
-    if is_weekday and is_market_time:
-        online = True
-    return render_template("database.html", all_stocks=data, sort_by=sort_by, order=order, logged_in= current_user.is_authenticated, status = online)
+@app.route("/watchlist", methods=["GET", "POST"])
+@login_required
+def watchlist():
+    form = WatchlistForm()
+    if request.method == "POST" and form.validate_on_submit():
+        watch(form.symbol.data)
+        return redirect(url_for("watchlist"))
+
+    # Only the watched symbols are quoted: a cache lookup, or one small Fyers call.
+    symbols = watchlist_symbols(current_user.user)
+    data = []
+    if symbols:
+        data = get_database(symbols)
+        if data is None:
+            flash(f"Please connect Fyers first")
+            return redirect(url_for("get_code"))
+    return render_template("watchlist.html", form=form, all_stocks=data, symbols=symbols, current_query="",
+                           logged_in=True)
+
+
+@app.route("/watchlist/<symbol>/add", methods=["POST"])
+@login_required
+def add_watch(symbol):
+    watch(symbol)
+    return redirect(url_for("stock_info", symbol=symbol))
+
+
+@app.route("/watchlist/<symbol>/remove", methods=["POST"])
+@login_required
+def remove_watch(symbol):
+    remove_from_watchlist(current_user.user, symbol)
+    return redirect(url_for("watchlist"))
 
 
 @app.route("/stock/<symbol>")
 @login_required
-def stock_info(symbol):
-    data = get_data(symbol)
+async def stock_info(symbol):
+    # quote, news and history are fetched concurrently
+    data, news, historic = await get_stock_page_data(symbol, "1M")
 
-    news_data = search(symbol)["items"]
+    news_data = news.get("items", [])
 
-    historic_data = get_historic_data(symbol, "1M")["candles"]
+    historic_data = historic["candles"]
 
     return render_template("stock.html", stock=data,
                            logged_in= current_user.is_authenticated,
@@ -235,28 +394,19 @@ def stock_info(symbol):
 def buy(symbol):
     form = BuySellForm()
     data = get_data(symbol)
+    if data is None:
+        return quote_unavailable(data, symbol, "buy")
     qty_held = get_quantity_held(symbol)
     if request.method == "POST" and form.validate():
-        qty = form.quantity.data
-        ltp = Decimal(str(data["v"]["lp"]))
-        txn_val = qty * ltp
-        if txn_val > current_user.balance:
-            flash(f"Your balance is not enough for this transaction", "error")
-            return redirect(url_for("buy", symbol =symbol))
-        new_transaction = Transaction(
-            user_id = current_user.user,
-            symbol=symbol,
-            name=data["v"]["name"],
-            type="BUY",
-            quantity=qty,
-            execution_price=ltp,
-            total_value=txn_val,
-            remarks=form.remarks.data,
-        )
-
-        current_user.balance -= txn_val
-        db.session.add(new_transaction)
-        db.session.commit()
+        if data["v"].get("stale"):
+            return quote_unavailable(data, symbol, "buy")
+        try:
+            transaction = execute_order(current_user, "BUY", symbol, data["v"]["name"], form.quantity.data,
+                                        data["v"]["lp"], form.remarks.data)
+        except OrderRejected as e:
+            flash(str(e), "error")
+            return redirect(url_for("buy", symbol=symbol))
+        commit_orders([transaction])
         next_page = request.args.get("next")
         return redirect(next_page or url_for("database"))
     return render_template("buy-sell.html", balance = current_user.balance, stock=data, form=form,
@@ -268,38 +418,19 @@ def buy(symbol):
 def sell(symbol):
     form = BuySellForm()
     data = get_data(symbol)
+    if data is None:
+        return quote_unavailable(data, symbol, "sell")
     qty_held = get_quantity_held(symbol)
     if request.method == "POST" and form.validate():
-        qty = Decimal(str(form.quantity.data))
-        ltp = Decimal(str(data["v"]["lp"]))
-
-        if ltp == 0 or ltp == None:
-            flash("Invalid quantity", "danger")
-            return redirect(url_for("sell", symbol=symbol))
-
-        txn_val = qty * ltp
-        portfolio = calculate_portfolio()
-        position = next((p for p in portfolio if p["symbol"] == symbol), None)
-        if not position or position["quantity"] < qty:
-            flash("You do not have enough quantity to sell.")
+        if data["v"].get("stale"):
+            return quote_unavailable(data, symbol, "sell")
+        try:
+            transaction = execute_order(current_user, "SELL", symbol, data["v"]["name"], form.quantity.data,
+                                        data["v"]["lp"], form.remarks.data)
+        except OrderRejected as e:
+            flash(str(e), "error")
             return redirect(url_for("sell", symbol=symbol))
-        avg_cost = Decimal(position["avg_price"])
-        realised_pnl = (ltp - avg_cost) * qty
-
-        new_transaction = Transaction(
-            user_id= current_user.user,
-            symbol=symbol,
-            name=data["v"]["name"],
-            type="SELL",
-            quantity=qty,
-            execution_price=ltp,
-            total_value=txn_val,
-            realised_pnl=realised_pnl,
-            remarks=form.remarks.data,
-        )
-        current_user.balance += txn_val
-        db.session.add(new_transaction)
-        db.session.commit()
+        commit_orders([transaction])
         next_page = request.args.get("next")
         return redirect(next_page or url_for("database"))
     return render_template("buy-sell.html", balance = current_user.balance, stock=data, form=form,
@@ -308,60 +439,73 @@ def sell(symbol):
 
 @app.route("/news", methods=["GET", "POST"])
 @login_required
-def get_news():
+async def get_news():
     form = GetNewsForm()
     if request.method == "POST":
         query = form.query.data
-        data = search(query)["items"]
+        data = (await search_only(query)).get("items", [])
         return render_template("news.html", data=data, form=form, logged_in= current_user.is_authenticated)
     return render_template("news.html", form=form, logged_in= current_user.is_authenticated)
 
 
 @app.route("/transactions")
+@read_only
 @login_required
 def transactions():
+    show_archived = request.args.get("archived") == "1"
     results = db.session.execute(
         db.select(Transaction)
         .where(Transaction.user_id == current_user.user)
         .order_by(Transaction.timestamp.desc())
-    ).scalars()
+    ).scalars().all()
+    rows = [{c: getattr(tx, c) for c in ARCHIVE_COLUMNS} for tx in results]
+    if show_archived:
+        rows.extend(dict(tx, archived=True) for tx in reversed(archived_transactions(current_user.user)))
 
     transaction_data = []
-    total_realised_pnl = Decimal("0.00")
-    symbols = {tx.symbol for tx in results}
+    # Realised P&L of archived periods is carried forward in the ledger summaries.
+    total_realised_pnl = Decimal(str(db.session.execute(
+        db.select(db.func.coalesce(db.func.sum(LedgerSummary.realised_pnl), 0))
+        .where(LedgerSummary.user_id == current_user.user)
+    ).scalar()))
+    symbols = {tx["symbol"] for tx in rows}
     price_map = {}
 
-    if current_user.fyers_connected and symbols:
+    if market_data_available() and symbols:
         price_map = get_prices_bulk(list(symbols))
 
-    for tx in results:
-        current_price = price_map.get(tx.symbol)
+    for tx in rows:
+        current_price = price_map.get(tx["symbol"])
 
-        pnl = tx.realised_pnl if tx.type == "SELL" else Decimal("0.00")
-        total_realised_pnl += pnl
+        pnl = tx["realised_pnl"] if tx["type"] == "SELL" else Decimal("0.00")
+        if not tx.get("archived"):
+            total_realised_pnl += pnl
 
         transaction_data.append({
-            "txn_id": tx.txn_id,
-            "symbol": tx.symbol,
-            "type": tx.type,
-            "quantity": tx.quantity,
-            "execution_price": tx.execution_price,
-            "total_value": tx.total_value,
-            "timestamp": tx.timestamp,
-            "remarks": tx.remarks,
+            "txn_id": tx["txn_id"],
+            "symbol": tx["symbol"],
+            "type": tx["type"],
+            "quantity": tx["quantity"],
+            "execution_price": tx["execution_price"],
+            "total_value": tx["total_value"],
+            "timestamp": tx["timestamp"],
+            "remarks": tx["remarks"],
             "pnl": pnl,
             "current_price": current_price,
+            "archived": tx.get("archived", False),
         })
 
     return render_template(
         "transactions.html",
         data=transaction_data,
         total_pnl=total_realised_pnl,
+        show_archived=show_archived,
         logged_in=current_user.is_authenticated,
     )
 
 
 @app.route("/portfolio")
+@read_only
 @login_required
 def portfolio():
     portfolio = calculate_portfolio()
@@ -372,7 +516,7 @@ def portfolio():
     symbols = [p["symbol"] for p in portfolio]
 
     price_map = {}
-    if current_user.fyers_connected and symbols:
+    if market_data_available() and symbols:
         price_map = get_prices_bulk(symbols)
 
     total_unrealised_pnl = Decimal("0")
@@ -405,18 +549,146 @@ def portfolio():
         elif sort_by == "symbol":
             portfolio.sort(key=lambda x: x["symbol"], reverse=reverse)
 
-    if not current_user.fyers_connected:
+    if not market_data_available():
         flash("Live prices unavailable. Connect FYERS to view P&L.", "info")
 
     return render_template("portfolio.html", data=portfolio, total_unrealised_pnl=total_unrealised_pnl,
                            tmv=total_market_value, logged_in=True)
 
 
+@app.route("/portfolio/lots", methods=["GET", "POST"])
+@login_required
+def lots():
+    method = lot_method(current_user.user)
+    form = LotMethodForm(method=method or "FIFO")
+    if request.method == "POST" and form.validate_on_submit():
+        set_lot_method(current_user.user, form.method.data)
+        flash(f"Lot accounting set to {METHODS[form.method.data]}; lots rebuilt from your transactions.")
+        return redirect(url_for("lots"))
+
+    return render_template("lots.html", form=form, method=method, methods=METHODS,
+                           lots=open_lots(current_user.user), realised=realised_by_term(current_user.user),
+                           logged_in=True)
+
+
+@app.route("/portfolio/risk")
+@read_only
+@login_required
+def risk():
+    if not market_data_available():
+        flash("Connect FYERS to load the price history risk figures are computed from.", "info")
+        return redirect(url_for("portfolio"))
+    report = portfolio_risk(calculate_portfolio())
+    if not report["complete"]:
+        flash("Some price history could not be fetched; figures use what is cached locally.", "info")
+    return render_template("risk.html", report=report, benchmark=RISK_BENCHMARK, logged_in=True)
+
+
+@app.route("/leaderboard")
+@read_only
+@login_required
+def leaderboard():
+    metric = request.args.get("metric", "total")
+    if metric not in METRICS:
+        metric = "total"
+    n = min(request.args.get("n", 50, type=int), 500)
+
+    board = get_leaderboard()
+    return render_template("leaderboard.html", rows=board.top(metric, n), me=board.rank(metric, current_user.user),
+                           metric=metric, metrics=METRICS, logged_in=True)
+
+
+@app.route("/alerts", methods=["GET", "POST"])
+@login_required
+def alerts():
+    form = AlertForm(symbol=request.args.get("symbol"))
+    if request.method == "POST" and form.validate_on_submit():
+        symbol = form.symbol.data.strip().upper()
+        if symbol not in get_equity_symbols():
+            flash("Unknown symbol.")
+            return redirect(url_for("alerts"))
+        quote = get_data(symbol) if market_data_available() else None
+        create_alert(current_user.user, symbol, form.field.data, form.direction.data, form.threshold.data,
+                     quote["v"].get(form.field.data) if quote else None)
+        flash(f"Alert created for {symbol}.")
+        return redirect(url_for("alerts"))
+
+    user_alerts = db.session.execute(
+        db.select(PriceAlert).where(PriceAlert.user_id == current_user.user)
+        .order_by(PriceAlert.active.desc(), PriceAlert.created_at.desc())
+    ).scalars().all()
+    notifications = db.session.execute(
+        db.select(Notification).where(Notification.user_id == current_user.user)
+        .order_by(Notification.created_at.desc()).limit(50)
+    ).scalars().all()
+    unread = [n.id for n in notifications if not n.read]
+    page = render_template("alerts.html", form=form, alerts=user_alerts, notifications=notifications,
+                           fields=FIELDS, logged_in=True)
+    if unread:
+        db.session.execute(db.update(Notification).where(Notification.id.in_(unread)).values(read=True))
+        db.session.commit()
+    return page
+
+
+@app.route("/alerts/<int:alert_id>/delete", methods=["POST"])
+@login_required
+def remove_alert(alert_id):
+    delete_alert(current_user.user, alert_id)
+    return redirect(url_for("alerts"))
+
+
+@app.route("/strategies", methods=["GET", "POST"])
+@login_required
+def strategies():
+    form = StrategyForm()
+    if request.method == "POST" and form.validate_on_submit():
+        name = form.name.data.strip()
+        try:
+            params = strategy_params(form.kind.data, form.symbols.data, form.fast.data, form.slow.data,
+                                     form.quantity.data, form.capital.data, form.band.data)
+            unknown = set(strategy_symbols(form.kind.data, params)) - set(get_equity_symbols())
+            if unknown:
+                raise ValueError(f"Unknown symbol: {', '.join(sorted(unknown))}.")
+        except ValueError as e:
+            flash(str(e))
+        else:
+            create_strategy(current_user.user, name, form.kind.data, params, form.interval.data)
+            flash(f"Strategy {name} created. It runs every {form.interval.data} min while the market is open.")
+            return redirect(url_for("strategies"))
+
+    user_strategies = db.session.execute(
+        db.select(Strategy).where(Strategy.user_id == current_user.user)
+        .order_by(Strategy.active.desc(), Strategy.created_at.desc())
+    ).scalars().all()
+    return render_template("strategies.html", form=form, strategies=user_strategies, kinds=STRATEGY_KINDS,
+                           logged_in=True)
+
+
+@app.route("/strategies/<int:strategy_id>/toggle", methods=["POST"])
+@login_required
+def toggle_strategy(strategy_id):
+    strategy = user_strategy(current_user.user, strategy_id)
+    if strategy is not None:
+        strategy.active = not strategy.active
+        db.session.commit()
+    return redirect(url_for("strategies"))
+
+
+@app.route("/strategies/<int:strategy_id>/delete", methods=["POST"])
+@login_required
+def remove_strategy(strategy_id):
+    strategy = user_strategy(current_user.user, strategy_id)
+    if strategy is not None:
+        db.session.delete(strategy)
+        db.session.commit()
+    return redirect(url_for("strategies"))
+
+
 @app.route("/candles/<symbol>")
 @login_required
-def candles(symbol):
+async def candles(symbol):
     range_key = request.args.get("range", "1M")
-    data = get_historic_data(symbol, range_key)
+    data = await get_historic_data_only(symbol, range_key)
 
     if not data or data.get("s") != "ok":
         return jsonify({"candles": []}), 200
@@ -447,6 +719,142 @@ def balance():
     return render_template('balance.html', form=form)
 
 
+@app.cli.command("rebuild-lots")
+@click.option("--user", "users", multiple=True, help="only these accounts (default: every lot-mode account)")
+def rebuild_lots_command(users):
+    """Recompute open and realised lots from the transaction ledger."""
+    rebuilt = rebuild_lots(list(users) or None)
+    db.session.commit()
+    click.echo(f"Rebuilt lots for {rebuilt} account(s).")
+
+
+@app.cli.command("archive-ledger")
+@click.option("--keep-months", type=int, default=LEDGER_HOT_MONTHS, show_default=True,
+              help="periods that ended within this many months stay in the live table")
+def archive_ledger_command(keep_months):
+    """Move closed ledger periods to Parquet and fold them into carry-forward summaries."""
+    archived = archive_ledger(keep_months)
+    for period, rows in archived.items():
+        click.echo(f"{period}: archived {rows} transactions")
+    click.echo(f"Archived {len(archived)} period(s).")
+
+
+@app.cli.command("partition-ledger")
+@click.option("--months-ahead", type=int, default=3, show_default=True)
+@click.option("--ensure-only", is_flag=True, help="only create upcoming partitions (for a monthly cron)")
+def partition_ledger_command(months_ahead, ensure_only):
+    """Range-partition the transaction table by period (Postgres)."""
+    created = ensure_partitions(months_ahead) if ensure_only else partition_ledger(months_ahead)
+    click.echo(f"Created {len(created)} partition(s): {', '.join(created) or '-'}")
+
+
+@app.cli.command("backfill-history")
+@click.option("--user", "username", required=True, help="account whose Fyers connection is used")
+@click.option("--universe", type=click.Choice(sorted(UNIVERSES)), default="eq", show_default=True,
+              help="eq: Data/NSE_EQ_only.csv, cm: every symbol in Data/NSE_CM.csv")
+@click.option("--symbols", default=None, help="comma separated, overrides --universe")
+@click.option("--years", type=int, default=BACKFILL_YEARS, show_default=True,
+              help="daily history fetched for a symbol with no checkpoint yet")
+@click.option("--intraday", "intraday_resolution", default=None, help="also store intraday candles, e.g. 1 or 5 (minutes)")
+@click.option("--intraday-days", type=int, default=30, show_default=True)
+@click.option("--workers", type=int, default=4, show_default=True)
+def backfill_history_command(username, universe, symbols, years, intraday_resolution, intraday_days, workers):
+    """Backfill / append candles for a symbol universe into the candle store. Run after the close."""
+    user = db.session.get(UserData, username)
+    if not user:
+        raise click.ClickException(f"Unknown user {username}")
+    symbol_list = symbols.split(",") if symbols else universe_symbols(universe)
+
+    with app.test_request_context():
+        login_user(user)
+        try:
+            fyers = get_fyers_client()
+        except UpstreamUnavailable as e:
+            raise click.ClickException(f"Fyers is unavailable: {e}")
+        if fyers is None:
+            raise click.ClickException("Fyers is not connected for this user")
+        header = fyers.header
+    summary = run_backfill(symbol_list, header, years, intraday_resolution, intraday_days, workers)
+    click.echo(f"{summary['ok']} updated, {summary['up to date']} already up to date, "
+               f"{summary['failed']} failed, {summary['candles']} candles fetched")
+
+
+@contextmanager
+def job_context(username):
+    """
+    One tick of a long-running CLI job: a fresh request context logged in as `username`, so `g`
+    (upstream call log, secret memo) starts empty and the DB session is ended when the tick is.
+    """
+    with app.test_request_context():
+        login_user(db.session.get(UserData, username))
+        try:
+            yield
+        finally:
+            db.session.remove()
+
+
+@app.cli.command("run-strategies")
+@click.option("--user", "username", required=True, help="account whose Fyers connection fetches the quotes")
+@click.option("--workers", type=int, default=STRATEGY_WORKERS, show_default=True, help="evaluation processes (1: in-process)")
+@click.option("--tick", type=int, default=STRATEGY_TICK_SECONDS, show_default=True, help="seconds between ticks")
+@click.option("--once", is_flag=True, help="run a single tick and exit")
+@click.option("--any-time", is_flag=True, help="also tick while the market is closed")
+def run_strategies_command(username, workers, tick, once, any_time):
+    """Run every user's active strategies on a schedule, placing paper orders. Keep it running."""
+    if not db.session.get(UserData, username):
+        raise click.ClickException(f"Unknown user {username}")
+    # Don't sit idle in a transaction between ticks; each tick opens its own session.
+    db.session.remove()
+
+    summary = run_strategies(workers, tick, once, any_time, context=lambda: job_context(username))
+    if once:
+        if summary is None:
+            click.echo("Market is closed; nothing ran (use --any-time to force a tick).")
+        else:
+            click.echo(f"{summary['strategies']} strategies evaluated, {summary['orders']} orders placed, "
+                       f"{summary['rejected']} rejected")
+
+
+@app.cli.command("refresh-quotes")
+@click.option("--user", "username", required=True, help="account whose Fyers connection fetches the quotes")
+@click.option("--every", type=int, default=QUOTE_REFRESH_SECONDS, show_default=True, help="seconds between refreshes")
+@click.option("--once", is_flag=True, help="refresh once and exit")
+@click.option("--any-time", is_flag=True, help="also refresh while the market is closed")
+def refresh_quotes_command(username, every, once, any_time):
+    """Keep quotes for every watchlisted and held symbol fresh in the quote cache. Keep it running."""
+    if not db.session.get(UserData, username):
+        raise click.ClickException(f"Unknown user {username}")
+    db.session.remove()
+
+    refreshed = run_quote_refresher(every, once, any_time, context=lambda: job_context(username))
+    if once:
+        click.echo("Market is closed; nothing refreshed (use --any-time to force)." if refreshed is None
+                   else f"Refreshed {refreshed} watchlisted / held symbols.")
+
+
+@app.cli.command("replay-record")
+@click.option("--user", "username", required=True, help="account whose Fyers connection is used")
+@click.option("--date", "date", required=True, help="session to record, YYYY-MM-DD")
+@click.option("--symbols", default=None, help="comma separated, defaults to Data/NSE_EQ_only.csv")
+def replay_record(username, date, symbols):
+    """Record a day of 1-minute candles for REPLAY_MODE."""
+    user = db.session.get(UserData, username)
+    if not user:
+        raise click.ClickException(f"Unknown user {username}")
+    symbol_list = symbols.split(",") if symbols else get_equity_symbols()
+
+    with app.test_request_context():
+        login_user(user)
+        try:
+            fyers = get_fyers_client()
+        except UpstreamUnavailable as e:
+            raise click.ClickException(f"Fyers is unavailable: {e}")
+        if fyers is None:
+            raise click.ClickException("Fyers is not connected for this user")
+        recorded = record_session(fyers, symbol_list, date)
+    click.echo(f"Recorded {recorded}/{len(symbol_list)} symbols for {date}")
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
 
@@ -0,0 +1,222 @@
+import os, time, threading
+from datetime import datetime
+from flask import current_app
+from sortedcontainers import SortedList
+from utils.models import db, PriceAlert, Notification
+from utils.logs import get_logger
+
+# Price / % change alerts, evaluated on every quote-cache refresh (see stock_utils.on_quote_refresh).
+# Alerts fire on a crossing, not a level: one created while the value is already past its
+# threshold starts disarmed and is armed once the value is seen on the other side.
+# Active thresholds are indexed per symbol in sorted lists, one per (field, direction):
+#   armed ABOVE fires for every threshold <= value     -> a prefix of the list
+#   armed BELOW fires for every threshold >= value     -> a suffix of the list
+#   disarmed ABOVE arms for every threshold > value    -> a suffix of the list
+#   disarmed BELOW arms for every threshold < value    -> a prefix of the list
+# so a refresh costs a dict lookup plus a bisect per symbol, not a scan over all alerts.
+# Alerts created on other workers are picked up by the periodic rebuild, which runs in a
+# background thread while quote refreshes keep using the previous index.
+ALERT_REBUILD_SECONDS = int(os.getenv("ALERT_REBUILD_SECONDS", "60"))
+
+FIELDS = {"lp": "last price", "chp": "% change"}
+DIRECTIONS = {"ABOVE": "rose above", "BELOW": "fell below"}
+
+
+class AlertIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.built_at = None
+        self.books = {}  # symbol -> {(field, direction, armed): SortedList[(threshold, alert_id)]}
+        self.entries = {}  # alert_id -> (symbol, (field, direction, armed), threshold)
+
+    def add(self, alert_id, symbol, field, direction, threshold, armed=True):
+        with self.lock:
+            self._add(alert_id, symbol, (field, direction, armed), float(threshold))
+
+    def _add(self, alert_id, symbol, key, threshold):
+        self.books.setdefault(symbol, {}).setdefault(key, SortedList()).add((threshold, alert_id))
+        self.entries[alert_id] = (symbol, key, threshold)
+
+    def remove(self, alert_id):
+        with self.lock:
+            entry = self.entries.pop(alert_id, None)
+            if entry is None:
+                return
+            symbol, key, threshold = entry
+            self.books[symbol][key].discard((threshold, alert_id))
+
+    def pop_due(self, quotes):
+        """
+        Removes and returns {alert_id: value} for every armed alert the given quotes trigger,
+        and arms the disarmed ones the quotes put on the far side of their threshold.
+        Returns (due, newly armed alert ids).
+        """
+        due, armed = {}, []
+        with self.lock:
+            for q in quotes:
+                v = q["v"]
+                books = self.books.get(v.get("symbol"))
+                if not books:
+                    continue
+                for key, book in list(books.items()):
+                    field, direction, is_armed = key
+                    value = v.get(field)
+                    if value is None or not book:
+                        continue
+                    value = float(value)
+                    if direction == "ABOVE":
+                        split = book.bisect_right((value, float("inf")))
+                        hits = book[:split] if is_armed else book[split:]
+                    else:
+                        split = book.bisect_left((value, float("-inf")))
+                        hits = book[split:] if is_armed else book[:split]
+                    for item in hits:
+                        book.remove(item)
+                        if is_armed:
+                            self.entries.pop(item[1], None)
+                            due[item[1]] = value
+                        else:
+                            self._add(item[1], v["symbol"], (field, direction, True), item[0])
+                            armed.append(item[1])
+        return due, armed
+
+
+ALERT_INDEX = None
+_rebuild_lock = threading.Lock()
+_pending = None  # alerts created while a rebuild is in flight, added to the new index before the swap
+_pending_lock = threading.Lock()
+log = get_logger("alerts")
+
+
+def rebuild_alert_index():
+    global ALERT_INDEX, _pending
+    with _pending_lock:
+        _pending = []
+    try:
+        index = _load_alert_index()
+        with _pending_lock:
+            for alert_id, symbol, key, threshold in _pending:
+                if alert_id not in index.entries:
+                    index._add(alert_id, symbol, key, threshold)
+            ALERT_INDEX = index
+    finally:
+        with _pending_lock:
+            _pending = None
+    return index
+
+
+def _load_alert_index():
+    rows = db.session.execute(
+        db.select(PriceAlert.id, PriceAlert.symbol, PriceAlert.field, PriceAlert.direction, PriceAlert.threshold,
+                  PriceAlert.armed)
+        .where(PriceAlert.active.is_(True))
+        .execution_options(yield_per=5000)
+    )
+    index = AlertIndex()
+    for alert_id, symbol, field, direction, threshold, armed in rows:
+        index._add(alert_id, symbol, (field, direction, armed), float(threshold))
+    index.built_at = time.time()
+    return index
+
+
+def _rebuild_in_background(app):
+    try:
+        with app.app_context():
+            rebuild_alert_index()
+    except Exception:
+        log.exception("Alert index rebuild failed")
+    finally:
+        _rebuild_lock.release()
+
+
+def get_alert_index():
+    """
+    The current index. Only the first call builds it inline; once it is older than
+    ALERT_REBUILD_SECONDS, it is still used while a background thread rebuilds it.
+    """
+    index = ALERT_INDEX
+    if index is None:
+        return rebuild_alert_index()
+    if time.time() - index.built_at > ALERT_REBUILD_SECONDS and _rebuild_lock.acquire(blocking=False):
+        threading.Thread(
+            target=_rebuild_in_background, args=(current_app._get_current_object(),),
+            name="alert-index-rebuild", daemon=True,
+        ).start()
+    return index
+
+
+def alert_message(symbol, field, direction, threshold, value):
+    unit = "%" if field == "chp" else ""
+    return (f"{symbol[4:].split('-')[0]} {FIELDS[field]} {DIRECTIONS[direction]} "
+            f"{threshold:.2f}{unit} (now {value:.2f}{unit})")
+
+
+def evaluate_alerts(quotes):
+    """
+    Quote-refresh listener. Marks triggered alerts inactive and stores one notification each.
+    The conditional UPDATE ... RETURNING makes sure an alert fires once even if several
+    workers see the same refresh. The writes run in their own transaction on a separate
+    connection, so a failure here never leaves the refreshing request's session aborted.
+    """
+    due, armed = get_alert_index().pop_due(quotes)
+    if not due and not armed:
+        return
+
+    with db.engine.begin() as conn:
+        if armed:
+            conn.execute(db.update(PriceAlert).where(PriceAlert.id.in_(armed)).values(armed=True))
+        if not due:
+            return
+        fired = conn.execute(
+            db.update(PriceAlert)
+            .where(PriceAlert.id.in_(due), PriceAlert.active.is_(True))
+            .values(active=False, triggered_at=datetime.now())
+            .returning(PriceAlert.id, PriceAlert.user_id, PriceAlert.symbol, PriceAlert.field,
+                       PriceAlert.direction, PriceAlert.threshold)
+        ).all()
+        if fired:
+            conn.execute(db.insert(Notification), [
+                {
+                    "user_id": user_id,
+                    "message": alert_message(symbol, field, direction, float(threshold), due[alert_id]),
+                    "link": f"/stock/{symbol}",
+                }
+                for alert_id, user_id, symbol, field, direction, threshold in fired
+            ])
+
+
+def create_alert(user, symbol, field, direction, threshold, value=None):
+    """
+    `value` is the symbol's current `field`. The alert is armed only if that is on the near side
+    of the threshold; when the value is unknown it waits to see one, so it never fires on a level.
+    """
+    armed = value is not None and (float(value) < float(threshold) if direction == "ABOVE"
+                                   else float(value) > float(threshold))
+    alert = PriceAlert(user_id=user, symbol=symbol, field=field, direction=direction, threshold=threshold,
+                       armed=armed)
+    db.session.add(alert)
+    db.session.commit()
+    with _pending_lock:
+        if _pending is not None:
+            _pending.append((alert.id, symbol, (field, direction, armed), float(threshold)))
+        index = ALERT_INDEX
+    if index is not None:
+        index.add(alert.id, symbol, field, direction, threshold, armed)
+    return alert
+
+
+def delete_alert(user, alert_id):
+    deleted = db.session.execute(
+        db.delete(PriceAlert).where(PriceAlert.id == alert_id, PriceAlert.user_id == user)
+    ).rowcount
+    db.session.commit()
+    if deleted and ALERT_INDEX is not None:
+        ALERT_INDEX.remove(alert_id)
+    return deleted
+
+
+def unread_count(user):
+    return db.session.execute(
+        db.select(db.func.count(Notification.id))
+        .where(Notification.user_id == user, Notification.read.is_(False))
+    ).scalar_one()
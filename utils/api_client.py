@@ -1,29 +1,108 @@
-from fyers_apiv3 import fyersModel
 import requests, os, hashlib, time, json
 from utils.models import UserData, db
 from utils.crypto_utils import decrypt, encrypt
 from flask_login import current_user
-from flask import url_for
+from flask import url_for, g
+from utils.metrics import upstream_call, record_cache
+from utils.resilience import acquire_fyers, release_fyers, UPSTREAM_TIMEOUT, RATE_LIMIT_MAX_WAIT
+from utils.logs import get_logger
+
+log = get_logger("auth")
 
 PIN = os.getenv("PIN","1234")
-FYERS_REFRESH_URL = "https://api-t1.fyers.in/api/v3/validate-refresh-token"
-FYERS_VALIDATE_AUTH_URL = "https://api-t1.fyers.in/api/v3/validate-authcode"
+
+# FYERS_API_BASE points every broker call at another host, e.g. the local stand-in
+# server in benchmarks/stub_server.py (http://127.0.0.1:8765).
+FYERS_API_BASE = os.getenv("FYERS_API_BASE", "https://api-t1.fyers.in").rstrip("/")
+FYERS_REFRESH_URL = f"{FYERS_API_BASE}/api/v3/validate-refresh-token"
+FYERS_VALIDATE_AUTH_URL = f"{FYERS_API_BASE}/api/v3/validate-authcode"
+FYERS_DATA_URL = f"{FYERS_API_BASE}/data"
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, "../Data")
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "../Data"))
 os.makedirs(DATA_DIR, exist_ok=True)
 
 ACCESS_TOKEN_FILE = os.path.join(BASE_DIR, "access_token.txt")  # not used but kept
 TOKEN_CACHE_FILE = os.path.join(DATA_DIR, "token_cache.json")
 
+# Decrypted credentials are memoized per request (g) and for SECRET_CACHE_TTL seconds per worker,
+# so a page that needs the client ID/secret several times pays for one load and one decrypt.
+SECRET_CACHE_TTL = int(os.getenv("SECRET_CACHE_TTL", "300"))
+CACHED_SECRETS = ("fyers_client_id", "fyers_secret_key", "google_api_key", "cx")
+_secret_cache = {}  # (user, field) -> (expires_at, value)
+
+
+_fyers_model = None
+
+
+def get_fyers_model():
+    """
+    fyers_apiv3 (and the aiohttp/boto stack it pulls in) is imported on first use
+    rather than at worker boot.
+    """
+    global _fyers_model
+    if _fyers_model is None:
+        from fyers_apiv3 import fyersModel
+        fyersModel.Config.API = f"{FYERS_API_BASE}/api/v3"
+        fyersModel.Config.DATA_API = f"{FYERS_API_BASE}/data"
+        _fyers_model = fyersModel
+    return _fyers_model
+
+
+def fyers_get(endpoint, header, params, upstream, max_wait=RATE_LIMIT_MAX_WAIT):
+    """
+    One GET against the Fyers data API (quotes, history), with a timeout, through the shared rate
+    limiter and circuit breaker. Returns the Fyers response dict; raises UpstreamUnavailable if
+    the call was refused or failed upstream (see utils/resilience.py).
+    """
+    time.sleep(acquire_fyers(header, upstream, max_wait))
+    start = time.perf_counter()
+    try:
+        with upstream_call(upstream) as call:
+            response = requests.get(
+                f"{FYERS_DATA_URL}/{endpoint}",
+                params=params,
+                headers={"Authorization": header, "version": "3"},
+                timeout=UPSTREAM_TIMEOUT,
+            )
+            data = response.json()
+            call.set_fyers_response(data)
+    except Exception as e:
+        data = {"s": "error", "code": -99, "message": str(e)}
+    release_fyers(data, time.perf_counter() - start)
+    return data
+
+
+def get_secret(field):
+    """Decrypted value of one of the current user's encrypted credential columns."""
+    memo = g.setdefault("_secrets", {})
+    if field in memo:
+        return memo[field]
+
+    key = (current_user.user, field)
+    now = time.time()
+    cached = _secret_cache.get(key)
+    if cached and cached[0] > now:
+        value = cached[1]
+    else:
+        value = decrypt(getattr(current_user, field))
+        if field in CACHED_SECRETS:
+            if len(_secret_cache) > 5000:
+                for k in [k for k, (expires, _) in _secret_cache.items() if expires <= now]:
+                    _secret_cache.pop(k, None)
+            _secret_cache[key] = (now + SECRET_CACHE_TTL, value)
+
+    memo[field] = value
+    return value
+
 
 def get_fyers_credentials():
     if not current_user.is_authenticated:
         raise RuntimeError("User not logged in")
 
     return {
-        "client_id": decrypt(current_user.fyers_client_id),
-        "secret_key": decrypt(current_user.fyers_secret_key),
+        "client_id": get_secret("fyers_client_id"),
+        "secret_key": get_secret("fyers_secret_key"),
     }
 
 
@@ -56,11 +135,13 @@ def exchange_auth_code_for_tokens(auth_code: str) -> str:
     }
 
     headers = {"Content-Type": "application/json"}
-    resp = requests.post(FYERS_VALIDATE_AUTH_URL, headers=headers, json=payload)
+    with upstream_call("fyers_validate_authcode") as call:
+        resp = requests.post(FYERS_VALIDATE_AUTH_URL, headers=headers, json=payload)
+        call.set_http_response(resp)
     data = resp.json()
 
     if resp.status_code != 200 or "access_token" not in data:
-        print("FYERS AUTH FAILED:", data)
+        log.warning("Fyers auth failed", extra={"status": resp.status_code, "response": data})
         return None
 
     access_token = data["access_token"]
@@ -69,7 +150,7 @@ def exchange_auth_code_for_tokens(auth_code: str) -> str:
     current_user.fyers_refresh_token = encrypt(refresh_token)
 
     if not refresh_token:
-        print("FYERS RESPONSE MISSING REFRESH TOKEN:", data)
+        log.warning("Fyers response missing refresh token", extra={"response": data})
         return None
 
     current_user.fyers_auth_code = None
@@ -79,13 +160,14 @@ def exchange_auth_code_for_tokens(auth_code: str) -> str:
     with open(TOKEN_CACHE_FILE, "w") as f:
         json.dump({"access_token": access_token, "timestamp": time.time()}, f)
 
-    print("Fyers access/refresh tokens updated from auth_code.")
+    log.info("Fyers access/refresh tokens updated from auth_code")
     return access_token
 
 
 def get_auth_code():
-    fyers_client_id = decrypt(current_user.fyers_client_id)
-    fyers_secret_key = decrypt(current_user.fyers_secret_key)
+    creds = get_fyers_credentials()
+    fyers_client_id = creds["client_id"]
+    fyers_secret_key = creds["secret_key"]
 
     redirect_uri = url_for(
         "fyers_callback",
@@ -93,7 +175,7 @@ def get_auth_code():
         _scheme="https"
     )
 
-    session = fyersModel.SessionModel(
+    session = get_fyers_model().SessionModel(
         client_id=fyers_client_id,
         secret_key=fyers_secret_key,
         redirect_uri=redirect_uri,
@@ -104,7 +186,7 @@ def get_auth_code():
 
 
 def get_fyers_authcode(*, client_id, secret_key):
-    session = fyersModel.SessionModel(
+    session = get_fyers_model().SessionModel(
         client_id=client_id,
         secret_key=secret_key,
         redirect_uri= os.getenv("FYERS_REDIRECT_URL"),
@@ -118,13 +200,14 @@ def get_fyers_access_token():
     Returns:
         access_token (str) if valid
         None if user must re-auth
-    Safe for Render. Never raises.
+    Raises UpstreamUnavailable when the refresh was refused by the rate limiter / circuit breaker
+    or failed upstream: the broker is down, the user does not need to reconnect.
     """
 
     if not current_user.is_authenticated:
         return None
 
-    if not current_user.fyers_refresh_token:
+    if not current_user.fyers_connected:
         return None
 
     # Reuse cached access token if still valid (12 hours)
@@ -137,9 +220,13 @@ def get_fyers_access_token():
             timestamp = cache.get("timestamp", 0)
 
             if access_token and (time.time() - timestamp) < 43200:
+                record_cache("token", "hit")
                 return access_token
+            record_cache("token", "stale")
         except Exception:
-            pass  # ignore corrupt cache
+            record_cache("token", "miss")  # ignore corrupt cache
+    else:
+        record_cache("token", "miss")
 
     # Refresh token flow
     creds = get_fyers_credentials()
@@ -153,7 +240,7 @@ def get_fyers_access_token():
         return None
 
     try:
-        refresh_token = decrypt(current_user.fyers_refresh_token)
+        refresh_token = get_secret("fyers_refresh_token")
     except Exception:
         return None
 
@@ -169,11 +256,20 @@ def get_fyers_access_token():
 
     headers = {"Content-Type": "application/json"}
 
+    # Same limiter and breaker as the data calls; release_fyers raises on timeouts, 429 and 5xx.
+    time.sleep(acquire_fyers(f"{FYERS_CLIENT_ID}:", "fyers_refresh"))
+    start = time.perf_counter()
     try:
-        response = requests.post(FYERS_REFRESH_URL, headers=headers, json=payload, timeout=10)
-        data = response.json()
-    except Exception:
-        return None
+        with upstream_call("fyers_refresh") as call:
+            response = requests.post(FYERS_REFRESH_URL, headers=headers, json=payload, timeout=UPSTREAM_TIMEOUT)
+            call.set_http_response(response)
+        if response.status_code == 429 or response.status_code >= 500:
+            data = {"s": "error", "code": response.status_code, "message": f"HTTP {response.status_code}"}
+        else:
+            data = response.json()
+    except Exception as e:
+        data = {"s": "error", "code": -99, "message": str(e)}
+    release_fyers(data, time.perf_counter() - start)
 
     #  Refresh token expired → force reconnect
     if data.get("code") == -501:
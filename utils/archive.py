@@ -0,0 +1,278 @@
+import os
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import text
+from utils.models import db, Transaction, LedgerSummary, LedgerArchive
+from utils.logs import get_logger
+
+# Cold-ledger storage. The ledger is split into periods of LEDGER_PERIOD_MONTHS months:
+#   - on Postgres, "transaction" can be range-partitioned by timestamp, one partition per period
+#     (flask partition-ledger), so per-user queries only touch the partitions they need;
+#   - closed periods older than LEDGER_HOT_MONTHS are archived (flask archive-ledger): rows go to
+#     a zstd Parquet file per period, sorted by user so reads can skip row groups, and are folded
+#     into one LedgerSummary row per (user, symbol), then dropped from the live table.
+# On SQLite / dev the same archive job runs against LEDGER_ARCHIVE_DIR and deletes the rows.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "../Data"))
+LEDGER_ARCHIVE_DIR = os.getenv("LEDGER_ARCHIVE_DIR", os.path.join(DATA_DIR, "archive", "transactions"))
+LEDGER_PERIOD_MONTHS = int(os.getenv("LEDGER_PERIOD_MONTHS", "1"))
+LEDGER_HOT_MONTHS = int(os.getenv("LEDGER_HOT_MONTHS", "12"))
+ARCHIVE_BATCH = 50000
+log = get_logger("archive")
+
+COLUMNS = ["txn_id", "user_id", "symbol", "name", "type", "quantity", "execution_price",
+           "total_value", "timestamp", "remarks", "realised_pnl"]
+
+
+def add_months(start, months):
+    index = start.year * 12 + start.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def period_start(at):
+    index = (at.year * 12 + at.month - 1) // LEDGER_PERIOD_MONTHS * LEDGER_PERIOD_MONTHS
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def period_end(start):
+    return add_months(start, LEDGER_PERIOD_MONTHS)
+
+
+def periods(first, last):
+    """Starts of every period from the one containing `first` up to the one containing `last`."""
+    start = period_start(first)
+    while start <= last:
+        yield start
+        start = period_end(start)
+
+
+def archive_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("txn_id", pa.string()),
+        ("user_id", pa.string()),
+        ("symbol", pa.string()),
+        ("name", pa.string()),
+        ("type", pa.string()),
+        ("quantity", pa.decimal128(12, 4)),
+        ("execution_price", pa.decimal128(12, 2)),
+        ("total_value", pa.decimal128(14, 2)),
+        ("timestamp", pa.timestamp("us")),
+        ("remarks", pa.string()),
+        ("realised_pnl", pa.decimal128(14, 2)),
+    ])
+
+
+# ---------- carry-forward summaries ----------
+
+def apply_to_summary(summary, row):
+    """Same average-cost rules as calculate_portfolio()."""
+    qty, price = Decimal(row["quantity"]), Decimal(row["execution_price"])
+    quantity, total_cost = Decimal(summary.quantity or 0), Decimal(summary.total_cost or 0)
+    if row["type"] == "BUY":
+        summary.quantity = quantity + qty
+        summary.total_cost = total_cost + qty * price
+        summary.bought_value = Decimal(summary.bought_value or 0) + qty * price
+    else:
+        avg_price = total_cost / quantity if quantity > 0 else Decimal("0")
+        summary.quantity = quantity - qty
+        summary.total_cost = total_cost - qty * avg_price
+        summary.realised_pnl = Decimal(summary.realised_pnl or 0) + Decimal(row["realised_pnl"] or 0)
+    summary.archived_through = row["timestamp"]
+
+
+def summaries_for(user):
+    return {
+        s.symbol: s for s in db.session.execute(
+            db.select(LedgerSummary).where(LedgerSummary.user_id == user)
+        ).scalars()
+    }
+
+
+# ---------- archival ----------
+
+def archive_period(start):
+    """
+    Archives one closed period: writes its rows to Parquet, folds them into LedgerSummary and
+    removes them from the live table, in one DB transaction. Returns the number of rows archived.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    end = period_end(start)
+    name = start.strftime("%Y-%m")
+    if db.session.get(LedgerArchive, name) is not None:
+        log.warning("Period already archived, leaving its live rows in place", extra={"period": name})
+        return 0
+    os.makedirs(LEDGER_ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(LEDGER_ARCHIVE_DIR, f"{name}.parquet")
+    tmp_path = path + ".tmp"
+
+    rows = db.session.execute(
+        db.select(*[getattr(Transaction, c) for c in COLUMNS])
+        .where(Transaction.timestamp >= start, Transaction.timestamp < end)
+        .order_by(Transaction.user_id, Transaction.timestamp)
+        .execution_options(yield_per=ARCHIVE_BATCH)
+    ).mappings()
+
+    schema = archive_schema()
+    writer, batch, count = None, [], 0
+    current, summaries = None, {}
+    for row in rows:
+        if row["user_id"] != current:
+            current, summaries = row["user_id"], summaries_for(row["user_id"])
+        summary = summaries.get(row["symbol"])
+        if summary is None:
+            summary = LedgerSummary(user_id=row["user_id"], symbol=row["symbol"], name=row["name"])
+            db.session.add(summary)
+            summaries[row["symbol"]] = summary
+        apply_to_summary(summary, row)
+
+        batch.append(dict(row))
+        count += 1
+        if len(batch) >= ARCHIVE_BATCH:
+            writer = writer or pq.ParquetWriter(tmp_path, schema, compression="zstd")
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            batch = []
+
+    if count == 0:
+        return 0
+    if batch:
+        writer = writer or pq.ParquetWriter(tmp_path, schema, compression="zstd")
+        writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+    writer.close()
+    os.replace(tmp_path, path)
+
+    if is_partitioned():
+        db.session.execute(text(f'DROP TABLE IF EXISTS {partition_name(start)}'))
+    db.session.execute(
+        db.delete(Transaction).where(Transaction.timestamp >= start, Transaction.timestamp < end)
+    )
+    db.session.add(LedgerArchive(period=name, path=os.path.basename(path), rows=count))
+    db.session.commit()
+    return count
+
+
+def archive_ledger(keep_months=LEDGER_HOT_MONTHS, now=None):
+    """
+    Archives every closed period that ended more than `keep_months` ago, oldest first, so the
+    summaries always cover a prefix of each user's history. Returns {period: rows}.
+    """
+    cutoff = period_start(add_months(now or datetime.now(), -keep_months))
+    oldest = db.session.execute(db.select(db.func.min(Transaction.timestamp))).scalar()
+    archived = {}
+    if oldest is None:
+        return archived
+    for start in periods(oldest, cutoff):
+        if period_end(start) > cutoff:
+            break
+        count = archive_period(start)
+        if count:
+            archived[start.strftime("%Y-%m")] = count
+    return archived
+
+
+# ---------- reading the archive back ----------
+
+def archived_transactions(user):
+    """A user's archived transactions (dicts shaped like Transaction columns), oldest first."""
+    import pyarrow.parquet as pq
+
+    paths = db.session.execute(db.select(LedgerArchive.path).order_by(LedgerArchive.period)).scalars().all()
+    rows = []
+    for path in paths:
+        table = pq.read_table(os.path.join(LEDGER_ARCHIVE_DIR, path), filters=[("user_id", "=", user)])
+        rows.extend(table.to_pylist())
+    return rows
+
+
+def has_archive():
+    return db.session.execute(db.select(LedgerArchive.period).limit(1)).first() is not None
+
+
+def with_archived(rows, users, columns):
+    """
+    Prefixes each user's archived rows to a live row stream sorted by user (first column), and
+    appends users that only have archived history. `columns` names the tuple fields.
+    """
+    if not has_archive():
+        yield from rows
+        return
+
+    def archived(user):
+        for r in archived_transactions(user):
+            yield tuple(r[c] for c in columns)
+
+    seen, current = set(), None
+    for row in rows:
+        if row[0] != current:
+            current = row[0]
+            seen.add(current)
+            yield from archived(current)
+        yield row
+    for user in sorted(set(users) - seen):
+        yield from archived(user)
+
+
+# ---------- Postgres partitioning ----------
+
+def partition_name(start):
+    return f"transaction_p{start:%Y_%m}"
+
+
+def is_partitioned():
+    if db.engine.dialect.name != "postgresql":
+        return False
+    return db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('\"transaction\"')"
+    )).first() is not None
+
+
+def ensure_partitions(months_ahead=3):
+    """Creates missing period partitions up to `months_ahead`, moving matching rows out of the default."""
+    if not is_partitioned():
+        raise RuntimeError('"transaction" is not partitioned; run flask partition-ledger first (Postgres only)')
+    now = datetime.now()
+    oldest = db.session.execute(db.select(db.func.min(Transaction.timestamp))).scalar() or now
+    created = []
+    for start in periods(oldest, add_months(now, months_ahead)):
+        name, end = partition_name(start), period_end(start)
+        if db.session.execute(text(f"SELECT to_regclass('{name}')")).scalar() is not None:
+            continue
+        db.session.execute(text(f'CREATE TABLE {name} (LIKE "transaction" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+        db.session.execute(text(
+            f'WITH moved AS (DELETE FROM transaction_default WHERE "timestamp" >= :start AND "timestamp" < :end '
+            f'RETURNING *) INSERT INTO {name} SELECT * FROM moved'
+        ), {"start": start, "end": end})
+        db.session.execute(text(
+            f"ALTER TABLE \"transaction\" ATTACH PARTITION {name} FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+        ))
+        created.append(name)
+    db.session.commit()
+    return created
+
+
+def partition_ledger(months_ahead=3):
+    """
+    Converts "transaction" into a table range-partitioned by timestamp (once), then makes sure
+    partitions exist for every live period and `months_ahead` months ahead. Postgres only.
+    """
+    if db.engine.dialect.name != "postgresql":
+        raise RuntimeError("partitioning needs Postgres; on other databases only the archive job applies")
+
+    if not is_partitioned():
+        for statement in (
+            'ALTER TABLE "transaction" RENAME TO transaction_unpartitioned',
+            'CREATE TABLE "transaction" (LIKE transaction_unpartitioned INCLUDING DEFAULTS) '
+            'PARTITION BY RANGE ("timestamp")',
+            'ALTER TABLE "transaction" ALTER COLUMN "timestamp" SET NOT NULL',
+            # The partition key must be part of the primary key; txn_id stays the ORM identity.
+            'ALTER TABLE "transaction" ADD CONSTRAINT transaction_part_pkey PRIMARY KEY (txn_id, "timestamp")',
+            'ALTER TABLE "transaction" ADD FOREIGN KEY (user_id) REFERENCES user_data ("user")',
+            'CREATE INDEX ix_transaction_user_time ON "transaction" (user_id, "timestamp")',
+            'CREATE TABLE transaction_default PARTITION OF "transaction" DEFAULT',
+            'INSERT INTO "transaction" SELECT * FROM transaction_unpartitioned',
+            'DROP TABLE transaction_unpartitioned',
+        ):
+            db.session.execute(text(statement))
+    return ensure_partitions(months_ahead)
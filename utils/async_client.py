@@ -0,0 +1,156 @@
+import asyncio, time
+from utils.api_client import FYERS_DATA_URL, get_fyers_access_token, get_fyers_credentials, get_secret
+from utils.stock_utils import enrich_stock_data, history_payloads, merge_candles, GOOGLE_CSE_URL, \
+    load_quote_cache, stale_quotes, save_history, stale_history, cached_quote, cached_history, cached_news, save_news
+from utils.replay import replay_enabled, replay_quotes
+from utils.metrics import upstream_call
+from utils.stock_utils import quotes_log, history_log
+from utils.resilience import acquire_fyers, release_fyers, UpstreamUnavailable, UPSTREAM_TIMEOUT
+
+# Non-blocking versions of the market-data, history and news calls used by the async views.
+# Credentials and the access token are resolved synchronously first (DB / file cache),
+# then all network waits happen on the event loop and can run concurrently.
+
+
+def client_session():
+    """One aiohttp session per view call; aiohttp is imported on first use, like fyers_apiv3."""
+    import aiohttp
+    return aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=UPSTREAM_TIMEOUT))
+
+
+def fyers_header():
+    """
+    Fyers "client_id:access_token" auth header, or None if the user must reconnect.
+    Raises UpstreamUnavailable if the token refresh could not reach the broker.
+    """
+    access_token = get_fyers_access_token()
+    if not access_token:
+        return None
+    return f"{get_fyers_credentials()['client_id']}:{access_token}"
+
+
+async def fyers_get(session, endpoint, header, params, upstream):
+    """Async api_client.fyers_get(): same rate limiter and breaker, raises UpstreamUnavailable."""
+    await asyncio.sleep(acquire_fyers(header, upstream))
+    start = time.perf_counter()
+    try:
+        with upstream_call(upstream) as call:
+            async with session.get(
+                f"{FYERS_DATA_URL}/{endpoint}",
+                params=params,
+                headers={"Authorization": header, "version": "3"},
+            ) as resp:
+                data = await resp.json(content_type=None)
+            call.set_fyers_response(data)
+    except Exception as e:
+        data = {"s": "error", "code": -99, "message": str(e)}
+    release_fyers(data, time.perf_counter() - start)
+    return data
+
+
+async def get_data_async(session, symbol, header):
+    if replay_enabled():
+        data = replay_quotes([symbol])
+    else:
+        if header is None:
+            return None
+        cached = cached_quote(symbol)
+        if cached is not None:
+            return cached
+        try:
+            response = await fyers_get(session, "quotes", header, {"symbols": symbol}, "fyers_quotes")
+        except UpstreamUnavailable as e:
+            quotes_log.info("Quote unavailable, serving cache: %s", e, extra={"symbol": symbol})
+            stale = stale_quotes(load_quote_cache(), [symbol])
+            return stale[0] if stale else None
+        data = response.get("d", [])
+
+    if not data:
+        return None
+
+    return enrich_stock_data(data[0])
+
+
+async def get_historic_data_async(session, symbol, range_key, header):
+    if header is None:
+        return {"s": "error", "candles": []}
+
+    cached = cached_history(symbol, range_key)
+    if cached is not None:
+        return cached
+
+    # The yearly chunks are independent, so they are requested concurrently.
+    try:
+        responses = await asyncio.gather(*[
+            fyers_get(session, "history", header, payload, "fyers_history")
+            for payload in history_payloads(symbol, range_key)
+        ])
+    except UpstreamUnavailable as e:
+        history_log.info("History unavailable, serving cache: %s", e, extra={"symbol": symbol, "range": range_key})
+        return stale_history(symbol, range_key)
+    candles = merge_candles(responses)
+    save_history(symbol, candles)
+    return {"s": "ok", "candles": candles}
+
+
+async def search_async(session, name, key, cx):
+    cached = cached_news(name)
+    if cached is not None:
+        return cached
+    if key is None:
+        return {"items": []}
+    try:
+        with upstream_call("google_cse") as call:
+            async with session.get(GOOGLE_CSE_URL, params={"key": key, "cx": cx, "q": name}) as response:
+                call.code = str(response.status)
+                data = await response.json(content_type=None)
+    except Exception:
+        return {"items": []}
+    if response.status != 200:
+        return {"items": []}
+    save_news(name, data)
+    return data
+
+
+def google_credentials():
+    try:
+        return get_secret("google_api_key"), get_secret("cx")
+    except Exception:
+        return None, None
+
+
+async def get_stock_page_data(symbol, range_key="1M"):
+    """Quote, news and history for the stock page, fetched concurrently."""
+    key, cx = google_credentials()
+    try:
+        header = fyers_header()
+    except UpstreamUnavailable as e:
+        # The broker is down, not the user's connection: serve the caches, flagged stale.
+        quotes_log.info("Token refresh unavailable, serving cache: %s", e, extra={"symbol": symbol})
+        stale = stale_quotes(load_quote_cache(), [symbol])
+        async with client_session() as session:
+            news = await search_async(session, symbol, key, cx)
+        return stale[0] if stale else None, news, stale_history(symbol, range_key)
+
+    async with client_session() as session:
+        return await asyncio.gather(
+            get_data_async(session, symbol, header),
+            search_async(session, symbol, key, cx),
+            get_historic_data_async(session, symbol, range_key, header),
+        )
+
+
+async def get_historic_data_only(symbol, range_key):
+    try:
+        header = fyers_header()
+    except UpstreamUnavailable as e:
+        history_log.info("Token refresh unavailable, serving cache: %s", e, extra={"symbol": symbol, "range": range_key})
+        return stale_history(symbol, range_key)
+    async with client_session() as session:
+        return await get_historic_data_async(session, symbol, range_key, header)
+
+
+async def search_only(name):
+    key, cx = google_credentials()
+    async with client_session() as session:
+        return await search_async(session, name, key, cx)
@@ -0,0 +1,101 @@
+import os, csv, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+from utils.api_client import fyers_get
+from utils.resilience import UpstreamUnavailable
+from utils.candle_store import append_candles, read_checkpoint, write_checkpoint
+from utils.market_calendar import last_session_day
+from utils.logs import get_logger, pool_logging
+
+# Universe-wide history backfill (flask backfill-history), meant to run after the close.
+# Each symbol is one task in a process pool; every worker goes through the same cross-process
+# Fyers rate limiter (utils/resilience.py), queueing for tokens rather than giving up. A task
+# fetches from the day after the symbol's checkpoint up to the last completed session, appends
+# to the candle store and then moves the checkpoint, so an interrupted run resumes where it
+# stopped and a nightly run only asks for the new day.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "../Data"))
+BACKFILL_YEARS = int(os.getenv("BACKFILL_YEARS", "5"))
+PROGRESS_EVERY = 100
+log = get_logger("backfill")
+
+# Longest range Fyers serves per history request.
+CHUNK_DAYS = {"1D": 365}
+INTRADAY_CHUNK_DAYS = 100
+
+UNIVERSES = {"eq": "NSE_EQ_only.csv", "cm": "NSE_CM.csv"}
+
+
+def universe_symbols(universe):
+    with open(os.path.join(DATA_DIR, UNIVERSES[universe]), newline="") as f:
+        return [row["symbol"] for row in csv.DictReader(f) if row.get("symbol")]
+
+
+def date_ranges(start, end, chunk_days):
+    while start <= end:
+        stop = min(end, start + timedelta(days=chunk_days - 1))
+        yield start, stop
+        start = stop + timedelta(days=1)
+
+
+def backfill_symbol(symbol, header, resolution, first_day, through):
+    """
+    Pool task: brings one (symbol, resolution) up to `through`.
+    Returns (symbol, resolution, candles fetched, status).
+    """
+    checkpoint = read_checkpoint(symbol, resolution)
+    start = date.fromisoformat(checkpoint["through"]) + timedelta(days=1) if checkpoint else first_day
+    if start > through:
+        return symbol, resolution, 0, "up to date"
+
+    candles = []
+    try:
+        for range_from, range_to in date_ranges(start, through, CHUNK_DAYS.get(resolution, INTRADAY_CHUNK_DAYS)):
+            resp = fyers_get("history", header, {
+                "symbol": symbol,
+                "resolution": resolution,
+                "date_format": "1",
+                "range_from": range_from.isoformat(),
+                "range_to": range_to.isoformat(),
+            }, "fyers_history", max_wait=None)
+            if resp.get("s") not in ("ok", "no_data"):
+                return symbol, resolution, 0, f"error {resp.get('code')}: {resp.get('message')}"
+            candles.extend(resp.get("candles") or [])
+    except UpstreamUnavailable as e:
+        return symbol, resolution, 0, f"unavailable: {e}"
+
+    append_candles(symbol, resolution, candles)
+    write_checkpoint(symbol, resolution, {"through": through.isoformat(), "updated": time.time()})
+    return symbol, resolution, len(candles), "ok"
+
+
+def run_backfill(symbols, header, years=BACKFILL_YEARS, intraday_resolution=None, intraday_days=30, workers=4):
+    """
+    Backfills daily (and optionally intraday) candles for symbols with a pool of `workers`
+    processes. Returns {"ok": n, "up to date": n, "failed": n, "candles": n}.
+    """
+    through = last_session_day()
+    jobs = [(symbol, "1D", through - timedelta(days=365 * years)) for symbol in symbols]
+    if intraday_resolution:
+        jobs += [(symbol, intraday_resolution, through - timedelta(days=intraday_days)) for symbol in symbols]
+
+    summary = {"ok": 0, "up to date": 0, "failed": 0, "candles": 0}
+    started = time.time()
+    initializer, initargs = pool_logging()
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        futures = [
+            pool.submit(backfill_symbol, symbol, header, resolution, first_day, through)
+            for symbol, resolution, first_day in jobs
+        ]
+        for done, future in enumerate(as_completed(futures), 1):
+            symbol, resolution, fetched, status = future.result()
+            if status in ("ok", "up to date"):
+                summary[status] += 1
+            else:
+                summary["failed"] += 1
+                log.warning("Symbol failed: %s", status, extra={"symbol": symbol, "resolution": resolution})
+            summary["candles"] += fetched
+            if done % PROGRESS_EVERY == 0 or done == len(futures):
+                log.info("Progress %d/%d through %s", done, len(futures), through,
+                         extra={"elapsed": round(time.time() - started)})
+    return summary
@@ -0,0 +1,86 @@
+import os, json
+
+# On-disk candle store written by the backfill job (flask backfill-history) and read by the web
+# app. One .npy file of fixed-width records per (resolution, symbol):
+#     CANDLE_STORE_DIR/<resolution>/<NSE_SBIN-EQ>.npy
+# Readers open it with np.load(mmap_mode="r"), so a worker only pages in the rows it touches and
+# all workers share the OS page cache. Writers rewrite the file to a temp name and os.replace()
+# it, so an open memory map keeps seeing the old, complete file.
+# Next to each file, <symbol>.ckpt.json records the last trading day the backfill has covered.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "../Data"))
+CANDLE_STORE_DIR = os.getenv("CANDLE_STORE_DIR", os.path.join(DATA_DIR, "candles"))
+
+CANDLE_DTYPE = [  # numpy record layout; numpy itself is only imported when candles are read or written
+    ("ts", "<i8"), ("open", "<f8"), ("high", "<f8"), ("low", "<f8"), ("close", "<f8"), ("volume", "<i8"),
+]
+
+
+def empty_candles():
+    import numpy as np
+    return np.empty(0, dtype=CANDLE_DTYPE)
+
+
+def store_file(symbol, resolution="1D", suffix=".npy"):
+    return os.path.join(CANDLE_STORE_DIR, resolution, symbol.replace(":", "_") + suffix)
+
+
+def read_candles(symbol, resolution="1D"):
+    """The stored candles as a read-only memory-mapped record array (empty if none)."""
+    import numpy as np
+    try:
+        return np.load(store_file(symbol, resolution), mmap_mode="r")
+    except (OSError, ValueError):
+        return empty_candles()
+
+
+def stored_at(symbol, resolution="1D"):
+    """When the symbol's candles were last written (epoch seconds), or 0."""
+    try:
+        return os.path.getmtime(store_file(symbol, resolution))
+    except OSError:
+        return 0
+
+
+def to_records(candles):
+    """Fyers [[ts, o, h, l, c, v], ...] -> CANDLE_DTYPE array."""
+    import numpy as np
+    if not candles:
+        return empty_candles()
+    return np.array([tuple(c[:6]) for c in candles], dtype=CANDLE_DTYPE)
+
+
+def append_candles(symbol, resolution, candles):
+    """Merges candles into the stored ones (new values win on equal timestamps). Returns the row count."""
+    import numpy as np
+    new = to_records(candles)
+    if not len(new):
+        return len(read_candles(symbol, resolution))
+    merged = np.concatenate([read_candles(symbol, resolution), new])
+    # Keep the last occurrence of each timestamp, then sort by time.
+    _, last = np.unique(merged["ts"][::-1], return_index=True)
+    merged = merged[len(merged) - 1 - last]
+
+    path = store_file(symbol, resolution)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, merged)
+    os.replace(tmp_path, path)
+    return len(merged)
+
+
+def read_checkpoint(symbol, resolution="1D"):
+    try:
+        with open(store_file(symbol, resolution, ".ckpt.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_checkpoint(symbol, resolution, checkpoint):
+    path = store_file(symbol, resolution, ".ckpt.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,63 @@
+import os, gzip, hashlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# gzip / brotli for HTML and JSON responses, plus an ETag so an unchanged page costs a 304.
+# The ETag is taken from the uncompressed body and tagged with the encoding, as each encoding
+# is a different representation (Vary: Accept-Encoding).
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "500"))
+COMPRESS_LEVEL_GZIP = int(os.getenv("COMPRESS_LEVEL_GZIP", "6"))
+COMPRESS_LEVEL_BROTLI = int(os.getenv("COMPRESS_LEVEL_BROTLI", "4"))  # 0-11; 4 is ~gzip-6 size at lower CPU
+COMPRESS_MIMETYPES = {"text/html", "application/json"}
+
+
+def choose_encoding(accept_encodings):
+    """
+    The best of br / gzip for a parsed Accept-Encoding (request.accept_encodings), honouring
+    q-values and "*": "br;q=0, gzip" is gzip. Ties go to br. None if neither is acceptable.
+    """
+    return accept_encodings.best_match(["br", "gzip"] if brotli is not None else ["gzip"])
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=COMPRESS_LEVEL_BROTLI)
+    return gzip.compress(data, compresslevel=COMPRESS_LEVEL_GZIP)
+
+
+def _compress_response(response):
+    if (
+        request.method not in ("GET", "HEAD")
+        or response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or response.mimetype not in COMPRESS_MIMETYPES
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    data = response.get_data()
+    encoding = choose_encoding(request.accept_encodings) if len(data) >= COMPRESS_MIN_SIZE else None
+
+    etag = hashlib.sha1(data).hexdigest()
+    response.set_etag(f"{etag}-{encoding}" if encoding else etag)
+    response.vary.add("Accept-Encoding")
+    if "Cache-Control" not in response.headers:
+        # Pages are per user: browsers may keep them but must revalidate, proxies must not share them.
+        response.headers["Cache-Control"] = "private, no-cache"
+
+    response.make_conditional(request)
+    if response.status_code == 304 or encoding is None:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_compression(app):
+    app.after_request(_compress_response)
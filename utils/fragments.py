@@ -0,0 +1,26 @@
+from flask import current_app
+from markupsafe import Markup
+from utils.metrics import record_cache
+
+# Rendered HTML fragments that don't depend on the user, e.g. the 2,000-row stock table.
+# Each entry is stored under (template, params) together with the data version it was rendered
+# from; a newer version replaces the old entry, so the cache never grows beyond the param space.
+FRAGMENTS = {}
+
+
+def cached_fragment(template, version, params, build_context):
+    """
+    Renders `template` with the dict returned by build_context(), or returns the copy rendered
+    for the same `params` and `version` without calling it. Context processors are skipped:
+    fragments must not depend on the current user.
+    """
+    key = (template, params)
+    entry = FRAGMENTS.get(key)
+    if entry is not None and entry[0] == version:
+        record_cache("fragment", "hit")
+        return entry[1]
+
+    record_cache("fragment", "stale" if entry is not None else "miss")
+    html = Markup(current_app.jinja_env.get_template(template).render(**build_context()))
+    FRAGMENTS[key] = (version, html)
+    return html
@@ -0,0 +1,237 @@
+import os, time, threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sortedcontainers import SortedList
+from utils.models import db, Transaction, UserData, LedgerSummary
+from utils.logs import get_logger
+
+# Cross-user P&L leaderboard kept incrementally per worker:
+#   - per-user aggregates (positions at average cost, realised P&L, amount invested)
+#   - a symbol -> holders index, so a quote refresh only touches users holding that symbol
+#   - one SortedList per metric, so top-N and "my rank" are O(log n) lookups
+# Trades served by other workers are picked up by the periodic rebuild, which runs in a background
+# thread (one at a time per worker) while requests keep reading the previous board.
+LEADERBOARD_REBUILD_SECONDS = int(os.getenv("LEADERBOARD_REBUILD_SECONDS", "300"))
+
+METRICS = {
+    "total": "Total Return %",
+    "realised": "Realised P&L",
+    "unrealised": "Unrealised P&L",
+}
+
+
+class Leaderboard:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.built_at = None
+        self.users = {}
+        self.holders = {}
+        self.prices = {}
+        self.rankings = {metric: SortedList() for metric in METRICS}
+        self.keys = {metric: {} for metric in METRICS}
+
+    def load(self, usernames, summaries, txns, prices):
+        self.prices = dict(prices)
+        for user in usernames:
+            self.users[user] = {"positions": {}, "realised": 0.0, "invested": 0.0, "unrealised": 0.0}
+        for user_id, symbol, qty, cost, realised, bought in summaries:
+            agg = self.users.setdefault(user_id, {"positions": {}, "realised": 0.0, "invested": 0.0, "unrealised": 0.0})
+            agg["positions"][symbol] = {"quantity": float(qty), "total_cost": float(cost), "contribution": 0.0}
+            agg["realised"] += float(realised)
+            agg["invested"] += float(bought)
+            if qty > 0:
+                self.holders.setdefault(symbol, set()).add(user_id)
+                self._revalue(agg, symbol, agg["positions"][symbol])
+        for user_id, symbol, side, qty, price, realised in txns:
+            self._apply_trade(user_id, symbol, side, float(qty), float(price), float(realised or 0))
+        for user in self.users:
+            self._rerank(user)
+        self.built_at = time.time()
+
+    def _apply_trade(self, user, symbol, side, qty, price, realised):
+        agg = self.users.setdefault(user, {"positions": {}, "realised": 0.0, "invested": 0.0, "unrealised": 0.0})
+        pos = agg["positions"].setdefault(symbol, {"quantity": 0.0, "total_cost": 0.0, "contribution": 0.0})
+
+        if side == "BUY":
+            pos["quantity"] += qty
+            pos["total_cost"] += qty * price
+            agg["invested"] += qty * price
+        else:
+            avg_price = pos["total_cost"] / pos["quantity"] if pos["quantity"] > 0 else 0.0
+            pos["quantity"] -= qty
+            pos["total_cost"] -= qty * avg_price
+            agg["realised"] += realised
+
+        if pos["quantity"] > 0:
+            self.holders.setdefault(symbol, set()).add(user)
+        else:
+            self.holders.get(symbol, set()).discard(user)
+        self._revalue(agg, symbol, pos)
+
+    def _revalue(self, agg, symbol, pos):
+        """Unrealised P&L of one position at the last known price."""
+        price = self.prices.get(symbol)
+        contribution = price * pos["quantity"] - pos["total_cost"] if price is not None and pos["quantity"] > 0 else 0.0
+        agg["unrealised"] += contribution - pos["contribution"]
+        pos["contribution"] = contribution
+
+    def _values(self, user):
+        agg = self.users[user]
+        total_return = (agg["realised"] + agg["unrealised"]) / agg["invested"] * 100 if agg["invested"] else 0.0
+        return {"total": total_return, "realised": agg["realised"], "unrealised": agg["unrealised"]}
+
+    def _rerank(self, user):
+        for metric, value in self._values(user).items():
+            old = self.keys[metric].get(user)
+            if old is not None:
+                self.rankings[metric].remove(old)
+            key = (-round(value, 6), user)
+            self.rankings[metric].add(key)
+            self.keys[metric][user] = key
+
+    def record_trade(self, user, symbol, side, qty, price, realised=0):
+        with self.lock:
+            self._apply_trade(user, symbol, side, float(qty), float(price), float(realised or 0))
+            self._rerank(user)
+
+    def update_prices(self, price_map):
+        """Revalues only the users holding a symbol whose price changed."""
+        with self.lock:
+            touched = set()
+            for symbol, price in price_map.items():
+                if self.prices.get(symbol) == price:
+                    continue
+                self.prices[symbol] = price
+                for user in self.holders.get(symbol, ()):
+                    agg = self.users[user]
+                    self._revalue(agg, symbol, agg["positions"][symbol])
+                    touched.add(user)
+            for user in touched:
+                self._rerank(user)
+
+    def row(self, rank, user):
+        agg = self.users[user]
+        return {
+            "rank": rank,
+            "user": user,
+            "total_return": self._values(user)["total"],
+            "realised_pnl": agg["realised"],
+            "unrealised_pnl": agg["unrealised"],
+            "holdings": sum(1 for p in agg["positions"].values() if p["quantity"] > 0),
+        }
+
+    def top(self, metric, n=50):
+        with self.lock:
+            return [self.row(i + 1, user) for i, (_, user) in enumerate(self.rankings[metric][:n])]
+
+    def rank(self, metric, user):
+        with self.lock:
+            key = self.keys[metric].get(user)
+            if key is None:
+                return None
+            return self.row(self.rankings[metric].index(key) + 1, user)
+
+
+LEADERBOARD = None
+_rebuild_lock = threading.Lock()
+# Trades and price updates seen while a rebuild is in flight: ("trade", txn_id, trade) or
+# ("prices", None, price map).
+# They are replayed onto the new board before it is swapped in.
+_pending = None
+_pending_lock = threading.Lock()
+log = get_logger("leaderboard")
+
+
+def rebuild_leaderboard():
+    """
+    Builds a fresh board from the archived summaries plus the live ledger (one streaming query) and swaps it in,
+    so readers keep using the old one meanwhile. Needs an app context.
+    """
+    global LEADERBOARD, _pending
+    from utils.stock_utils import load_quote_cache
+
+    with _pending_lock:
+        _pending = []
+    # A trade is committed before it is recorded, so one buffered here may also be in the ledger
+    # query; the ids of recent ledger rows tell which buffered trades are already counted.
+    recent_since = datetime.now() - timedelta(seconds=LEADERBOARD_REBUILD_SECONDS)
+    loaded = set()
+    try:
+        usernames = db.session.execute(db.select(UserData.user)).scalars().all()
+        summaries = db.session.execute(db.select(
+            LedgerSummary.user_id, LedgerSummary.symbol, LedgerSummary.quantity,
+            LedgerSummary.total_cost, LedgerSummary.realised_pnl, LedgerSummary.bought_value,
+        )).all()
+        txns = db.session.execute(
+            db.select(
+                Transaction.txn_id, Transaction.timestamp, Transaction.user_id, Transaction.symbol,
+                Transaction.type, Transaction.quantity, Transaction.execution_price, Transaction.realised_pnl,
+            ).order_by(Transaction.timestamp).execution_options(yield_per=5000)
+        )
+        prices = {s: c["data"]["v"]["lp"] for s, c in load_quote_cache().items() if c["data"]["v"].get("lp") is not None}
+
+        def ledger_rows():
+            for txn_id, timestamp, *row in txns:
+                if timestamp >= recent_since:
+                    loaded.add(txn_id)
+                yield row
+
+        board = Leaderboard()
+        board.load(usernames, summaries, ledger_rows(), prices)
+        with _pending_lock:
+            for kind, txn_id, update in _pending:
+                if kind == "prices":
+                    board.update_prices(update)
+                elif txn_id is None or txn_id not in loaded:
+                    board.record_trade(*update)
+            LEADERBOARD = board
+    finally:
+        with _pending_lock:
+            _pending = None
+    return board
+
+
+def _rebuild_in_background(app):
+    try:
+        with app.app_context():
+            rebuild_leaderboard()
+    except Exception:
+        log.exception("Leaderboard rebuild failed")
+    finally:
+        _rebuild_lock.release()
+
+
+def get_leaderboard():
+    """
+    The current board. Only the first call builds it inline; once it is older than
+    LEADERBOARD_REBUILD_SECONDS, it is still served while a background thread rebuilds it.
+    """
+    board = LEADERBOARD
+    if board is None:
+        return rebuild_leaderboard()
+    if time.time() - board.built_at > LEADERBOARD_REBUILD_SECONDS and _rebuild_lock.acquire(blocking=False):
+        threading.Thread(
+            target=_rebuild_in_background, args=(current_app._get_current_object(),),
+            name="leaderboard-rebuild", daemon=True,
+        ).start()
+    return board
+
+
+def record_leaderboard_trade(user, symbol, side, qty, price, realised=0, txn_id=None):
+    with _pending_lock:
+        if _pending is not None:
+            _pending.append(("trade", txn_id, (user, symbol, side, qty, price, realised)))
+        board = LEADERBOARD
+    if board is not None:
+        board.record_trade(user, symbol, side, qty, price, realised)
+
+
+def update_leaderboard_prices(quotes):
+    """Quote-refresh listener (see stock_utils.on_quote_refresh)."""
+    prices = {q["v"]["symbol"]: float(q["v"]["lp"]) for q in quotes if q["v"].get("lp") is not None}
+    with _pending_lock:
+        if _pending is not None:
+            _pending.append(("prices", None, prices))
+        board = LEADERBOARD
+    if board is not None:
+        board.update_prices(prices)
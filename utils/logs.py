@@ -0,0 +1,234 @@
+import os, re, sys, json, time, uuid, queue, random, atexit, logging, multiprocessing, multiprocessing.queues
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import g, request, has_app_context, has_request_context
+
+# Structured logging for the "suwi.*" loggers. Handlers on the request path only redact, sample,
+# stamp the record with the request ID and the upstream calls made so far, and put it on a
+# queue; a listener thread formats it as one JSON line and writes it to stderr and to a rotating
+# file in LOG_DIR. Under gunicorn the listener runs in the master (gunicorn.conf.py calls
+# start_listener(shared=True) before forking) and workers send records over a multiprocessing
+# queue, so all workers share one file and one rotation.
+#   LOG_LEVEL     level of "suwi" (default INFO)
+#   LOG_LEVELS    per-logger overrides, e.g. "suwi.history=DEBUG,suwi.access=WARNING"
+#   LOG_SAMPLE    keep this fraction of the DEBUG/INFO records of a logger, e.g. "suwi.access=0.1"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_DIR = os.getenv("LOG_DIR", os.path.join(BASE_DIR, "../Data/fyers_logs"))
+LOG_FILE = os.getenv("LOG_FILE", "suwi.log")  # empty: stderr only
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "suwi.access=0.1,suwi.quotes=0.1,suwi.history=0.1")
+LOG_SLOW_MS = float(os.getenv("LOG_SLOW_MS", "1000"))
+REQUEST_ID_HEADER = "X-Request-ID"
+
+REDACTED = "[REDACTED]"
+SECRET_KEYS = re.compile(r"token|secret|password|pin$|authorization|appidhash|auth_code|api_key|^key$", re.I)
+SECRET_VALUES = [
+    re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]+"),  # JWTs: Fyers access / refresh tokens and auth codes
+    re.compile(r"AIza[\w-]{35}"),  # Google API keys
+    re.compile(r"(?i)(bearer\s+)[\w.~+/-]+=*"),
+]
+
+# Record attributes every LogRecord has; anything else came in through extra=.
+_STANDARD = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+_queue = None
+_listener = None
+_listener_pid = None
+_pool_queue = None
+_pool_listener = None
+
+
+def parse_pairs(spec):
+    pairs = {}
+    for part in spec.split(","):
+        if "=" in part:
+            name, value = part.split("=", 1)
+            pairs[name.strip()] = value.strip()
+    return pairs
+
+
+def redact(value, key=None):
+    if key is not None and SECRET_KEYS.search(str(key)) and value:
+        return REDACTED
+    if isinstance(value, dict):
+        return {k: redact(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(v) for v in value)
+    if isinstance(value, str):
+        for pattern in SECRET_VALUES:
+            value = pattern.sub(lambda m: (m.group(1) if m.groups() else "") + REDACTED, value)
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Samples, stamps and redacts a record before it leaves the request thread."""
+
+    def __init__(self):
+        super().__init__()
+        self.rates = {name: float(rate) for name, rate in parse_pairs(LOG_SAMPLE).items()}
+
+    def sample_rate(self, name):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING and random.random() >= self.sample_rate(record.name):
+            return False
+        if has_request_context() and g.get("request_id"):
+            record.request_id = g.request_id
+        if has_app_context() and g.get("_upstream_calls"):
+            record.upstream = list(g._upstream_calls)
+        # Render the message here: args may not survive the trip to the listener.
+        record.msg = redact(record.getMessage())
+        record.args = None
+        for key, value in list(vars(record).items()):
+            if key not in _STANDARD:
+                setattr(record, key, redact(value, key))
+        if record.exc_info:
+            record.exc = redact(logging.Formatter().formatException(record.exc_info))
+            record.exc_info = None
+        return True
+
+
+def sink_handlers():
+    formatter = JsonFormatter()
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if LOG_FILE:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        handlers.append(RotatingFileHandler(
+            os.path.join(LOG_DIR, LOG_FILE), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8"
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+def start_listener(shared=False):
+    """
+    Starts the thread that writes queued records; returns the queue. shared=True (gunicorn
+    master, before forking) uses a multiprocessing queue that the workers inherit.
+    """
+    global _queue, _listener, _listener_pid
+    if _listener is None:
+        _queue = multiprocessing.Queue(-1) if shared else queue.SimpleQueue()
+        _listener = QueueListener(_queue, *sink_handlers())
+        _listener.start()
+        _listener_pid = os.getpid()
+        atexit.register(_stop_listener)
+    return _queue
+
+
+def _stop_listener():
+    # Forked workers inherit this atexit hook; only the process running the listener may stop it.
+    if _listener is not None and os.getpid() == _listener_pid:
+        _listener.stop()
+
+
+def configure_logging():
+    logger = logging.getLogger("suwi")
+    if logger.handlers:
+        return logger
+    handler = QueueHandler(_queue or start_listener())
+    handler.addFilter(ContextFilter())
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    for name, level in parse_pairs(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level.upper())
+    return logger
+
+
+def pool_logging():
+    """
+    (initializer, initargs) for a ProcessPoolExecutor. Forked workers inherit a QueueHandler
+    whose listener thread only exists in this process, so their records would be lost; the
+    initializer gives each worker a handler on a multiprocessing queue that a thread here drains
+    into this process's log queue.
+    """
+    global _pool_queue, _pool_listener
+    parent_queue = _queue or start_listener()
+    if isinstance(parent_queue, multiprocessing.queues.Queue):  # gunicorn: already shared
+        return init_worker_logging, (parent_queue,)
+    if _pool_listener is None:
+        _pool_queue = multiprocessing.Queue(-1)
+        _pool_listener = QueueListener(_pool_queue, QueueHandler(parent_queue))
+        _pool_listener.start()
+        atexit.register(_stop_pool_listener, os.getpid())
+    return init_worker_logging, (_pool_queue,)
+
+
+def _stop_pool_listener(pid):
+    # Registered after _stop_listener, so it runs first and hands over what is left.
+    if os.getpid() == pid:
+        _pool_listener.stop()
+
+
+def init_worker_logging(log_queue):
+    """Pool initializer: drops the inherited handler and logs to log_queue instead."""
+    global _queue, _listener
+    _queue, _listener = log_queue, None
+    logger = logging.getLogger("suwi")
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    configure_logging()
+
+
+def get_logger(name):
+    return logging.getLogger(f"suwi.{name}")
+
+
+access_log = get_logger("access")
+
+
+def record_upstream_log(upstream, duration, code):
+    """Called by utils.metrics.upstream_call; the request's calls are attached to its log records."""
+    if has_app_context():
+        g.setdefault("_upstream_calls", []).append(
+            {"upstream": upstream, "ms": round(duration * 1000, 1), "code": code}
+        )
+
+
+def _start_request():
+    g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+    g._log_start = time.perf_counter()
+
+
+def _log_request(response):
+    start = g.pop("_log_start", None)
+    if start is None:
+        return response
+    duration_ms = round((time.perf_counter() - start) * 1000, 1)
+    response.headers[REQUEST_ID_HEADER] = g.request_id
+    # Errors and slow requests are always kept; the rest is sampled with suwi.access.
+    level = logging.WARNING if response.status_code >= 500 or duration_ms > LOG_SLOW_MS else logging.INFO
+    access_log.log(level, "%s %s %s", request.method, request.path, response.status_code, extra={
+        "route": request.endpoint, "status": response.status_code, "duration_ms": duration_ms,
+    })
+    return response
+
+
+def init_logging(app):
+    configure_logging()
+    app.before_request(_start_request)
+    app.after_request(_log_request)
@@ -0,0 +1,230 @@
+import os
+from collections import deque
+from datetime import datetime, timedelta
+from decimal import Decimal
+from utils.models import db, Lot, LotAccount, RealisedLot, Transaction
+from utils.archive import with_archived
+from utils.logs import get_logger
+
+# Lot-level accounting for accounts that opted in (LotAccount row). Each buy opens a lot; each
+# sell consumes lots from the front (FIFO, also used for AVG holding periods) or back (LIFO) of
+# the (user, symbol) deque, reading only the lots it consumes. AVG realises P&L against the
+# average cost of the open lots and re-prices what is left at that average.
+LONG_TERM_DAYS = int(os.getenv("LONG_TERM_DAYS", "365"))
+LOT_BATCH = 16
+log = get_logger("lots")
+
+METHODS = {
+    "FIFO": "First in, first out",
+    "LIFO": "Last in, first out",
+    "AVG": "Average cost",
+}
+
+
+def lot_method(user):
+    """FIFO / LIFO / AVG, or None if the account still uses the plain average-cost replay."""
+    return db.session.execute(db.select(LotAccount.method).where(LotAccount.user_id == user)).scalar()
+
+
+def gain_term(opened_at, closed_at):
+    return "LONG" if closed_at - opened_at > timedelta(days=LONG_TERM_DAYS) else "SHORT"
+
+
+def open_lot(user, symbol, qty, price, at, txn_id=None):
+    db.session.add(Lot(user_id=user, symbol=symbol, buy_txn_id=txn_id, opened_at=at, quantity=qty, price=price))
+
+
+def open_quantity(user, symbol):
+    return Decimal(str(db.session.execute(
+        db.select(db.func.coalesce(db.func.sum(Lot.quantity), 0)).where(Lot.user_id == user, Lot.symbol == symbol)
+    ).scalar()))
+
+
+def average_cost(user, symbol):
+    qty, cost = db.session.execute(
+        db.select(db.func.sum(Lot.quantity), db.func.sum(Lot.quantity * Lot.price))
+        .where(Lot.user_id == user, Lot.symbol == symbol)
+    ).one()
+    if not qty:
+        return None
+    return Decimal(str(cost)) / Decimal(str(qty))
+
+
+def close_lots(user, symbol, qty, price, at, method, txn_id=None):
+    """
+    Matches a sell of `qty` at `price` against the open lots and returns the realised P&L.
+    Fully consumed lots are deleted and the last one is trimmed; nothing is committed.
+    Raises ValueError if the open lots don't cover qty (orders.execute_order checks first).
+    """
+    qty, price = Decimal(qty), Decimal(price)
+    avg = average_cost(user, symbol) if method == "AVG" else None
+    order = Lot.id.desc() if method == "LIFO" else Lot.id.asc()
+
+    remaining, realised = qty, Decimal("0")
+    while remaining > 0:
+        # Deletes from the previous batch are flushed by this query, so it starts at the new head.
+        batch = db.session.execute(
+            db.select(Lot).where(Lot.user_id == user, Lot.symbol == symbol).order_by(order).limit(LOT_BATCH)
+        ).scalars().all()
+        if not batch:
+            raise ValueError(f"not enough open lots of {symbol} to sell {qty}")
+
+        for lot in batch:
+            take = min(Decimal(lot.quantity), remaining)
+            basis = avg if avg is not None else Decimal(lot.price)
+            pnl = (price - basis) * take
+            db.session.add(RealisedLot(
+                user_id=user, symbol=symbol, buy_txn_id=lot.buy_txn_id, sell_txn_id=txn_id,
+                quantity=take, buy_price=basis, sell_price=price, opened_at=lot.opened_at,
+                closed_at=at, realised_pnl=pnl, term=gain_term(lot.opened_at, at),
+            ))
+            realised += pnl
+            remaining -= take
+            if take == lot.quantity:
+                db.session.delete(lot)
+            else:
+                lot.quantity = Decimal(lot.quantity) - take
+            if remaining <= 0:
+                break
+
+    if avg is not None:
+        db.session.execute(
+            db.update(Lot).where(Lot.user_id == user, Lot.symbol == symbol).values(price=avg),
+            execution_options={"synchronize_session": "fetch"},
+        )
+    return realised
+
+
+def match_in_memory(book, qty, price, at, method, txn_id):
+    """close_lots() for the rebuild: `book` is a deque of open-lot dicts for one symbol."""
+    avg = None
+    if method == "AVG" and book:
+        avg = sum(l["quantity"] * l["price"] for l in book) / sum(l["quantity"] for l in book)
+
+    rows, remaining = [], qty
+    while remaining > 0 and book:
+        lot = book[-1] if method == "LIFO" else book[0]
+        take = min(lot["quantity"], remaining)
+        basis = avg if avg is not None else lot["price"]
+        rows.append({
+            "buy_txn_id": lot["buy_txn_id"], "sell_txn_id": txn_id, "quantity": take,
+            "buy_price": basis, "sell_price": price, "opened_at": lot["opened_at"], "closed_at": at,
+            "realised_pnl": (price - basis) * take, "term": gain_term(lot["opened_at"], at),
+        })
+        remaining -= take
+        lot["quantity"] -= take
+        if lot["quantity"] == 0:
+            book.pop() if method == "LIFO" else book.popleft()
+
+    if avg is not None:
+        for lot in book:
+            lot["price"] = avg
+    return rows, remaining
+
+
+def rebuild_lots(users=None, chunk=5000):
+    """
+    Recomputes Lot and RealisedLot for every lot-mode account (or just `users`) from the ledger
+    (archived periods included), in one pass over the transactions ordered by user and time.
+    Holds one user's open lots in memory at a time. Recorded Transaction.realised_pnl values
+    are left as they are.
+    """
+    query = db.select(LotAccount.user_id, LotAccount.method)
+    if users:
+        query = query.where(LotAccount.user_id.in_(users))
+    methods = dict(db.session.execute(query).all())
+    if not methods:
+        return 0
+
+    db.session.execute(db.delete(Lot).where(Lot.user_id.in_(methods)))
+    db.session.execute(db.delete(RealisedLot).where(RealisedLot.user_id.in_(methods)))
+
+    txns = db.session.execute(
+        db.select(
+            Transaction.user_id, Transaction.txn_id, Transaction.symbol, Transaction.type,
+            Transaction.quantity, Transaction.execution_price, Transaction.timestamp,
+        ).where(Transaction.user_id.in_(methods))
+        .order_by(Transaction.user_id, Transaction.timestamp)
+        .execution_options(yield_per=chunk)
+    )
+    # Archived periods come first from the Parquet archive, one user at a time.
+    txns = with_archived(txns, methods, ["user_id", "txn_id", "symbol", "type", "quantity",
+                                         "execution_price", "timestamp"])
+
+    realised_rows = []
+    current, books = None, {}
+
+    def flush_user():
+        lots = [
+            {"user_id": current, "symbol": symbol, **lot}
+            for symbol, book in books.items() for lot in book
+        ]
+        for i in range(0, len(lots), chunk):
+            db.session.execute(db.insert(Lot), lots[i:i + chunk])
+
+    for user, txn_id, symbol, side, qty, price, at in txns:
+        if user != current:
+            if current is not None:
+                flush_user()
+            current, books = user, {}
+
+        qty, price = Decimal(qty), Decimal(price)
+        book = books.setdefault(symbol, deque())
+        if side == "BUY":
+            book.append({"buy_txn_id": txn_id, "opened_at": at, "quantity": qty, "price": price})
+            continue
+
+        rows, short = match_in_memory(book, qty, price, at, methods[user], txn_id)
+        if short > 0:
+            log.warning("Lot rebuild: sold more than held", extra={
+                "user": user, "symbol": symbol, "short": short, "txn_id": txn_id,
+            })
+        realised_rows.extend({"user_id": user, "symbol": symbol, **row} for row in rows)
+        if len(realised_rows) >= chunk:
+            db.session.execute(db.insert(RealisedLot), realised_rows)
+            realised_rows = []
+
+    if current is not None:
+        flush_user()
+    if realised_rows:
+        db.session.execute(db.insert(RealisedLot), realised_rows)
+    return len(methods)
+
+
+def set_lot_method(user, method):
+    """Switches an account to lot accounting (or to another method) and rebuilds its lots."""
+    account = db.session.get(LotAccount, user)
+    if account is None:
+        db.session.add(LotAccount(user_id=user, method=method))
+    else:
+        account.method = method
+    db.session.flush()
+    rebuild_lots([user])
+    db.session.commit()
+
+
+def open_lots(user):
+    now = datetime.now()
+    lots = db.session.execute(
+        db.select(Lot).where(Lot.user_id == user).order_by(Lot.symbol, Lot.id)
+    ).scalars().all()
+    return [
+        {
+            "symbol": lot.symbol,
+            "opened_at": lot.opened_at,
+            "quantity": lot.quantity,
+            "price": lot.price,
+            "holding_days": (now - lot.opened_at).days,
+            "term": gain_term(lot.opened_at, now),
+        }
+        for lot in lots
+    ]
+
+
+def realised_by_term(user):
+    totals = dict(db.session.execute(
+        db.select(RealisedLot.term, db.func.sum(RealisedLot.realised_pnl))
+        .where(RealisedLot.user_id == user)
+        .group_by(RealisedLot.term)
+    ).all())
+    return {term: Decimal(str(totals.get(term) or 0)) for term in ("SHORT", "LONG")}
@@ -0,0 +1,170 @@
+import os, csv
+from collections import Counter
+from datetime import datetime, date, time as dtime, timedelta
+import pytz
+from utils.logs import get_logger
+
+# NSE trading calendar: a trading day is a weekday that is not in the holiday list, and on it
+# prices can move during the pre-open call auction, the sessions of the instrument master's
+# trad_ses field ("0915-1530|1815-1915") and the post-close session. Outside those windows
+# quotes, candles and headlines stay as they were at the last close, so cached values fetched
+# after that close are still current; see fresh_since().
+IST = pytz.timezone("Asia/Kolkata")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "../Data"))
+MARKET_HOLIDAYS_FILE = os.getenv("MARKET_HOLIDAYS_FILE", os.path.join(DATA_DIR, "NSE_holidays.csv"))
+MARKET_PRE_OPEN = os.getenv("MARKET_PRE_OPEN", "0900-0915")
+MARKET_POST_CLOSE = os.getenv("MARKET_POST_CLOSE", "1540-1600")
+DEFAULT_SESSIONS = "0915-1530"
+
+PRE_OPEN, OPEN, POST_CLOSE, CLOSED = "pre_open", "open", "post_close", "closed"
+STATE_LABELS = {PRE_OPEN: "Pre-open", OPEN: "Open", POST_CLOSE: "Post-close", CLOSED: "Closed"}
+
+HOLIDAYS = None
+SESSIONS = None
+WINDOWS = {}  # day -> windows_on(day); only days near today are ever asked for
+
+
+def parse_windows(spec):
+    """"0915-1530|1815-1915:" -> [(time(9, 15), time(15, 30)), (time(18, 15), time(19, 15))]"""
+    windows = []
+    for part in spec.strip().rstrip(":").split("|"):
+        if not part:
+            continue
+        start, end = part.split("-")
+        windows.append((dtime(int(start[:2]), int(start[2:])), dtime(int(end[:2]), int(end[2:]))))
+    return windows
+
+
+def get_holidays():
+    global HOLIDAYS
+    if HOLIDAYS is None:
+        holidays = {}
+        try:
+            with open(MARKET_HOLIDAYS_FILE, newline="") as f:
+                for row in csv.DictReader(line for line in f if not line.startswith("#")):
+                    holidays[date.fromisoformat(row["date"])] = row["description"]
+        except OSError:
+            get_logger("calendar").warning("No holiday list at %s", MARKET_HOLIDAYS_FILE)
+        HOLIDAYS = holidays
+    return HOLIDAYS
+
+
+def get_sessions():
+    """Trading sessions from the most common trad_ses value in NSE_CM.csv."""
+    global SESSIONS
+    if SESSIONS is None:
+        spec = DEFAULT_SESSIONS
+        try:
+            with open(os.path.join(DATA_DIR, "NSE_CM.csv"), newline="") as f:
+                counts = Counter(row["trad_ses"] for row in csv.DictReader(f) if row.get("trad_ses"))
+            if counts:
+                spec = counts.most_common(1)[0][0]
+        except OSError:
+            pass
+        SESSIONS = parse_windows(spec)
+    return SESSIONS
+
+
+def is_trading_day(day):
+    return day.weekday() < 5 and day not in get_holidays()
+
+
+def windows_on(day):
+    """[(start, end, state)] IST datetimes of the windows in which prices can move on `day`."""
+    windows = WINDOWS.get(day)
+    if windows is None:
+        windows = WINDOWS[day] = _build_windows(day)
+    return windows
+
+
+def _build_windows(day):
+    if not is_trading_day(day):
+        return []
+    windows = [(start, end, PRE_OPEN) for start, end in parse_windows(MARKET_PRE_OPEN)]
+    windows += [(start, end, OPEN) for start, end in get_sessions()]
+    windows += [(start, end, POST_CLOSE) for start, end in parse_windows(MARKET_POST_CLOSE)]
+    return sorted(
+        (IST.localize(datetime.combine(day, start)), IST.localize(datetime.combine(day, end)), state)
+        for start, end, state in windows
+    )
+
+
+def now_ist():
+    return datetime.now(IST)
+
+
+def market_state(at=None):
+    at = at or now_ist()
+    for start, end, state in windows_on(at.date()):
+        if start <= at < end:
+            return state
+    return CLOSED
+
+
+def is_market_open(at=None):
+    return market_state(at) == OPEN
+
+
+def last_close(at=None):
+    """End of the most recent window before `at`: prices have not changed since."""
+    at = at or now_ist()
+    for back in range(15):
+        ends = [end for start, end, _ in windows_on(at.date() - timedelta(days=back)) if end <= at]
+        if ends:
+            return max(ends)
+    return at - timedelta(days=15)
+
+
+def next_open(at=None, states=(PRE_OPEN, OPEN, POST_CLOSE)):
+    """Start of the next window (of `states`) after `at`; by default when cached prices next go stale."""
+    at = at or now_ist()
+    for ahead in range(15):
+        starts = [
+            start for start, end, state in windows_on(at.date() + timedelta(days=ahead))
+            if start > at and state in states
+        ]
+        if starts:
+            return min(starts)
+    return at + timedelta(days=15)
+
+
+def last_session_day(at=None):
+    """The latest trading day whose regular sessions have all ended: its daily candle is final."""
+    at = at or now_ist()
+    day = at.date()
+    for _ in range(15):
+        ends = [end for start, end, state in windows_on(day) if state == OPEN]
+        if ends and max(ends) <= at:
+            return day
+        day -= timedelta(days=1)
+    return day
+
+
+def fresh_since(live_ttl, at=None):
+    """
+    Epoch seconds from which fetched market data is still current: the last live_ttl seconds
+    while prices can move, otherwise anything fetched after the last close (valid until next open).
+    Work it out once and compare timestamps against it, rather than calling cache_fresh per item.
+    """
+    at = at or now_ist()
+    if market_state(at) != CLOSED:
+        return at.timestamp() - live_ttl
+    return last_close(at).timestamp()
+
+
+def cache_fresh(fetched_at, live_ttl, at=None):
+    return fetched_at >= fresh_since(live_ttl, at)
+
+
+def market_status(at=None):
+    """State, label and next open time for the UI."""
+    at = at or now_ist()
+    state = market_state(at)
+    return {
+        "state": state,
+        "label": STATE_LABELS[state],
+        "holiday": get_holidays().get(at.date()),
+        "next_open": next_open(at, (OPEN,)) if state == CLOSED else None,
+    }
@@ -0,0 +1,177 @@
+import os, time
+from contextlib import contextmanager
+from flask import g, request, Response, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from utils.profiling import record_upstream_span
+from utils.logs import record_upstream_log
+from prometheus_client import (
+    Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, generate_latest, CONTENT_TYPE_LATEST, multiprocess
+)
+
+# When PROMETHEUS_MULTIPROC_DIR is set (see gunicorn.conf.py) every worker writes its samples
+# to mmap files in that directory and /metrics aggregates them, so any worker can answer a scrape.
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+ROUTE_LATENCY = Histogram(
+    "suwi_request_duration_seconds",
+    "Flask request latency by route",
+    ["route", "method", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_CALLS = Counter(
+    "suwi_upstream_calls_total",
+    "Calls to external services by outcome code",
+    ["upstream", "code"],
+)
+UPSTREAM_LATENCY = Histogram(
+    "suwi_upstream_duration_seconds",
+    "Latency of calls to external services",
+    ["upstream"],
+    buckets=LATENCY_BUCKETS,
+)
+CACHE_EVENTS = Counter(
+    "suwi_cache_events_total",
+    "Cache lookups by result (hit / miss / stale)",
+    ["cache", "result"],
+)
+CIRCUIT_STATE = Gauge(
+    "suwi_circuit_state",
+    "Circuit breaker state per upstream: 0 closed, 1 half-open, 2 open",
+    ["upstream"],
+    multiprocess_mode="livemostrecent",
+)
+UPSTREAM_REJECTED = Counter(
+    "suwi_upstream_rejected_total",
+    "Calls not made because the circuit was open or the rate limit was exhausted",
+    ["upstream", "reason"],
+)
+RATE_LIMIT_WAIT = Histogram(
+    "suwi_rate_limit_wait_seconds",
+    "Time a call waited for a rate-limit token",
+    ["limiter"],
+    buckets=(0, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 30, 60),
+)
+STRATEGY_LATENCY = Histogram(
+    "suwi_strategy_run_seconds",
+    "Time to evaluate one strategy and book its orders, per strategy kind",
+    ["kind"],
+    buckets=LATENCY_BUCKETS,
+)
+STRATEGY_ORDERS = Counter(
+    "suwi_strategy_orders_total",
+    "Paper orders from strategies by result (placed / rejected)",
+    ["kind", "result"],
+)
+DB_QUERIES = Histogram(
+    "suwi_db_queries_per_request",
+    "Number of SQL statements executed while serving a request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+
+
+def record_cache(cache, result):
+    """result is one of "hit", "miss", "stale" or "served_stale" (upstream down, old value returned)."""
+    CACHE_EVENTS.labels(cache, result).inc()
+
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def set_circuit_state(upstream, state):
+    CIRCUIT_STATE.labels(upstream).set(CIRCUIT_STATES[state])
+
+
+def record_rejected_call(upstream, reason):
+    """reason is "circuit_open" or "rate_limited"."""
+    UPSTREAM_REJECTED.labels(upstream, reason).inc()
+
+
+def record_strategy_run(kind, duration, placed, rejected):
+    STRATEGY_LATENCY.labels(kind).observe(duration)
+    if placed:
+        STRATEGY_ORDERS.labels(kind, "placed").inc(placed)
+    if rejected:
+        STRATEGY_ORDERS.labels(kind, "rejected").inc(rejected)
+
+
+class UpstreamCall:
+    def __init__(self):
+        self.code = "ok"
+
+    def set_fyers_response(self, resp):
+        """Fyers answers HTTP 200 with {"s": "error", "code": ...} on failure."""
+        if not isinstance(resp, dict):
+            self.code = "invalid"
+        elif resp.get("s") != "ok":
+            self.code = str(resp.get("code", "error"))
+
+    def set_http_response(self, resp):
+        self.code = str(resp.status_code)
+
+
+@contextmanager
+def upstream_call(upstream):
+    """
+    Times one call to an external service.
+        with upstream_call("fyers_quotes") as call:
+            resp = fyers.quotes(...)
+            call.set_fyers_response(resp)
+    """
+    call = UpstreamCall()
+    start = time.perf_counter()
+    try:
+        yield call
+    except Exception as e:
+        call.code = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        UPSTREAM_LATENCY.labels(upstream).observe(duration)
+        UPSTREAM_CALLS.labels(upstream, call.code).inc()
+        record_upstream_span(upstream, start, duration, call.code)
+        record_upstream_log(upstream, duration, call.code)
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and "_metrics_db_queries" in g:
+        g._metrics_db_queries += 1
+
+
+def _start_timer():
+    g._metrics_start = time.perf_counter()
+    g._metrics_db_queries = 0
+
+
+def _observe_request(response):
+    start = g.pop("_metrics_start", None)
+    if start is None:
+        return response
+    route = request.endpoint or "unmatched"
+    ROUTE_LATENCY.labels(route, request.method, str(response.status_code)).observe(time.perf_counter() - start)
+    DB_QUERIES.labels(route).observe(g.pop("_metrics_db_queries", 0))
+    return response
+
+
+def metrics_view():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return Response("Forbidden", status=403)
+
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app):
+    app.before_request(_start_timer)
+    app.after_request(_observe_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+    if not event.contains(Engine, "before_cursor_execute", _count_query):
+        event.listen(Engine, "before_cursor_execute", _count_query)
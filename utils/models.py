@@ -1,16 +1,17 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import String, Float, DateTime, Integer, LargeBinary, Numeric, Enum, ForeignKey
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, column_property
+from sqlalchemy import String, Float, DateTime, Integer, LargeBinary, Numeric, Enum, ForeignKey, Text, true
 from datetime import datetime
 import uuid
 from flask_login import UserMixin
+from utils.replica import RoutingSession
 
 # This is where the data lives
 # db = sqlite3.connect("transaction_data.db")
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class= Base)
+db = SQLAlchemy(model_class= Base, session_options={"class_": RoutingSession})
 
 class Transaction(db.Model):
     txn_id: Mapped[str] = mapped_column(String(40), primary_key=True, unique= True, default=lambda: str(uuid.uuid4().hex[:10]))
@@ -21,7 +22,7 @@ class Transaction(db.Model):
     quantity = mapped_column(Numeric(12, 4), nullable=False)
     execution_price = mapped_column(Numeric(12, 2), nullable=False)
     total_value = mapped_column(Numeric(14, 2), nullable=False)
-    timestamp: Mapped[datetime] = mapped_column(DateTime, default=datetime.now())
+    timestamp: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
     remarks: Mapped[str] = mapped_column(String(255))
     realised_pnl = mapped_column(Numeric(14, 2), nullable=True)
 
@@ -65,13 +66,16 @@ class Transaction(db.Model):
 class UserData(UserMixin, db.Model):
     user: Mapped[str] = mapped_column(String(100), primary_key= True, unique=True, nullable=False)
     password: Mapped[str] = mapped_column(String(200), nullable=False)
-    fyers_client_id =  mapped_column(LargeBinary, nullable=False)
-    fyers_secret_key =  mapped_column(LargeBinary, nullable=False)
-    fyers_refresh_token = mapped_column(LargeBinary, nullable=True)
-    google_api_key =  mapped_column(LargeBinary, nullable=False)
-    cx =  mapped_column(LargeBinary, nullable=False)
-    email = mapped_column(LargeBinary, unique=True, nullable=False)
+    # Encrypted blobs are deferred: the per-request user load skips them and the first access
+    # loads the whole "credentials" group in one query.
+    fyers_client_id =  mapped_column(LargeBinary, nullable=False, deferred=True, deferred_group="credentials")
+    fyers_secret_key =  mapped_column(LargeBinary, nullable=False, deferred=True, deferred_group="credentials")
+    fyers_refresh_token = mapped_column(LargeBinary, nullable=True, deferred=True, deferred_group="credentials")
+    google_api_key =  mapped_column(LargeBinary, nullable=False, deferred=True, deferred_group="credentials")
+    cx =  mapped_column(LargeBinary, nullable=False, deferred=True, deferred_group="credentials")
+    email = mapped_column(LargeBinary, unique=True, nullable=False, deferred=True)
     balance = mapped_column(Numeric(12, 2), default=100000)
+    fyers_connected = column_property(fyers_refresh_token.is_not(None))
 
     def get_id(self):
         return self.user
@@ -89,6 +93,98 @@ class UserData(UserMixin, db.Model):
             "balance" : self.balance
         }
 
-    @property
-    def fyers_connected(self):
-        return self.fyers_refresh_token is not None
+class PriceAlert(db.Model):
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id = mapped_column(String(100), ForeignKey("user_data.user"), nullable=False, index=True)
+    symbol: Mapped[str] = mapped_column(String(30), nullable=False)
+    field = mapped_column(Enum("lp", "chp", name="alert_field"), nullable=False)  # last price / % change
+    direction = mapped_column(Enum("ABOVE", "BELOW", name="alert_direction"), nullable=False)
+    threshold = mapped_column(Numeric(12, 2), nullable=False)
+    active: Mapped[bool] = mapped_column(default=True, index=True)
+    # False while the value is (or, at creation, was) already past the threshold: the alert only
+    # fires once the value has been on the other side, i.e. on a crossing.
+    armed: Mapped[bool] = mapped_column(default=True, server_default=true())
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    triggered_at = mapped_column(DateTime, nullable=True)
+
+class Notification(db.Model):
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id = mapped_column(String(100), ForeignKey("user_data.user"), nullable=False, index=True)
+    message: Mapped[str] = mapped_column(String(255), nullable=False)
+    link = mapped_column(String(255), nullable=True)
+    read: Mapped[bool] = mapped_column(default=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+# Lot accounting: accounts with a LotAccount row keep their open buy lots per (user, symbol),
+# and every sell closes lots (FIFO / LIFO, or FIFO order at average cost) into RealisedLot rows.
+class LotAccount(db.Model):
+    user_id = mapped_column(String(100), ForeignKey("user_data.user"), primary_key=True)
+    method = mapped_column(Enum("FIFO", "LIFO", "AVG", name="lot_method"), nullable=False, default="FIFO")
+
+class Lot(db.Model):
+    # Open lots of one (user, symbol) form a deque ordered by id: FIFO pops the lowest id, LIFO the highest.
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id = mapped_column(String(100), ForeignKey("user_data.user"), nullable=False)
+    symbol: Mapped[str] = mapped_column(String(30), nullable=False)
+    buy_txn_id = mapped_column(String(40), nullable=True)
+    opened_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    quantity = mapped_column(Numeric(12, 4), nullable=False)  # still open
+    price = mapped_column(Numeric(12, 2), nullable=False)  # cost basis per unit
+
+    __table_args__ = (db.Index("ix_lot_user_symbol", "user_id", "symbol", "id"),)
+
+class RealisedLot(db.Model):
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id = mapped_column(String(100), ForeignKey("user_data.user"), nullable=False, index=True)
+    symbol: Mapped[str] = mapped_column(String(30), nullable=False)
+    buy_txn_id = mapped_column(String(40), nullable=True)
+    sell_txn_id = mapped_column(String(40), nullable=True)
+    quantity = mapped_column(Numeric(12, 4), nullable=False)
+    buy_price = mapped_column(Numeric(12, 2), nullable=False)
+    sell_price = mapped_column(Numeric(12, 2), nullable=False)
+    opened_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    closed_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    realised_pnl = mapped_column(Numeric(14, 2), nullable=False)
+    term = mapped_column(Enum("SHORT", "LONG", name="gain_term"), nullable=False)
+
+# Cold ledger: transactions of archived periods live in Parquet files (see utils/archive.py),
+# folded into one carry-forward row per (user, symbol) that portfolio / P&L computations start from.
+class LedgerSummary(db.Model):
+    user_id = mapped_column(String(100), ForeignKey("user_data.user"), primary_key=True)
+    symbol: Mapped[str] = mapped_column(String(30), primary_key=True)
+    name: Mapped[str] = mapped_column(String(100), nullable=False)
+    quantity = mapped_column(Numeric(18, 6), nullable=False, default=0)
+    total_cost = mapped_column(Numeric(20, 6), nullable=False, default=0)  # average-cost basis of quantity
+    realised_pnl = mapped_column(Numeric(16, 2), nullable=False, default=0)
+    bought_value = mapped_column(Numeric(20, 2), nullable=False, default=0)
+    archived_through: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+class LedgerArchive(db.Model):
+    period: Mapped[str] = mapped_column(String(7), primary_key=True)  # YYYY-MM of the period start
+    path: Mapped[str] = mapped_column(String(255), nullable=False)
+    rows: Mapped[int] = mapped_column(Integer, nullable=False)
+    archived_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+# Rule-based strategies evaluated by the strategy runner (utils/strategies.py). params holds the
+# kind-specific settings as JSON; runs / orders / last_* are the per-strategy execution stats.
+class Strategy(db.Model):
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id = mapped_column(String(100), ForeignKey("user_data.user"), nullable=False, index=True)
+    name: Mapped[str] = mapped_column(String(100), nullable=False)
+    kind = mapped_column(Enum("SMA_CROSS", "REBALANCE", name="strategy_kind"), nullable=False)
+    params = mapped_column(Text, nullable=False)
+    interval_minutes: Mapped[int] = mapped_column(Integer, nullable=False, default=15)
+    active: Mapped[bool] = mapped_column(default=True, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    last_run_at = mapped_column(DateTime, nullable=True)
+    runs: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    orders: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_latency_ms = mapped_column(Float, nullable=True)
+    last_error = mapped_column(String(255), nullable=True)
+
+# Symbols a user follows on /watchlist. Together with held symbols they are what the quote
+# refresher keeps warm (utils/watchlists.py).
+class WatchlistItem(db.Model):
+    user_id = mapped_column(String(100), ForeignKey("user_data.user"), primary_key=True)
+    symbol: Mapped[str] = mapped_column(String(30), primary_key=True)
+    added_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
@@ -0,0 +1,98 @@
+from decimal import Decimal
+from utils.models import db, Transaction
+from utils.lots import lot_method, open_lot, close_lots, open_quantity
+from utils.stock_utils import calculate_portfolio, get_quantity_held
+from utils.leaderboard import record_leaderboard_trade
+
+# The one place a paper order is booked: the /buy and /sell forms and the strategy runner
+# (utils/strategies.py) all go through execute_order(), so they share the same checks, the same
+# lot bookkeeping and the same leaderboard updates. Orders are only added to the session;
+# commit_orders() commits a whole batch at once and then publishes the trades.
+
+
+class OrderRejected(Exception):
+    """The order failed validation; nothing was booked. The message is shown to the user."""
+
+
+def execute_order(user, side, symbol, name, qty, ltp, remarks=None, position=None):
+    """
+    Books one BUY / SELL of `qty` `symbol` at `ltp` for `user` (a UserData row): checks it, adds
+    the Transaction, moves the balance and opens / closes lots. Nothing is committed.
+    `position` ({"quantity", "avg_price"} from calculate_portfolio) saves the lookup for callers
+    that already have it, and is updated in place so a batch can book several orders from it.
+    Raises OrderRejected.
+    """
+    qty, ltp = Decimal(str(qty)), Decimal(str(ltp))
+    if not ltp:
+        raise OrderRejected("No valid price for this stock right now.")
+    if qty <= 0:
+        raise OrderRejected("Invalid quantity")
+    txn_val = qty * ltp
+    method = lot_method(user.user)
+
+    if side == "BUY":
+        if txn_val > user.balance:
+            raise OrderRejected("Your balance is not enough for this transaction")
+        realised_pnl = None
+    else:
+        if position is None:
+            if method:
+                # Lot accounts match against their open lots instead of replaying the whole ledger.
+                position = {"quantity": get_quantity_held(symbol, user.user), "avg_price": None}
+            else:
+                position = next((p for p in calculate_portfolio(user.user) if p["symbol"] == symbol),
+                                {"quantity": Decimal("0"), "avg_price": Decimal("0")})
+        if position["quantity"] < qty:
+            raise OrderRejected("You do not have enough quantity to sell.")
+        # The ledger and the lots can drift apart (e.g. lots not rebuilt after a restore); check
+        # before anything is booked, so close_lots never runs short halfway through a sale.
+        if method and open_quantity(user.user, symbol) < qty:
+            raise OrderRejected(f"Your open lots of {symbol} do not cover this sale. "
+                                "Ask an admin to rebuild your lots (flask rebuild-lots).")
+        realised_pnl = None if method else (ltp - Decimal(position["avg_price"])) * qty
+
+    transaction = Transaction(
+        user_id=user.user,
+        symbol=symbol,
+        name=name,
+        type=side,
+        quantity=qty,
+        execution_price=ltp,
+        total_value=txn_val,
+        realised_pnl=realised_pnl,
+        remarks=remarks,
+    )
+    db.session.add(transaction)
+    if side == "BUY":
+        user.balance -= txn_val
+        if method:
+            db.session.flush()
+            open_lot(user.user, symbol, qty, ltp, transaction.timestamp, transaction.txn_id)
+    else:
+        user.balance += txn_val
+        if method:
+            db.session.flush()
+            transaction.realised_pnl = close_lots(user.user, symbol, qty, ltp, transaction.timestamp, method,
+                                                  transaction.txn_id)
+
+    if position is not None:
+        held = Decimal(position["quantity"])
+        if side == "BUY":
+            avg = Decimal(position["avg_price"] or 0)
+            position["avg_price"] = (held * avg + txn_val) / (held + qty)
+            position["quantity"] = held + qty
+        else:
+            position["quantity"] = held - qty
+    return transaction
+
+
+def commit_orders(transactions):
+    """Commits the booked orders in one go, then feeds them to the leaderboard."""
+    # Read before the commit expires them, or every attribute access would be a SELECT; the flush
+    # assigns the txn_ids the leaderboard uses to tell its rebuild which trades it already has.
+    db.session.flush()
+    trades = [(t.user_id, t.symbol, t.type, t.quantity, t.execution_price, t.realised_pnl or 0, t.txn_id)
+              for t in transactions]
+    db.session.commit()
+    for trade in trades:
+        record_leaderboard_trade(*trade)
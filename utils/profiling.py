@@ -0,0 +1,262 @@
+import os, time, json, uuid, inspect, cProfile, pstats, threading
+from functools import wraps
+from flask import g, request, abort, jsonify, send_from_directory, has_app_context
+from flask_login import current_user, login_required
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Opt-in profiling of a single request: an admin adds "X-Profile: 1" (or ?_profile=1) and the
+# response carries an X-Profile-Id whose pstats / speedscope / SQL+upstream report can be
+# downloaded from /profiles/<id>/<kind>. Nothing is hooked unless a profiled request is running.
+# cProfile only sees the thread it is enabled in; async views run on asgiref's event-loop thread,
+# so their coroutine gets a second profiler there and the two are merged into one report.
+ADMIN_USERS = {u.strip() for u in os.getenv("ADMIN_USERS", "").split(",") if u.strip()}
+PROFILE_HEADER = "X-Profile"
+PROFILE_ARG = "_profile"
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILE_DIR = os.path.join(BASE_DIR, "../Data/profiles")
+
+PROFILE_FILES = {
+    "pstats": "{}.pstats",
+    "speedscope": "{}.speedscope.json",
+    "report": "{}.json",
+}
+
+_active = 0
+_active_lock = threading.Lock()
+
+
+def is_admin():
+    return current_user.is_authenticated and current_user.user in ADMIN_USERS
+
+
+def profiling_requested():
+    return request.headers.get(PROFILE_HEADER) == "1" or request.args.get(PROFILE_ARG) == "1"
+
+
+def record_upstream_span(upstream, start, duration, code):
+    """Called by utils.metrics.upstream_call for every external call."""
+    if has_app_context() and "_profile" in g:
+        g._profile["upstream"].append({
+            "upstream": upstream,
+            "start_ms": round((start - g._profile["start"]) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3),
+            "code": code,
+        })
+
+
+def _before_sql(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and "_profile" in g:
+        context._profile_start = time.perf_counter()
+
+
+def _after_sql(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_profile_start", None)
+    if start is None or not has_app_context() or "_profile" not in g:
+        return
+    g._profile["sql"].append({
+        "statement": statement,
+        "start_ms": round((start - g._profile["start"]) * 1000, 3),
+        "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+    })
+
+
+def _hook_sql():
+    global _active
+    with _active_lock:
+        _active += 1
+        if _active == 1:
+            event.listen(Engine, "before_cursor_execute", _before_sql)
+            event.listen(Engine, "after_cursor_execute", _after_sql)
+
+
+def _unhook_sql():
+    global _active
+    with _active_lock:
+        _active -= 1
+        if _active == 0:
+            event.remove(Engine, "before_cursor_execute", _before_sql)
+            event.remove(Engine, "after_cursor_execute", _after_sql)
+
+
+def to_speedscope(stats, name):
+    """
+    Converts cProfile stats to a speedscope "sampled" profile by walking the
+    caller -> callee edges from the root frames and weighting each stack by its self time.
+    Branches below 0.1% of the total time are dropped to keep the tree bounded.
+    """
+    frames, frame_index = [], {}
+    samples, weights = [], []
+    callees = {}
+    for func, (_cc, _nc, _tt, _ct, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge))
+
+    roots = [f for f, st in stats.stats.items() if not st[4]]
+    min_time = sum(stats.stats[r][3] for r in roots) * 0.001
+
+    def frame_id(func):
+        if func not in frame_index:
+            filename, line, fn_name = func
+            frame_index[func] = len(frames)
+            frames.append({"name": fn_name, "file": filename, "line": line})
+        return frame_index[func]
+
+    def walk(func, stack, self_time, cum_time):
+        stack = stack + [frame_id(func)]
+        if self_time > 0:
+            samples.append(stack)
+            weights.append(self_time)
+        total_child = sum(edge[3] for _, edge in callees.get(func, []))
+        # A function called from several places only spends part of its time under this stack.
+        scale = min(1.0, cum_time / total_child) if total_child else 0
+        for child, (_cc, _nc, tt, ct, *_rest) in callees.get(func, []):
+            if ct * scale < min_time or frame_index.get(child) in stack or len(stack) > 128:
+                continue
+            walk(child, stack, tt * scale, ct * scale)
+
+    for root in roots:
+        _cc, _nc, tt, ct, _callers = stats.stats[root]
+        walk(root, [], tt, ct)
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": samples,
+            "weights": weights,
+        }],
+        "name": name,
+        "exporter": "suwi",
+    }
+
+
+def _start_profile():
+    if not profiling_requested() or not is_admin():
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # Python 3.12+: another request is being profiled; serve this one unprofiled
+        return
+    _hook_sql()
+    g._profile_hooked = True
+    g._profile = {"start": time.perf_counter(), "sql": [], "upstream": []}
+    g._profiler = profiler
+
+
+def _profile_coroutine(view):
+    """Profiles an async view on the loop thread it actually runs on, when its request is profiled."""
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        if "_profiler" not in g:
+            return await view(*args, **kwargs)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # Python 3.12+: only one profiler at a time; keep the request thread's
+            return await view(*args, **kwargs)
+        try:
+            return await view(*args, **kwargs)
+        finally:
+            profiler.disable()
+            g._async_profiler = profiler
+    return wrapper
+
+
+def _finish_profile(response):
+    profiler = g.pop("_profiler", None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    profile = g.pop("_profile")
+
+    profile_id = uuid.uuid4().hex[:12]
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stats = pstats.Stats(profiler)
+    async_profiler = g.pop("_async_profiler", None)
+    if async_profiler is not None:
+        stats.add(async_profiler)
+    stats.dump_stats(os.path.join(PROFILE_DIR, PROFILE_FILES["pstats"].format(profile_id)))
+
+    name = f"{request.method} {request.path}"
+    with open(os.path.join(PROFILE_DIR, PROFILE_FILES["speedscope"].format(profile_id)), "w") as f:
+        json.dump(to_speedscope(stats, name), f)
+
+    report = {
+        "id": profile_id,
+        "request": name,
+        "user": current_user.user,
+        "status": response.status_code,
+        "created": time.time(),
+        "total_ms": round((time.perf_counter() - profile["start"]) * 1000, 3),
+        "sql_count": len(profile["sql"]),
+        "sql_ms": round(sum(q["duration_ms"] for q in profile["sql"]), 3),
+        "upstream_ms": round(sum(s["duration_ms"] for s in profile["upstream"]), 3),
+        "sql": profile["sql"],
+        "upstream": profile["upstream"],
+    }
+    with open(os.path.join(PROFILE_DIR, PROFILE_FILES["report"].format(profile_id)), "w") as f:
+        json.dump(report, f)
+
+    response.headers["X-Profile-Id"] = profile_id
+    return response
+
+
+def _end_profile(exc):
+    # Runs even when the view raised and after_request was skipped: never leave a profiler
+    # enabled or the SQL listeners attached.
+    profiler = g.pop("_profiler", None)
+    if profiler is not None:
+        profiler.disable()
+    if g.pop("_profile_hooked", False):
+        _unhook_sql()
+
+
+@login_required
+def list_profiles():
+    if not is_admin():
+        abort(403)
+    if not os.path.isdir(PROFILE_DIR):
+        return jsonify([])
+
+    reports = []
+    for filename in os.listdir(PROFILE_DIR):
+        if filename.endswith(".json") and not filename.endswith(".speedscope.json"):
+            with open(os.path.join(PROFILE_DIR, filename)) as f:
+                report = json.load(f)
+            reports.append({k: report[k] for k in ("id", "request", "user", "status", "created", "total_ms", "sql_count")})
+    reports.sort(key=lambda r: r["created"], reverse=True)
+    return jsonify(reports)
+
+
+@login_required
+def download_profile(profile_id, kind):
+    if not is_admin():
+        abort(403)
+    if kind not in PROFILE_FILES or not profile_id.isalnum():
+        abort(404)
+    return send_from_directory(os.path.abspath(PROFILE_DIR), PROFILE_FILES[kind].format(profile_id), as_attachment=True)
+
+
+def init_profiling(app):
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.teardown_request(_end_profile)
+
+    ensure_sync = app.ensure_sync
+
+    def profiled_ensure_sync(func):
+        if inspect.iscoroutinefunction(func):
+            func = _profile_coroutine(func)
+        return ensure_sync(func)
+
+    app.ensure_sync = profiled_ensure_sync
+    app.add_url_rule("/profiles", "list_profiles", list_profiles)
+    app.add_url_rule("/profiles/<profile_id>/<kind>", "download_profile", download_profile)
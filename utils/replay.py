@@ -0,0 +1,188 @@
+import os, json, time
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from utils.api_client import fyers_get
+from utils.resilience import UpstreamUnavailable
+from utils.logs import get_logger
+
+# Replay mode drives quotes from recorded 1-minute candles instead of the broker, so trading and
+# valuation work against a moving market outside 09:15-15:30. The replay clock is a pure function
+# of wall time (REPLAY_EPOCH, REPLAY_SPEED), so every gunicorn worker sees the same market.
+REPLAY_MODE = os.getenv("REPLAY_MODE", "0") == "1"
+REPLAY_SPEED = float(os.getenv("REPLAY_SPEED", "1"))  # 1, 10, 100 ...
+REPLAY_DATE = os.getenv("REPLAY_DATE")  # YYYY-MM-DD, defaults to the latest recorded session
+REPLAY_EPOCH = float(os.getenv("REPLAY_EPOCH", "0"))
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "../Data"))
+REPLAY_DIR = os.path.join(DATA_DIR, "replay")
+
+SESSIONS = {}  # date -> {symbol: {"prev_close", "candles", "ts"}}
+log = get_logger("replay")
+
+
+def replay_enabled():
+    return REPLAY_MODE
+
+
+def symbol_file(date, symbol):
+    return os.path.join(REPLAY_DIR, date, symbol.replace(":", "_") + ".json")
+
+
+def recorded_dates():
+    if not os.path.isdir(REPLAY_DIR):
+        return []
+    return sorted(d for d in os.listdir(REPLAY_DIR) if os.path.isdir(os.path.join(REPLAY_DIR, d)))
+
+
+def replay_date():
+    if REPLAY_DATE:
+        return REPLAY_DATE
+    dates = recorded_dates()
+    return dates[-1] if dates else None
+
+
+def load_symbol(date, symbol):
+    session = SESSIONS.setdefault(date, {})
+    if symbol not in session:
+        path = symbol_file(date, symbol)
+        if not os.path.exists(path):
+            session[symbol] = None
+        else:
+            with open(path) as f:
+                data = json.load(f)
+            candles = data["candles"]
+            data["ts"] = [c[0] for c in candles]
+            # Running high / low / volume before each candle, so a quote is a single bisect.
+            data["high_before"], data["low_before"], data["volume_before"] = [], [], []
+            high, low, volume = float("-inf"), float("inf"), 0
+            for c in candles:
+                data["high_before"].append(high)
+                data["low_before"].append(low)
+                data["volume_before"].append(volume)
+                high, low, volume = max(high, c[2]), min(low, c[3]), volume + c[5]
+            session[symbol] = data if candles else None
+    return session[symbol]
+
+
+def session_bounds(date):
+    """Market session of the replayed day in epoch seconds (09:15-15:30 IST)."""
+    day = datetime.strptime(date, "%Y-%m-%d")
+    # IST is UTC+05:30 and has no DST
+    open_ts = (day - datetime(1970, 1, 1)).total_seconds() + (9 * 3600 + 15 * 60) - 19800
+    return open_ts, open_ts + 375 * 60
+
+
+def replay_clock(date, now=None):
+    """Session time currently being replayed; loops back to the open after the close."""
+    start, end = session_bounds(date)
+    now = time.time() if now is None else now
+    elapsed = ((now - REPLAY_EPOCH) * REPLAY_SPEED) % (end - start)
+    return start + elapsed
+
+
+def synthetic_quote(symbol, data, at):
+    """Builds a Fyers-shaped quote from the candles up to session time `at`."""
+    i = max(0, bisect_right(data["ts"], at) - 1)
+    candles = data["candles"]
+    ts, o, h, l, c, v = candles[i]
+    # Interpolate inside the current minute so the price moves between candle closes.
+    frac = min(1.0, max(0.0, (at - ts) / 60))
+    lp = round(o + (c - o) * frac, 2)
+    open_price = candles[0][1]
+    prev_close = data.get("prev_close") or open_price
+    spread = round(max(0.05, lp * 0.0005), 2)
+    return {
+        "n": symbol,
+        "s": "ok",
+        "v": {
+            "symbol": symbol,
+            "short_name": symbol[4:].split("-")[0],
+            "exchange": "NSE",
+            "lp": lp,
+            "prev_close_price": prev_close,
+            "open_price": open_price,
+            "high_price": max(data["high_before"][i], lp),
+            "low_price": min(data["low_before"][i], lp),
+            "ch": round(lp - prev_close, 2),
+            "chp": round((lp - prev_close) / prev_close * 100, 2) if prev_close else 0,
+            "ask": round(lp + spread / 2, 2),
+            "bid": round(lp - spread / 2, 2),
+            "spread": spread,
+            "volume": int(data["volume_before"][i] + v * frac),
+            "tt": int(at),
+            "replay": True,
+        },
+    }
+
+
+def replay_quotes(symbols, now=None):
+    """Quotes for `symbols` at the current replay time; symbols with no recording are left out."""
+    date = replay_date()
+    if not date:
+        return []
+    at = replay_clock(date, now)
+    quotes = []
+    for symbol in symbols:
+        data = load_symbol(date, symbol)
+        if data:
+            quotes.append(synthetic_quote(symbol, data, at))
+    return quotes
+
+
+def iter_ticks(symbols, date=None):
+    """
+    Yields (session_time, quotes) for every recorded minute of a session, without sleeping.
+    A deterministic, full-rate tick source for stress-testing the pricing paths.
+    """
+    date = date or replay_date()
+    start, end = session_bounds(date)
+    at = start
+    while at < end:
+        quotes = []
+        for symbol in symbols:
+            data = load_symbol(date, symbol)
+            if data:
+                quotes.append(synthetic_quote(symbol, data, at + 59))
+        yield at, quotes
+        at += 60
+
+
+def record_session(fyers, symbols, date):
+    """
+    Fetches 1-minute candles for `date` plus the previous close for every symbol and stores them
+    under Data/replay/<date>/. Returns the number of symbols recorded.
+    """
+    os.makedirs(os.path.join(REPLAY_DIR, date), exist_ok=True)
+    day = datetime.strptime(date, "%Y-%m-%d")
+    recorded = 0
+    for symbol in symbols:
+        # max_wait=None: a recording job queues for rate-limit tokens instead of giving up.
+        try:
+            intraday = fyers_get("history", fyers.header, {
+                "symbol": symbol,
+                "resolution": "1",
+                "date_format": "1",
+                "range_from": date,
+                "range_to": date,
+            }, "fyers_history", max_wait=None)
+            if intraday.get("s") != "ok" or not intraday.get("candles"):
+                continue
+
+            daily = fyers_get("history", fyers.header, {
+                "symbol": symbol,
+                "resolution": "1D",
+                "date_format": "1",
+                "range_from": (day - timedelta(days=10)).strftime("%Y-%m-%d"),
+                "range_to": (day - timedelta(days=1)).strftime("%Y-%m-%d"),
+            }, "fyers_history", max_wait=None)
+        except UpstreamUnavailable as e:
+            log.warning("Recording stopped: %s", e, extra={"symbol": symbol, "date": date})
+            break
+        prev = daily.get("candles") or []
+
+        with open(symbol_file(date, symbol), "w") as f:
+            json.dump({"prev_close": prev[-1][4] if prev else None, "candles": intraday["candles"]}, f)
+        recorded += 1
+    SESSIONS.pop(date, None)
+    return recorded
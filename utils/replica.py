@@ -0,0 +1,66 @@
+import os, time
+from functools import wraps
+from flask import g, session, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+# Optional read replica. With DB_REPLICA_URI set, views marked @read_only send their SELECTs to
+# the "replica" bind; flushes and INSERT/UPDATE/DELETE statements always go to the primary.
+# After a request writes, that browser session reads from the primary for
+# READ_YOUR_WRITES_SECONDS, so a user sees their own trade even if the replica lags.
+REPLICA_BIND = "replica"
+DB_REPLICA_URI = os.getenv("DB_REPLICA_URI")
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "10"))
+STICKY_KEY = "_db_primary_until"
+
+
+def replica_enabled():
+    return bool(DB_REPLICA_URI)
+
+
+def use_replica():
+    return (
+        has_request_context()
+        and g.get("_db_read_only", False)
+        and session.get(STICKY_KEY, 0) < time.time()
+    )
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if self._flushing or isinstance(clause, UpdateBase):
+                if has_request_context():
+                    g._db_wrote = True
+            elif use_replica():
+                engine = self._db.engines.get(REPLICA_BIND)
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(view):
+    """Marks a view whose queries may be served by the replica."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g._db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _stick_to_primary(response):
+    # Writes made as a side effect of a read-only view (e.g. alert evaluation) don't count.
+    if g.get("_db_wrote") and not g.get("_db_read_only"):
+        session[STICKY_KEY] = time.time() + READ_YOUR_WRITES_SECONDS
+    return response
+
+
+def init_replica(app, engine_options):
+    """Registers the replica bind; call before db.init_app(app)."""
+    if not replica_enabled():
+        return
+    uri = DB_REPLICA_URI
+    if uri.startswith("postgres://"):
+        uri = uri.replace("postgres://", "postgresql+psycopg://", 1)
+    app.config["SQLALCHEMY_BINDS"] = {REPLICA_BIND: {"url": uri, **engine_options}}
+    app.after_request(_stick_to_primary)
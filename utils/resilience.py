@@ -0,0 +1,204 @@
+import os, re, json, time, threading
+from contextlib import contextmanager
+from utils.metrics import set_circuit_state, record_rejected_call, RATE_LIMIT_WAIT
+from utils.logs import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows dev box: state is still shared by threads, not by processes
+    fcntl = None
+
+# Guards every call to the Fyers data API:
+#   - a token-bucket rate limiter per Fyers app (client_id), one bucket per published limit
+#     (FYERS_RATE_LIMITS, "<requests>/<seconds>" pairs). Callers reserve a token and sleep until it
+#     is due; if that would take longer than RATE_LIMIT_MAX_WAIT the call is not made at all.
+#   - a circuit breaker that opens after BREAKER_FAILURES consecutive failures (timeouts, network
+#     errors, 429 and 5xx; a call slower than BREAKER_SLOW_SECONDS counts as a failure), rejects
+#     calls for BREAKER_COOLDOWN seconds, then lets one probe call through (half-open) and closes
+#     again if it succeeds.
+# Both keep their state in small JSON files under RESILIENCE_DIR, updated under an exclusive
+# file lock, so all gunicorn workers (and CLI jobs) share one budget and one breaker.
+# Rejected calls raise UpstreamUnavailable; stock_utils answers those with the last cached value.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "../Data"))
+RESILIENCE_DIR = os.getenv("RESILIENCE_DIR", os.path.join(DATA_DIR, "resilience"))
+
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+FYERS_RATE_LIMITS = os.getenv("FYERS_RATE_LIMITS", "10/1,200/60,100000/86400")
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "2"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_SLOW_SECONDS = float(os.getenv("BREAKER_SLOW_SECONDS", "3"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+_lock = threading.Lock()
+log = get_logger("resilience")
+
+
+class UpstreamUnavailable(Exception):
+    """The call was not made (circuit open / rate limit exhausted) or the upstream failed."""
+
+
+def parse_limits(spec):
+    limits = []
+    for part in spec.split(","):
+        count, seconds = part.strip().split("/")
+        limits.append((int(count), float(seconds)))
+    return limits
+
+
+def _state_path(name):
+    return os.path.join(RESILIENCE_DIR, re.sub(r"[^\w.-]", "_", name) + ".json")
+
+
+@contextmanager
+def shared_state(name):
+    """Read-modify-write of one JSON state dict, serialised across threads and worker processes."""
+    os.makedirs(RESILIENCE_DIR, exist_ok=True)
+    with _lock, open(_state_path(name), "a+") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            try:
+                state = json.loads(f.read() or "{}")
+            except ValueError:
+                state = {}
+            yield state
+            f.seek(0)
+            f.truncate()
+            json.dump(state, f)
+            f.flush()
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_state(name):
+    try:
+        with open(_state_path(name)) as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_SH)
+            return json.loads(f.read() or "{}")
+    except (OSError, ValueError):
+        return {}
+
+
+class RateLimiter:
+    def __init__(self, name, limits):
+        self.name = name
+        self.limits = limits
+
+    def reserve(self, key, max_wait=RATE_LIMIT_MAX_WAIT):
+        """
+        Takes one token from every bucket of `key` and returns how long to sleep before using it,
+        or None (nothing taken) if that is more than `max_wait` seconds. max_wait=None always waits.
+        """
+        now = time.time()
+        with shared_state(f"ratelimit-{self.name}-{key}") as state:
+            buckets, wait = {}, 0.0
+            for count, seconds in self.limits:
+                tokens, updated = state.get(str(seconds), (count, now))
+                # Tokens may go negative: that many callers are already queued for future tokens.
+                tokens = min(count, tokens + (now - updated) * count / seconds)
+                buckets[str(seconds)] = tokens
+                wait = max(wait, (1 - tokens) * seconds / count)
+
+            if max_wait is not None and wait > max_wait:
+                state.update({k: (tokens, now) for k, tokens in buckets.items()})
+                return None
+            state.update({k: (tokens - 1, now) for k, tokens in buckets.items()})
+        RATE_LIMIT_WAIT.labels(self.name).observe(wait)
+        return wait
+
+
+class CircuitBreaker:
+    def __init__(self, name):
+        self.name = name
+
+    def allow(self):
+        """Whether a call may go ahead now; in half-open state only one probe is let through."""
+        now = time.time()
+        with shared_state(f"breaker-{self.name}") as state:
+            current = state.get("state", CLOSED)
+            if current == CLOSED:
+                allowed = True
+            elif current == OPEN:
+                allowed = now - state["opened_at"] >= BREAKER_COOLDOWN
+            else:
+                # A probe that never reported back (worker killed, call rejected) is replaced.
+                allowed = now - state["probe_at"] > UPSTREAM_TIMEOUT + RATE_LIMIT_MAX_WAIT
+            if allowed and current != CLOSED:
+                state.update(state=HALF_OPEN, probe_at=now)
+            current = state.get("state", CLOSED)
+        set_circuit_state(self.name, current)
+        return allowed
+
+    def record(self, ok, reason=None):
+        now = time.time()
+        with shared_state(f"breaker-{self.name}") as state:
+            previous = state.get("state", CLOSED)
+            if ok:
+                state.clear()
+                state["state"] = CLOSED
+            else:
+                state["failures"] = state.get("failures", 0) + 1
+                if previous == HALF_OPEN or (previous == CLOSED and state["failures"] >= BREAKER_FAILURES):
+                    state.update(state=OPEN, opened_at=now, reason=reason)
+                    state.setdefault("since", now)
+            current = state.get("state", CLOSED)
+        if current != previous:
+            log.warning("Circuit %s: %s -> %s", self.name, previous, current, extra={"reason": reason})
+        set_circuit_state(self.name, current)
+
+    def status(self):
+        """{"state", "since", "retry_in", "reason"} for the UI; `since` is when it first opened."""
+        state = read_state(f"breaker-{self.name}")
+        current = state.get("state", CLOSED)
+        retry_in = None
+        if current == OPEN:
+            retry_in = max(0, int(state["opened_at"] + BREAKER_COOLDOWN - time.time()))
+        return {"state": current, "since": state.get("since"), "retry_in": retry_in, "reason": state.get("reason")}
+
+
+FYERS_LIMITER = RateLimiter("fyers", parse_limits(FYERS_RATE_LIMITS))
+FYERS_BREAKER = CircuitBreaker("fyers")
+
+
+def fyers_failure(resp):
+    """Why a Fyers response counts against the breaker, or None. Auth and input errors don't."""
+    if not isinstance(resp, dict):
+        return "invalid response"
+    if resp.get("s") == "ok":
+        return None
+    code = resp.get("code")
+    if code == -99 or code == 429 or (isinstance(code, int) and code >= 500):
+        return (resp.get("message") or f"code {code}")[:120]
+    return None
+
+
+def acquire_fyers(header, upstream, max_wait=RATE_LIMIT_MAX_WAIT):
+    """
+    Seconds to wait before making a Fyers call with `header` ("client_id:token").
+    Raises UpstreamUnavailable if the circuit is open or the rate limit can't be met in time.
+    """
+    if not FYERS_BREAKER.allow():
+        record_rejected_call(upstream, "circuit_open")
+        raise UpstreamUnavailable("Fyers circuit is open")
+    wait = FYERS_LIMITER.reserve(header.split(":")[0], max_wait)
+    if wait is None:
+        record_rejected_call(upstream, "rate_limited")
+        raise UpstreamUnavailable("Fyers rate limit reached")
+    return wait
+
+
+def release_fyers(resp, duration):
+    """Reports a finished Fyers call to the breaker; raises UpstreamUnavailable if it failed."""
+    reason = fyers_failure(resp)
+    if reason is None and duration > BREAKER_SLOW_SECONDS:
+        FYERS_BREAKER.record(False, f"slow response ({duration:.1f}s)")
+        return
+    FYERS_BREAKER.record(reason is None, reason)
+    if reason is not None:
+        raise UpstreamUnavailable(reason)
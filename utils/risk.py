@@ -0,0 +1,155 @@
+import os, hashlib, threading
+from collections import OrderedDict
+from datetime import date
+from utils.stock_utils import load_history, get_historic_data
+
+# Portfolio risk from the local daily-candle cache (stock_utils.save_history): the held symbols
+# and the benchmark are aligned on the benchmark's trading days into one returns matrix, and
+# every figure below is a few NumPy reductions over it. Histories are only fetched when the
+# cached ones are out of date (stock_utils.cached_history). Results are memoized per
+# (positions hash, as-of date), so repeat views of the same holdings on the same day are free.
+RISK_BENCHMARK = os.getenv("RISK_BENCHMARK", "NSE:NIFTY50-INDEX")
+RISK_LOOKBACK_DAYS = int(os.getenv("RISK_LOOKBACK_DAYS", "250"))  # trading days of returns
+RISK_MIN_OBSERVATIONS = int(os.getenv("RISK_MIN_OBSERVATIONS", "60"))
+RISK_CACHE_SIZE = 256
+TRADING_DAYS = 252
+IST_OFFSET = 19800
+
+# One-sided normal quantiles for parametric VaR.
+CONFIDENCE_Z = {0.95: 1.6448536, 0.99: 2.3263479}
+
+RISK_CACHE = OrderedDict()  # (positions hash, as-of date) -> report
+_lock = threading.Lock()
+
+
+def positions_hash(positions):
+    key = ";".join(f"{p['symbol']}={p['quantity']}" for p in sorted(positions, key=lambda p: p["symbol"]))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def refresh_histories(symbols):
+    """Makes sure a current year of candles is cached for symbols. False if any fetch was refused."""
+    complete = True
+    for symbol in symbols:
+        resp = get_historic_data(symbol, "1Y")
+        if resp.get("s") != "ok" or resp.get("stale"):
+            complete = False
+    return complete
+
+
+def closes_by_day(symbol):
+    """{IST day number: close} from the cached daily candles."""
+    return {(c[0] + IST_OFFSET) // 86400: c[4] for c in load_history(symbol)}
+
+
+def returns_matrix(symbols):
+    """
+    Daily simple returns, shape (days, 1 + len(symbols)), column 0 the benchmark, on the last
+    RISK_LOOKBACK_DAYS benchmark trading days. A missing close carries the previous one forward.
+    Symbols with fewer than RISK_MIN_OBSERVATIONS closes in the window are left out.
+    Returns (matrix, kept symbols, left-out symbols, last closes of kept symbols).
+    """
+    import numpy as np
+    benchmark = closes_by_day(RISK_BENCHMARK)
+    days = sorted(benchmark)[-(RISK_LOOKBACK_DAYS + 1):]
+    if len(days) <= RISK_MIN_OBSERVATIONS:
+        return None, [], list(symbols), None
+
+    prices = np.full((len(days), len(symbols) + 1), np.nan)
+    prices[:, 0] = [benchmark[d] for d in days]
+    kept, skipped = [], []
+    for symbol in symbols:
+        closes = closes_by_day(symbol)
+        column = np.array([closes.get(d, np.nan) for d in days])
+        if np.count_nonzero(~np.isnan(column)) < RISK_MIN_OBSERVATIONS:
+            skipped.append(symbol)
+            continue
+        kept.append(symbol)
+        prices[:, len(kept)] = column
+    prices = prices[:, :len(kept) + 1]
+
+    # Forward-fill gaps (suspensions, late listings), then start where every column has a price.
+    idx = np.where(np.isnan(prices), 0, np.arange(len(days))[:, None])
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    prices = prices[idx, np.arange(prices.shape[1])]
+    first = int(np.argmax(~np.isnan(prices).any(axis=1)))
+    prices = prices[first:]
+
+    returns = prices[1:] / prices[:-1] - 1
+    return returns, kept, skipped, prices[-1, 1:]
+
+
+def value_at_risk(pnl_returns, value):
+    """1-day historical and parametric (normal) VaR, plus historical expected shortfall, in ₹."""
+    import numpy as np
+    mean, std = pnl_returns.mean(), pnl_returns.std(ddof=1)
+    var = {}
+    for confidence, z in CONFIDENCE_Z.items():
+        cutoff = np.quantile(pnl_returns, 1 - confidence)
+        var[confidence] = {
+            "historical": -cutoff * value,
+            "parametric": (z * std - mean) * value,
+            "shortfall": -pnl_returns[pnl_returns <= cutoff].mean() * value,
+        }
+    return var
+
+
+def compute_risk(positions):
+    import numpy as np
+    symbols = [p["symbol"] for p in positions]
+    returns, kept, skipped, last = returns_matrix(symbols)
+    if returns is None or not kept:
+        return {"positions": [], "skipped": skipped, "portfolio": None, "correlation": None, "labels": []}
+
+    quantity = {p["symbol"]: float(p["quantity"]) for p in positions}
+    values = np.array([quantity[s] for s in kept]) * last
+    weights = values / values.sum()
+
+    market, assets = returns[:, 0], returns[:, 1:]
+    market_var = market.var(ddof=1)
+    centered = assets - assets.mean(axis=0)
+    betas = centered.T @ (market - market.mean()) / (len(market) - 1) / market_var
+    vols = assets.std(axis=0, ddof=1) * np.sqrt(TRADING_DAYS)
+
+    portfolio_returns = assets @ weights
+    total = float(values.sum())
+    return {
+        "observations": len(returns),
+        "positions": [
+            {"symbol": s, "value": float(v), "weight": float(w), "volatility": float(vol), "beta": float(b)}
+            for s, v, w, vol, b in zip(kept, values, weights, vols, betas)
+        ],
+        "skipped": skipped,
+        "portfolio": {
+            "value": total,
+            "volatility": float(portfolio_returns.std(ddof=1) * np.sqrt(TRADING_DAYS)),
+            "beta": float(weights @ betas),
+            "benchmark_volatility": float(market.std(ddof=1) * np.sqrt(TRADING_DAYS)),
+            "var": value_at_risk(portfolio_returns, total),
+        },
+        "labels": kept,
+        "correlation": np.corrcoef(assets, rowvar=False).reshape(len(kept), len(kept)).tolist(),
+    }
+
+
+def portfolio_risk(positions, as_of=None):
+    """
+    Risk report for positions ([{"symbol", "quantity"}, ...]) as of today: per-position
+    volatility and beta, portfolio volatility, beta and VaR, and the correlation matrix.
+    """
+    key = (positions_hash(positions), as_of or date.today())
+    with _lock:
+        if key in RISK_CACHE:
+            RISK_CACHE.move_to_end(key)
+            return RISK_CACHE[key]
+
+    complete = refresh_histories([RISK_BENCHMARK] + [p["symbol"] for p in positions])
+    report = compute_risk(positions)
+    report["complete"] = complete
+    # A report built while Fyers refused some fetches is shown but not kept.
+    if complete:
+        with _lock:
+            RISK_CACHE[key] = report
+            while len(RISK_CACHE) > RISK_CACHE_SIZE:
+                RISK_CACHE.popitem(last=False)
+    return report
@@ -1,22 +1,44 @@
 import datetime
-import os, json, time, requests
+import os, json, time, hashlib, threading, requests
 from datetime import timedelta, datetime
 from sqlalchemy import func
-import pandas as pd
-from utils.api_client import get_fyers_credentials, get_fyers_access_token
-from fyers_apiv3 import fyersModel
+from utils.api_client import get_fyers_credentials, get_fyers_access_token, get_fyers_model, get_secret, fyers_get
 from utils.crypto_utils import decrypt, encrypt
 from flask_login import current_user
-from utils.models import db, Transaction
+from utils.models import db, Transaction, LedgerSummary
 from flask import g
 from decimal import Decimal
-
-CACHE_TTL = 30  # seconds (adjust: 5–30s for market data)
+from utils.metrics import upstream_call, record_cache
+from utils.replay import replay_enabled, replay_quotes, REPLAY_SPEED, REPLAY_DIR
+from utils.resilience import UpstreamUnavailable
+from utils.market_calendar import fresh_since, market_state, CLOSED
+from utils.candle_store import read_candles, stored_at
+from utils.logs import get_logger
+
+CACHE_TTL = 30  # seconds while the market is open; cached quotes last until the next open otherwise
+CANDLE_TTL = int(os.getenv("CANDLE_TTL", "300"))
+NEWS_TTL = int(os.getenv("NEWS_TTL", "900"))
 NAME_MAP = None
+EQ_SYMBOLS = None
+GOOGLE_CSE_URL = os.getenv("GOOGLE_CSE_URL", "https://www.googleapis.com/customsearch/v1")
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, "../Data")
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "../Data"))
 os.makedirs(DATA_DIR, exist_ok=True)
+# Last good daily candles per symbol, served (flagged stale) while Fyers is unavailable.
+HISTORY_CACHE_DIR = os.path.join(DATA_DIR, "history_cache")
+NEWS_CACHE_DIR = os.path.join(DATA_DIR, "news_cache")
+
+quotes_log = get_logger("quotes")
+history_log = get_logger("history")
+
+QUOTE_LISTENERS = []
+
+
+def on_quote_refresh(listener):
+    """Registers listener(quotes), called with the enriched quotes after every quote-cache refresh."""
+    QUOTE_LISTENERS.append(listener)
+    return listener
 
 
 def write_equity_data(n):
@@ -25,6 +47,7 @@ def write_equity_data(n):
     eq_names_path = os.path.join(DATA_DIR, "NSE_EQ_names.csv")
     eq_only_path = os.path.join(DATA_DIR, "NSE_EQ_only.csv")
 
+    import pandas as pd
     data = pd.read_csv(input_path, header=0)
     df = pd.DataFrame(data)
 
@@ -77,49 +100,103 @@ def enrich_stock_data(stock: dict) -> dict:
     return stock
 
 
-def get_database(symbols=None):
+def get_equity_symbols():
+    global EQ_SYMBOLS
+    if EQ_SYMBOLS is None:
+        import pandas as pd
+        path = os.path.join(DATA_DIR, "NSE_EQ_only.csv")
+        df = pd.read_csv(path)
+        EQ_SYMBOLS = df["symbol"].tolist()
+    return list(EQ_SYMBOLS)
+
+
+def get_fyers_client():
+    """The user's FyersModel, or None if they must reconnect. Raises UpstreamUnavailable (token refresh)."""
     access_token = get_fyers_access_token()
     if not access_token:
         return None
 
     creds = get_fyers_credentials()
-    fyers = fyersModel.FyersModel(
+    return get_fyers_model().FyersModel(
         client_id=creds["client_id"],
         token=access_token,
         is_async=False,
         log_path=""
     )
 
-    cache_file = os.path.join(DATA_DIR, "stock_cache.json")
-    cache = {}
 
+def fetch_quotes(symbols, fyers):
+    """
+    Raw Fyers quote dicts for symbols, from the broker or, in replay mode, from recorded candles.
+    Raises UpstreamUnavailable while the broker is down or rate-limiting us.
+    """
+    if replay_enabled():
+        return replay_quotes(symbols)
+
+    response = fyers_get("quotes", fyers.header, {"symbols": ",".join(symbols)}, "fyers_quotes")
+    return response.get("d", [])
+
+
+def quote_fresh_since():
+    """Cached quotes fetched at or after this epoch are fresh."""
+    # A replayed market moves REPLAY_SPEED times faster, so the cache must expire that much sooner.
+    if replay_enabled():
+        return time.time() - CACHE_TTL / REPLAY_SPEED
+    return fresh_since(CACHE_TTL)
+
+
+def quote_cache_file():
+    # Replayed quotes live in their own file, so switching replay off never serves them as live prices.
+    if replay_enabled():
+        return os.path.join(REPLAY_DIR, "stock_cache.json")
+    return os.path.join(DATA_DIR, "stock_cache.json")
+
+
+def quote_is_fresh(entry, since):
+    """Whether a quote-cache entry was fetched at or after `since` (and, outside replay, is not a replayed one)."""
+    return entry["timestamp"] >= since and (replay_enabled() or not entry["data"]["v"].get("replay"))
+
+
+def load_quote_cache():
+    cache_file = quote_cache_file()
     if os.path.exists(cache_file):
         try:
             with open(cache_file, "r") as f:
-                cache = json.load(f)
+                return json.load(f)
         except Exception:
-            cache = {}
+            pass
+    return {}
 
-    now = time.time()
 
-    if cache:
-        required_symbols = set(symbols) if symbols else set(cache.keys())
-        if all(
-            s in cache and now - cache[s]["timestamp"] < CACHE_TTL
-            for s in required_symbols
-        ):
-            return [enrich_stock_data(cache[s]["data"]) for s in required_symbols]
+def snapshot_version(cache, symbols, stale=False):
+    """
+    Identifies the quote snapshot a page is rendered from, to key cached fragments: the oldest
+    fetch time among the symbols' cached quotes. A full refresh changes it; a partial write of a
+    few symbols (a watchlist view, a refresher batch) does not.
+    """
+    return min((cache[s]["timestamp"] for s in symbols if s in cache), default=0), stale
 
-    eq_list = symbols
-    if not eq_list:
-        path = os.path.join(DATA_DIR, "NSE_EQ_only.csv")
-        df = pd.read_csv(path)
-        eq_list = df["symbol"].tolist()
-
-    response = fyers.quotes({"symbols": ",".join(eq_list)})
-    raw = response.get("d", [])
 
+def stale_quotes(cache, symbols):
+    """Cached quotes for symbols, enriched and flagged v["stale"], with v["as_of"] the fetch time."""
+    stale = []
+    for s in symbols:
+        if s not in cache:
+            continue
+        stock = cache[s]["data"]
+        stale.append(enrich_stock_data({
+            **stock,
+            "v": {**stock["v"], "stale": True,
+                  "as_of": datetime.fromtimestamp(cache[s]["timestamp"]).strftime("%d %b %H:%M")},
+        }))
+    record_cache("quotes", "served_stale")
+    return stale
+
+
+def update_quote_cache(cache, raw):
+    """Stores fresh raw quotes in the quote cache and returns them enriched."""
     cleaned = []
+    now = time.time()
     for stock in raw:
         if not isinstance(stock, dict) or "v" not in stock:
             continue
@@ -130,105 +207,261 @@ def get_database(symbols=None):
 
         cache[symbol] = {
             "data": stock,
-            "timestamp": time.time()
+            "timestamp": now
         }
 
         cleaned.append(enrich_stock_data(stock))
 
-    with open(cache_file, "w") as f:
+    # Write aside and swap in, so readers in other workers never see a half-written file.
+    path = quote_cache_file()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
         json.dump(cache, f)
+    os.replace(tmp_path, path)
+
+    for listener in QUOTE_LISTENERS:
+        try:
+            listener(cleaned)
+        except Exception:
+            quotes_log.exception("Quote listener failed", extra={"listener": listener.__name__})
 
     return cleaned
 
 
-def get_historic_data(symbol, range_key):
-    print("RANGE KEY RECEIVED:", range_key)
-    creds = get_fyers_credentials()
-    access_token = get_fyers_access_token()
-    if not access_token:
-        return {"s": "error", "candles": []}
+def get_database(symbols=None):
+    return get_database_snapshot(symbols)[0]
 
-    fyers = fyersModel.FyersModel(
-        client_id=creds["client_id"],
-        token=access_token,
-        is_async=False,
-        log_path=""
-    )
 
-    now = datetime.now()
+def get_database_snapshot(symbols=None):
+    """get_database() plus the snapshot_version() of the quotes it returned ((None, None) if not connected)."""
+    eq_list = symbols or get_equity_symbols()
+    fyers = None
+    if not replay_enabled():
+        try:
+            fyers = get_fyers_client()
+        except UpstreamUnavailable as e:
+            quotes_log.info("Token refresh unavailable, serving cache: %s", e, extra={"symbols": len(eq_list)})
+            cache = load_quote_cache()
+            return stale_quotes(cache, eq_list), snapshot_version(cache, eq_list, stale=True)
+        if fyers is None:
+            return None, None
 
-    days_map = {
-        "5D": 5,
-        "1M": 30,
-        "3M": 90,
-        "6M": 180,
-        "1Y": 365,
-        "3Y": 1095,
-        "5Y": 1825
-    }
+    cache = load_quote_cache()
 
-    total_days = days_map.get(range_key, 30)
+    if cache:
+        # Without symbols the whole universe is required, not just whatever happens to be cached.
+        since = quote_fresh_since()
+        if all(
+            s in cache and quote_is_fresh(cache[s], since)
+            for s in eq_list
+        ):
+            record_cache("quotes", "hit")
+            return [enrich_stock_data(cache[s]["data"]) for s in eq_list], snapshot_version(cache, eq_list)
+        record_cache("quotes", "stale" if any(s in cache for s in eq_list) else "miss")
+    else:
+        record_cache("quotes", "miss")
 
-    all_candles = []
-    end = now
+    try:
+        raw = fetch_quotes(eq_list, fyers)
+    except UpstreamUnavailable as e:
+        quotes_log.info("Quotes unavailable, serving cache: %s", e, extra={"symbols": len(eq_list)})
+        return stale_quotes(cache, eq_list), snapshot_version(cache, eq_list, stale=True)
+    return update_quote_cache(cache, raw), snapshot_version(cache, eq_list)
+
+
+HISTORY_DAYS = {
+    "5D": 5,
+    "1M": 30,
+    "3M": 90,
+    "6M": 180,
+    "1Y": 365,
+    "3Y": 1095,
+    "5Y": 1825
+}
+
+
+def history_payloads(symbol, range_key):
+    """Fyers history requests covering range_key, newest first, at most 365 days each."""
+    total_days = HISTORY_DAYS.get(range_key, 30)
+    end = datetime.now()
+    payloads = []
 
     while total_days > 0:
         chunk_days = min(365, total_days)
         start = end - timedelta(days=chunk_days)
 
-        payload = {
+        payloads.append({
             "symbol": symbol,
             "resolution": "1D",
             "date_format": "1",
             "range_from": start.strftime("%Y-%m-%d"),
             "range_to": end.strftime("%Y-%m-%d")
-        }
-
-        resp = fyers.history(payload)
-
-        if resp.get("s") != "ok":
-            print("FYERS HISTORY FAILED:", resp)
-            break
-
-        candles = resp.get("candles", [])
-        all_candles.extend(candles)
+        })
 
         # 🔥 critical fix
         end = start - timedelta(days=1)
         total_days -= chunk_days
+    return payloads
+
+
+def merge_candles(responses):
+    """Candles from consecutive history chunks, stopping at the first failed chunk."""
+    all_candles = []
+    for resp in responses:
+        if resp.get("s") != "ok":
+            history_log.warning("Fyers history chunk failed", extra={"response": resp})
+            break
+        all_candles.extend(resp.get("candles", []))
 
     # Deduplicate + sort
     unique = {c[0]: c for c in all_candles}
     merged = list(unique.values())
     merged.sort(key=lambda x: x[0])
-    print(len(merged))
+    return merged
+
+
+def history_cache_file(symbol):
+    return os.path.join(HISTORY_CACHE_DIR, symbol.replace(":", "_") + ".json")
+
+
+def save_history(symbol, candles):
+    """Merges fresh daily candles into the symbol's history cache."""
+    if not candles:
+        return
+    os.makedirs(HISTORY_CACHE_DIR, exist_ok=True)
+    path = history_cache_file(symbol)
+    known = {c[0]: c for c in load_cached_history(symbol)}
+    known.update((c[0], c) for c in candles)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(sorted(known.values()), f)
+    os.replace(tmp_path, path)
+
+
+def load_cached_history(symbol):
+    try:
+        with open(history_cache_file(symbol)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def load_history(symbol):
+    """Daily candles from the backfilled candle store, extended by newer ones from the history cache."""
+    stored = read_candles(symbol)
+    cached = load_cached_history(symbol)
+    if not len(stored):
+        return cached
+    last = stored["ts"][-1]
+    return stored.tolist() + [c for c in cached if c[0] > last]
+
+
+def history_fetched_at(symbol):
+    try:
+        cached_at = os.path.getmtime(history_cache_file(symbol))
+    except OSError:
+        cached_at = 0
+    return max(cached_at, stored_at(symbol))
+
+
+def cached_history(symbol, range_key):
+    """The range from the local candles if they were fetched recently enough (see market_calendar), else None."""
+    if history_fetched_at(symbol) < fresh_since(CANDLE_TTL):
+        return None
+    since = (datetime.now() - timedelta(days=HISTORY_DAYS.get(range_key, 30))).timestamp()
+    candles = load_history(symbol)
+    # The cache may hold a shorter range (e.g. 1M from the chart); allow for leading non-trading days.
+    if not candles or candles[0][0] > since + 7 * 86400:
+        return None
+    record_cache("history", "hit")
+    return {"s": "ok", "candles": [c for c in candles if c[0] >= since]}
+
+
+def stale_history(symbol, range_key):
+    """Cached candles covering range_key, flagged stale; what the chart shows while Fyers is down."""
+    since = (datetime.now() - timedelta(days=HISTORY_DAYS.get(range_key, 30))).timestamp()
+    candles = [c for c in load_history(symbol) if c[0] >= since]
+    record_cache("history", "served_stale")
+    return {"s": "ok", "candles": candles, "stale": True}
+
+
+def get_historic_data(symbol, range_key):
+    try:
+        fyers = get_fyers_client()
+    except UpstreamUnavailable as e:
+        history_log.info("Token refresh unavailable, serving cache: %s", e, extra={"symbol": symbol, "range": range_key})
+        return stale_history(symbol, range_key)
+    if fyers is None:
+        return {"s": "error", "candles": []}
+
+    cached = cached_history(symbol, range_key)
+    if cached is not None:
+        return cached
+
+    responses = []
+    try:
+        for payload in history_payloads(symbol, range_key):
+            resp = fyers_get("history", fyers.header, payload, "fyers_history")
+            responses.append(resp)
+            if resp.get("s") != "ok":
+                break
+    except UpstreamUnavailable as e:
+        history_log.info("History unavailable, serving cache: %s", e, extra={"symbol": symbol, "range": range_key})
+        return stale_history(symbol, range_key)
+
+    merged = merge_candles(responses)
+    save_history(symbol, merged)
+    history_log.debug("History fetched", extra={
+        "symbol": symbol, "range": range_key, "chunks": len(responses), "candles": len(merged),
+    })
     return {"s": "ok", "candles": merged}
 
 
 def get_name_map():
     global NAME_MAP
     if NAME_MAP is None:
+        import pandas as pd
         path = os.path.join(DATA_DIR, "NSE_EQ_names.csv")
         df = pd.read_csv(path)
         NAME_MAP = df.set_index("symbol")["name"].to_dict()
     return NAME_MAP
 
 
-def get_data(symbol):
-    access_token = get_fyers_access_token()
-    if not access_token:
+def cached_quote(symbol):
+    """The cached quote while the market is closed and it was fetched after the last close, else None."""
+    if replay_enabled() or market_state() != CLOSED:
+        return None
+    entry = load_quote_cache().get(symbol)
+    if entry is None or not quote_is_fresh(entry, quote_fresh_since()):
         return None
+    record_cache("quotes", "hit")
+    return enrich_stock_data(entry["data"])
 
-    creds = get_fyers_credentials()
-    fyers = fyersModel.FyersModel(
-        client_id=creds["client_id"],
-        token=access_token,
-        is_async=False,
-        log_path=""
-    )
 
-    response = fyers.quotes({"symbols": symbol})
-    data = response.get("d", [])
+def get_data(symbol):
+    fyers = None
+    if not replay_enabled():
+        try:
+            fyers = get_fyers_client()
+        except UpstreamUnavailable as e:
+            quotes_log.info("Token refresh unavailable, serving cache: %s", e, extra={"symbol": symbol})
+            stale = stale_quotes(load_quote_cache(), [symbol])
+            return stale[0] if stale else None
+        if fyers is None:
+            return None
+
+    # Trades while the market is open always use a live quote; after the close the cached one is final.
+    cached = cached_quote(symbol)
+    if cached is not None:
+        return cached
+
+    try:
+        data = fetch_quotes([symbol], fyers)
+    except UpstreamUnavailable as e:
+        quotes_log.info("Quote unavailable, serving cache: %s", e, extra={"symbol": symbol})
+        stale = stale_quotes(load_quote_cache(), [symbol])
+        return stale[0] if stale else None
 
     if not data:
         return None
@@ -236,27 +469,66 @@ def get_data(symbol):
     return enrich_stock_data(data[0])
 
 
+def market_data_available():
+    """Whether live (or replayed) prices can be fetched for the current user."""
+    return replay_enabled() or current_user.fyers_connected
+
+
+def news_cache_file(name):
+    return os.path.join(NEWS_CACHE_DIR, hashlib.sha1(name.encode()).hexdigest() + ".json")
+
+
+def cached_news(name):
+    """Search results cached for NEWS_TTL while the market is open and until the next open otherwise."""
+    try:
+        with open(news_cache_file(name)) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        record_cache("news", "miss")
+        return None
+    if entry["timestamp"] < fresh_since(NEWS_TTL):
+        record_cache("news", "stale")
+        return None
+    record_cache("news", "hit")
+    return entry["data"]
+
+
+def save_news(name, data):
+    os.makedirs(NEWS_CACHE_DIR, exist_ok=True)
+    path = news_cache_file(name)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"timestamp": time.time(), "data": data}, f)
+    os.replace(tmp_path, path)
+
+
 def search(name):
+    cached = cached_news(name)
+    if cached is not None:
+        return cached
     try:
-        key = decrypt(current_user.google_api_key)
-        cx = decrypt(current_user.cx)
+        key = get_secret("google_api_key")
+        cx = get_secret("cx")
     except Exception:
         return {"items": []}
     try:
-        response = requests.get(
-            "https://www.googleapis.com/customsearch/v1",
-            params={"key": key, "cx": cx, "q": name},
-            timeout=5
-        )
+        with upstream_call("google_cse") as call:
+            response = requests.get(
+                GOOGLE_CSE_URL,
+                params={"key": key, "cx": cx, "q": name},
+                timeout=5
+            )
+            call.set_http_response(response)
         response.raise_for_status()
-        return response.json()
+        data = response.json()
     except Exception:
         return {"items": []}
+    save_news(name, data)
+    return data
 
 
 def get_avg_price(stock):
     results = Transaction.query.filter(Transaction.user_id == current_user.user, Transaction.symbol == stock).all()
-    print(results)
     portfolio = {}
     for tx in results:
         symbol = tx.symbol
@@ -265,11 +537,18 @@ def get_avg_price(stock):
         portfolio[symbol]["total_cost"] -= tx.quantity * avg_cost
 
 
-def calculate_portfolio():
-    positions = {}
+def calculate_portfolio(user=None):
+    user = user or current_user.user
+    # Archived history is already folded into one carry-forward row per symbol.
+    positions = {
+        s.symbol: {"quantity": Decimal(s.quantity), "total_cost": Decimal(s.total_cost), "name": s.name}
+        for s in db.session.execute(
+            db.select(LedgerSummary).where(LedgerSummary.user_id == user)
+        ).scalars()
+    }
     txns = db.session.execute(
         db.select(Transaction)
-        .where(Transaction.user_id == current_user.user)
+        .where(Transaction.user_id == user)
         .order_by(Transaction.timestamp)
     ).scalars()
 
@@ -320,6 +599,8 @@ def get_price(symbol):
         return g.price_cache[symbol]
 
     data = get_data(symbol)  # your existing cached function
+    if data is None:
+        return None
     price = Decimal(str(data["v"]["lp"]))
     g.price_cache[symbol] = price
     return price
@@ -339,14 +620,18 @@ def get_prices_bulk(symbols):
     return price_map
 
 
-def get_quantity_held(symbol):
+def get_quantity_held(symbol, user=None):
+    user = user or current_user.user
     buys = db.session.query(
-        func.coalesce(func.sum(Transaction.quantity), 0)).filter( Transaction.user_id == current_user.user, Transaction.symbol == symbol, Transaction.type == "BUY").scalar()
+        func.coalesce(func.sum(Transaction.quantity), 0)).filter( Transaction.user_id == user, Transaction.symbol == symbol, Transaction.type == "BUY").scalar()
 
     sells = db.session.query(
-        func.coalesce(func.sum(Transaction.quantity), 0)).filter(Transaction.user_id == current_user.user, Transaction.symbol == symbol, Transaction.type == "SELL").scalar()
+        func.coalesce(func.sum(Transaction.quantity), 0)).filter(Transaction.user_id == user, Transaction.symbol == symbol, Transaction.type == "SELL").scalar()
+
+    archived = db.session.query(
+        func.coalesce(func.sum(LedgerSummary.quantity), 0)).filter(LedgerSummary.user_id == user, LedgerSummary.symbol == symbol).scalar()
 
-    return Decimal(buys) - Decimal(sells)
+    return Decimal(archived) + Decimal(buys) - Decimal(sells)
 
 # def get_stock_news(company_name):
 #     news_api_key = decrypt(current_user.news_api_key)
@@ -0,0 +1,254 @@
+import os, json, math, time
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from utils.models import db, Strategy, UserData
+from utils.stock_utils import get_database, calculate_portfolio, load_history
+from utils.orders import execute_order, commit_orders, OrderRejected
+from utils.market_calendar import market_state, OPEN
+from utils.replay import replay_enabled
+from utils.metrics import record_strategy_run
+from utils.logs import get_logger, pool_logging
+
+# Scheduled paper-trading strategies (flask run-strategies). Every STRATEGY_TICK_SECONDS during
+# market hours the runner:
+#   1. picks the active strategies whose interval has elapsed,
+#   2. takes ONE quote snapshot for all their symbols (stock_utils.get_database, so it also
+#      refreshes the shared quote cache, alerts and leaderboard),
+#   3. evaluates the strategies in a pool of STRATEGY_WORKERS processes; evaluation is a pure
+#      function of the snapshot, the user's holdings and the local daily candles,
+#   4. books the resulting orders through orders.execute_order (the /buy and /sell path) and
+#      commits the whole tick in one transaction.
+# Per-strategy latency, run and order counts are kept on the Strategy row and in Prometheus.
+STRATEGY_TICK_SECONDS = int(os.getenv("STRATEGY_TICK_SECONDS", "60"))
+STRATEGY_WORKERS = int(os.getenv("STRATEGY_WORKERS", "4"))
+IST_OFFSET = 19800
+
+KINDS = {"SMA_CROSS": "SMA crossover", "REBALANCE": "Rebalance to weights"}
+
+log = get_logger("strategies")
+
+
+# ---------- parameters ----------
+
+def parse_weights(spec):
+    """ "NSE:SBIN-EQ=0.6, NSE:ITC-EQ=0.4" -> {"NSE:SBIN-EQ": 0.6, "NSE:ITC-EQ": 0.4} """
+    weights = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        symbol, _, weight = part.partition("=")
+        try:
+            weights[symbol.strip().upper()] = float(weight)
+        except ValueError:
+            raise ValueError(f"Invalid weight for {symbol.strip()}: use SYMBOL=weight.") from None
+    return weights
+
+
+def strategy_params(kind, symbols, fast=None, slow=None, quantity=None, capital=None, band=None):
+    """Validated params for a new strategy. Raises ValueError with a message for the user."""
+    if kind == "SMA_CROSS":
+        symbol = symbols.strip().upper()
+        if not symbol or "," in symbol:
+            raise ValueError("An SMA crossover trades exactly one symbol.")
+        fast, slow = int(fast or 20), int(slow or 50)
+        if not 1 <= fast < slow:
+            raise ValueError("The fast average must be shorter than the slow one.")
+        if not quantity or quantity <= 0:
+            raise ValueError("Enter the quantity to hold while the fast average is above the slow one.")
+        return {"symbol": symbol, "fast": fast, "slow": slow, "quantity": float(quantity)}
+
+    weights = parse_weights(symbols)
+    if not weights or any(w <= 0 for w in weights.values()):
+        raise ValueError("List the target weights as SYMBOL=weight, e.g. NSE:SBIN-EQ=0.6, NSE:ITC-EQ=0.4.")
+    if sum(weights.values()) > 1 + 1e-9:
+        raise ValueError("Target weights add up to more than 1.")
+    if not capital or capital <= 0:
+        raise ValueError("Enter the capital to allocate across the weights.")
+    return {"weights": weights, "capital": float(capital), "band": float(band if band is not None else 5) / 100}
+
+
+def strategy_symbols(kind, params):
+    return [params["symbol"]] if kind == "SMA_CROSS" else list(params["weights"])
+
+
+def create_strategy(user, name, kind, params, interval_minutes):
+    strategy = Strategy(user_id=user, name=name, kind=kind, params=json.dumps(params),
+                        interval_minutes=interval_minutes)
+    db.session.add(strategy)
+    db.session.commit()
+    return strategy
+
+
+def user_strategy(user, strategy_id):
+    return db.session.execute(
+        db.select(Strategy).where(Strategy.id == strategy_id, Strategy.user_id == user)
+    ).scalar()
+
+
+# ---------- evaluation (runs in the worker pool) ----------
+
+def daily_closes(symbol, today):
+    """Closes of completed sessions from the local candles; today's partial candle is dropped."""
+    import numpy as np
+    return np.array([c[4] for c in load_history(symbol) if (c[0] + IST_OFFSET) // 86400 < today], dtype=float)
+
+
+def sma_cross_orders(params, prices, held, today):
+    """Hold `quantity` while SMA(fast) > SMA(slow) of the daily closes plus the live price, else nothing."""
+    import numpy as np
+    symbol = params["symbol"]
+    if symbol not in prices:
+        raise ValueError(f"no live price for {symbol}")
+    closes = np.append(daily_closes(symbol, today), prices[symbol])
+    if len(closes) < params["slow"]:
+        raise ValueError(f"{len(closes)} closes for {symbol}, the slow average needs {params['slow']}")
+    target = params["quantity"] if closes[-params["fast"]:].mean() > closes[-params["slow"]:].mean() else 0
+    diff = target - held.get(symbol, 0)
+    if diff >= 1:
+        return [("BUY", symbol, math.floor(diff))]
+    if diff <= -1:
+        return [("SELL", symbol, math.floor(-diff))]
+    return []
+
+
+def rebalance_orders(params, prices, held, today):
+    """
+    Whole-share orders that bring each symbol back to capital * weight, for symbols that drifted
+    more than `band` of their target value. Sells come first so they fund the buys.
+    """
+    capital, band = params["capital"], params["band"]
+    orders = []
+    for symbol, weight in params["weights"].items():
+        if symbol not in prices:
+            continue
+        price = prices[symbol]
+        target = math.floor(capital * weight / price)
+        diff = target - math.floor(held.get(symbol, 0))
+        if diff and abs(diff) * price > band * capital * weight:
+            orders.append(("BUY" if diff > 0 else "SELL", symbol, abs(diff)))
+    missing = [s for s in params["weights"] if s not in prices]
+    if missing and not orders:
+        raise ValueError(f"no live price for {', '.join(missing)}")
+    return sorted(orders, key=lambda o: o[0] != "SELL")
+
+
+EVALUATORS = {"SMA_CROSS": sma_cross_orders, "REBALANCE": rebalance_orders}
+
+
+def evaluate_strategy(task):
+    """Pool task: {"id", "kind", "params", "prices", "held", "today"} -> {"id", "orders", "ms", "error"}."""
+    started = time.perf_counter()
+    try:
+        orders = EVALUATORS[task["kind"]](task["params"], task["prices"], task["held"], task["today"])
+        error = None
+    except Exception as e:
+        orders, error = [], str(e)
+    return {"id": task["id"], "orders": orders, "ms": (time.perf_counter() - started) * 1000, "error": error}
+
+
+# ---------- the runner ----------
+
+def due_strategies(now):
+    strategies = db.session.execute(db.select(Strategy).where(Strategy.active.is_(True))).scalars().all()
+    return [
+        s for s in strategies
+        if s.last_run_at is None or now - s.last_run_at >= timedelta(minutes=s.interval_minutes) - timedelta(seconds=1)
+    ]
+
+
+def run_tick(pool=None, now=None):
+    """
+    Evaluates every due strategy against one quote snapshot and books the orders.
+    `pool` is an executor (None evaluates in-process). Returns {"strategies", "orders", "rejected"}.
+    """
+    now = now or datetime.now()
+    summary = {"strategies": 0, "orders": 0, "rejected": 0}
+    strategies = due_strategies(now)
+    if not strategies:
+        return summary
+
+    params = {s.id: json.loads(s.params) for s in strategies}
+    symbols = sorted({sym for s in strategies for sym in strategy_symbols(s.kind, params[s.id])})
+    # One snapshot for the whole tick. Stale quotes (broker down) are not traded on, as on /buy.
+    quotes = {q["v"]["symbol"]: q["v"] for q in get_database(symbols) or []}
+    prices = {sym: float(v["lp"]) for sym, v in quotes.items() if v.get("lp") and not v.get("stale")}
+    if not prices:
+        log.warning("No live quotes, skipping tick", extra={"strategies": len(strategies)})
+        return summary
+
+    users = {
+        u.user: u for u in db.session.execute(
+            db.select(UserData).where(UserData.user.in_({s.user_id for s in strategies}))
+        ).scalars()
+    }
+    positions = {user: {p["symbol"]: p for p in calculate_portfolio(user)} for user in users}
+    today = (int(now.timestamp()) + IST_OFFSET) // 86400
+    tasks = []
+    for s in strategies:
+        held = positions[s.user_id]
+        tasks.append({
+            "id": s.id, "kind": s.kind, "params": params[s.id], "today": today,
+            "prices": {sym: prices[sym] for sym in strategy_symbols(s.kind, params[s.id]) if sym in prices},
+            "held": {sym: float(held[sym]["quantity"]) for sym in strategy_symbols(s.kind, params[s.id]) if sym in held},
+        })
+    results = list(pool.map(evaluate_strategy, tasks, chunksize=max(1, len(tasks) // 64))) if pool \
+        else [evaluate_strategy(t) for t in tasks]
+
+    # Book per user, in strategy order, against the positions read above; one commit for the tick.
+    by_id = {s.id: s for s in strategies}
+    booked = []
+    for result in sorted(results, key=lambda r: (by_id[r["id"]].user_id, r["id"])):
+        strategy = by_id[result["id"]]
+        user, held = users[strategy.user_id], positions[strategy.user_id]
+        started = time.perf_counter()
+        placed, rejected, error = 0, 0, result["error"]
+        for side, symbol, qty in result["orders"]:
+            position = held.setdefault(symbol, {"quantity": Decimal("0"), "avg_price": Decimal("0")})
+            try:
+                booked.append(execute_order(user, side, symbol, quotes[symbol]["name"], qty, prices[symbol],
+                                            f"strategy: {strategy.name}"[:255], position))
+                placed += 1
+            except OrderRejected as e:
+                rejected += 1
+                error = f"{side} {qty} {symbol}: {e}"
+        latency_ms = result["ms"] + (time.perf_counter() - started) * 1000
+        strategy.last_run_at = now
+        strategy.runs += 1
+        strategy.orders += placed
+        strategy.last_latency_ms = latency_ms
+        strategy.last_error = error[:255] if error else None
+        record_strategy_run(strategy.kind, latency_ms / 1000, placed, rejected)
+        summary["orders"] += placed
+        summary["rejected"] += rejected
+    commit_orders(booked)
+    summary["strategies"] = len(strategies)
+    return summary
+
+
+def run_strategies(workers=STRATEGY_WORKERS, tick=STRATEGY_TICK_SECONDS, once=False, any_time=False,
+                   context=nullcontext):
+    """
+    The runner loop: a tick every `tick` seconds while the market is open (or always, with
+    any_time / in replay mode). once=True runs a single tick and returns its summary.
+    Each tick runs inside a new context() (main.job_context: fresh request context and session).
+    """
+    initializer, initargs = pool_logging()
+    pool = (ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+            if workers > 1 else None)
+    try:
+        while True:
+            summary = None
+            if any_time or replay_enabled() or market_state() == OPEN:
+                started = time.perf_counter()
+                with context():
+                    summary = run_tick(pool)
+                if summary["strategies"]:
+                    log.info("Strategy tick", extra={**summary, "ms": round((time.perf_counter() - started) * 1000, 1)})
+            if once:
+                return summary
+            time.sleep(tick - time.time() % tick)
+    finally:
+        if pool:
+            pool.shutdown()
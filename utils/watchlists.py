@@ -0,0 +1,96 @@
+import os, time
+from contextlib import nullcontext
+from sqlalchemy import case
+from utils.models import db, WatchlistItem, Transaction, LedgerSummary
+from utils.stock_utils import get_database, CACHE_TTL
+from utils.market_calendar import market_state, OPEN
+from utils.replay import replay_enabled
+from utils.logs import get_logger
+
+# Per-user watchlists. The /watchlist page asks get_database() for just the user's symbols, so a
+# view costs one cache lookup (or one small Fyers call) instead of the whole NSE_EQ_only.csv
+# universe behind /stocks.
+# The quote refresher (flask refresh-quotes) keeps the symbols people actually look at warm:
+# every QUOTE_REFRESH_SECONDS while the market is open it refreshes the union of all watchlisted
+# and held symbols, in batches of QUOTE_BATCH, so watchlist, portfolio and trade pages are cache
+# hits and alerts / the leaderboard see those symbols move first. The rest of the universe is
+# still fetched on demand by /stocks.
+WATCHLIST_MAX = int(os.getenv("WATCHLIST_MAX", "50"))
+# A little under CACHE_TTL: a pass that runs exactly one TTL after the last one finds many
+# entries not quite expired, skips them, and leaves them to the pass after (about 2x TTL).
+QUOTE_REFRESH_SECONDS = int(os.getenv("QUOTE_REFRESH_SECONDS", str(max(1, CACHE_TTL - 5))))
+QUOTE_BATCH = 50  # symbols per Fyers quotes request
+
+log = get_logger("quotes")
+
+
+def watchlist_symbols(user):
+    return db.session.execute(
+        db.select(WatchlistItem.symbol).where(WatchlistItem.user_id == user).order_by(WatchlistItem.added_at)
+    ).scalars().all()
+
+
+def add_to_watchlist(user, symbol):
+    """False if the symbol was already on the list. Raises ValueError when the list is full."""
+    if db.session.get(WatchlistItem, (user, symbol)) is not None:
+        return False
+    count = db.session.execute(
+        db.select(db.func.count()).select_from(WatchlistItem).where(WatchlistItem.user_id == user)
+    ).scalar()
+    if count >= WATCHLIST_MAX:
+        raise ValueError(f"A watchlist holds at most {WATCHLIST_MAX} symbols.")
+    db.session.add(WatchlistItem(user_id=user, symbol=symbol))
+    db.session.commit()
+    return True
+
+
+def remove_from_watchlist(user, symbol):
+    db.session.execute(
+        db.delete(WatchlistItem).where(WatchlistItem.user_id == user, WatchlistItem.symbol == symbol)
+    )
+    db.session.commit()
+
+
+def priority_symbols():
+    """
+    Every watchlisted symbol plus every symbol someone holds, sorted. Holdings come from the live
+    ledger and the archived carry-forward rows, so a position closed after archiving may linger.
+    """
+    watched = db.session.execute(db.select(WatchlistItem.symbol).distinct()).scalars()
+    signed = case((Transaction.type == "BUY", Transaction.quantity), else_=-Transaction.quantity)
+    held_live = db.session.execute(
+        db.select(Transaction.symbol)
+        .group_by(Transaction.user_id, Transaction.symbol)
+        .having(db.func.sum(signed) > 0)
+    ).scalars()
+    held_archived = db.session.execute(
+        db.select(LedgerSummary.symbol).where(LedgerSummary.quantity > 0).distinct()
+    ).scalars()
+    return sorted(set(watched) | set(held_live) | set(held_archived))
+
+
+def refresh_priority_quotes():
+    """One refresher pass; returns how many symbols it covered."""
+    symbols = priority_symbols()
+    for start in range(0, len(symbols), QUOTE_BATCH):
+        get_database(symbols[start:start + QUOTE_BATCH])
+    return len(symbols)
+
+
+def run_quote_refresher(every=QUOTE_REFRESH_SECONDS, once=False, any_time=False, context=nullcontext):
+    """
+    Refreshes the priority symbols every `every` seconds while the market is open (or always).
+    Each pass runs inside a new context() (main.job_context: fresh request context and session).
+    """
+    while True:
+        refreshed = None
+        if any_time or replay_enabled() or market_state() == OPEN:
+            started = time.perf_counter()
+            with context():
+                refreshed = refresh_priority_quotes()
+            log.info("Priority quotes refreshed", extra={
+                "symbols": refreshed, "ms": round((time.perf_counter() - started) * 1000, 1),
+            })
+        if once:
+            return refreshed
+        time.sleep(every - time.time() % every)